@@ -0,0 +1,337 @@
+import time, logging, gc
+from collections import defaultdict, deque
+# time.strptime imports this on first use, which fails if several threads make that first call at once
+import _strptime
+
+TIMESTAMP_FORMAT = '%Y%m%d%H%M%S'
+# How many accepted commands are kept for clients catching up, older clients are sent a snapshot instead
+DELTA_LOG_LENGTH = 10000
+# Which session a command came from and its sequence number in that session, for commands that did not come from one
+NO_ORIGIN = ('', 0)
+# Ordered before every command, for entities that have never been removed
+NEVER = (-1,)
+# The id of each entity added by an AddRange, from the range's idPrefix and the entity's row and col
+RANGE_ID_FORMAT = '%s%d,%d'
+# The most recently parsed whole second of a timestamp and its epoch ms, as bursts of messages share the same second.
+# It is replaced as a whole tuple, never changed in place, so threads sharing it always see a matching pair
+lastParsedSecond = (None, None)
+
+def parseTimestamp(timestamp):
+    """ Milliseconds since the epoch of a ClientSession timestamp, local time formatted as TIMESTAMP_FORMAT followed by
+    three digits of milliseconds. Timestamps that are already ints are returned as they are """
+    if isinstance(timestamp, (int, long)):
+        return timestamp
+    global lastParsedSecond
+    second = timestamp[:14]
+    parsedSecond, secondMs = lastParsedSecond
+    if parsedSecond != second:
+        secondMs = int(time.mktime(time.strptime(second, TIMESTAMP_FORMAT))) * 1000
+        lastParsedSecond = (second, secondMs)
+    return secondMs + int(timestamp[14:17] or 0)
+
+def getCurrentTimestamp():
+    return int(time.time() * 1000)
+
+def getOrigin(command):
+    """ The session a command came from and its sequence number there, which order commands with the same timestamp.
+    Timestamps are only to the millisecond, so this keeps commands a session sends within one in the order it sent
+    them, and breaks ties between sessions the same way on every server """
+    return (command.get('origin') or '', command.get('seq') or 0)
+
+def expandRange(command):
+    """ The id and position of each entity an AddRange command adds, in row-major order. An AddRange adds an entity at
+    every position within radius of center, each with an id made from idPrefix and its position, so the server and
+    every client expand it to the same entities from a single small message """
+    excludedIds = set(command.get('excludedIds', ()))
+    idPrefix = command['idPrefix']
+    radius = int(command['radius'])
+    centerRow, centerCol = int(command['center'][0]), int(command['center'][1])
+    for dRow in xrange(-radius, radius + 1):
+        row = centerRow + dRow
+        for col in xrange(centerCol + max(-radius, -dRow - radius), centerCol + min(radius, -dRow + radius) + 1):
+            id = RANGE_ID_FORMAT % (idPrefix, row, col)
+            if id not in excludedIds:
+                yield id, (row, col)
+
+class EntityState(object):
+    """ The current state of a tile or piece on the board """
+    __slots__ = ('target', 'id', 'tilePosition', 'data', 'created', 'modified', 'createdBy', 'modifiedBy')
+
+    def __init__(self, target, id, tilePosition, data, created, modified, createdBy=NO_ORIGIN):
+        self.target = target
+        self.id = id
+        self.tilePosition = tilePosition
+        self.data = data
+        self.created = created
+        self.modified = modified
+        # The origin of the commands that created and last changed it, as given by getOrigin
+        self.createdBy = createdBy
+        self.modifiedBy = createdBy
+
+    def getCreatedOrder(self):
+        return (self.created,) + self.createdBy
+
+    def getModifiedOrder(self):
+        return (self.modified,) + self.modifiedBy
+
+    def toSnapshotEntry(self):
+        return [self.id, self.tilePosition[0], self.tilePosition[1], self.data, self.created, self.modified]
+
+    def toCommand(self):
+        """ The Add command that would create this entity """
+        command = {'type': 'Add', 'target': self.target, 'id': self.id, 'tilePosition': list(self.tilePosition),
+                   'created': self.created, 'modified': self.modified, 'origin': self.createdBy[0],
+                   'seq': self.createdBy[1]}
+        if self.data is not None:
+            command['data'] = self.data
+        return command
+
+    def toMoveCommand(self):
+        """ The Move command that last changed this entity """
+        return {'type': 'Move', 'target': self.target, 'id': self.id, 'tilePosition': list(self.tilePosition),
+                'modified': self.modified, 'origin': self.modifiedBy[0], 'seq': self.modifiedBy[1]}
+
+class GameStateStore(object):
+    """ The authoritative state of the board. Commands are applied in timestamp order with the last writer winning,
+    ties broken by getOrigin, and stale or duplicate commands are rejected so they are never relayed """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.entities = dict()
+        self.idsAt = defaultdict(set)
+        self.targets = set()
+        # When and by whom each removed entity was removed, so a stale Add arriving after its Remove is not resurrected
+        self.removedAt = dict()
+        # Incremented for every accepted command, which are kept in the delta log tagged with the version they created
+        self.version = 0
+        self.deltaLog = deque(maxlen=DELTA_LOG_LENGTH)
+        self.cachedSnapshot = None
+
+    def apply(self, command):
+        """ Apply an Add, AddRange, Remove or Move command, returning it with its timestamps as epoch ms if it was accepted or
+        None if it was stale or not a state change """
+        commandType = command.get('type')
+        key = (command.get('target'), command.get('id'))
+        modified = parseTimestamp(command.get('modified', command.get('timestamp', getCurrentTimestamp())))
+        created = parseTimestamp(command.get('created', modified))
+        if commandType == 'AddRange':
+            return self.applyRange(command, created, modified)
+        existing = self.entities.get(key)
+        origin = getOrigin(command)
+        if commandType == 'Add':
+            createdOrder = (created,) + origin
+            if existing is not None and existing.getCreatedOrder() >= createdOrder or \
+                    self.removedAt.get(key, NEVER) >= createdOrder:
+                return None
+            if existing is not None:
+                self.removeEntity(existing)
+            self.addEntity(EntityState(key[0], key[1], self.toPosition(command['tilePosition']), command.get('data'),
+                                       created, modified, origin))
+        elif commandType == 'Remove':
+            removedOrder = (modified,) + origin
+            if existing is None or existing.getCreatedOrder() > removedOrder:
+                return None
+            self.removeEntity(existing)
+            self.removedAt[key] = removedOrder
+        elif commandType == 'Move':
+            if existing is None or existing.getModifiedOrder() >= (modified,) + origin:
+                return None
+            self.moveEntity(existing, self.toPosition(command['tilePosition']), modified, origin)
+        else:
+            logging.warning("Ignoring unknown command %s", command)
+            return None
+        accepted = dict(command)
+        accepted.pop('timestamp', None)
+        accepted['modified'] = modified
+        if commandType == 'Add':
+            accepted['created'] = created
+        return self.recordAccepted(accepted)
+
+    def applyRange(self, command, created, modified):
+        """ Apply an AddRange as an Add of each entity in it. Entities removed after the range was created stay removed,
+        and are listed in the accepted command's excludedIds so clients skip them too """
+        excludedIds = list(command.get('excludedIds', ()))
+        # A range can add a whole board at once, so the cyclic garbage collector is paused rather than left to scan the
+        # growing state again and again as the entities are created
+        gcWasEnabled = gc.isenabled()
+        gc.disable()
+        try:
+            numAdded = self.addRangeEntities(command, created, modified, excludedIds)
+        finally:
+            if gcWasEnabled:
+                gc.enable()
+        if not numAdded:
+            return None
+        accepted = dict(command)
+        accepted.pop('timestamp', None)
+        accepted['created'] = created
+        accepted['modified'] = modified
+        if excludedIds:
+            accepted['excludedIds'] = excludedIds
+        return self.recordAccepted(accepted)
+
+    def addRangeEntities(self, command, created, modified, excludedIds):
+        """ Add the entities of an AddRange that are not stale, appending those that stay removed to excludedIds and
+        returning how many were added. Adding to an empty position is done inline as there can be so many """
+        target = command.get('target')
+        data = command.get('data')
+        origin = getOrigin(command)
+        createdOrder = (created,) + origin
+        entities, idsAt, removedAt = self.entities, self.idsAt, self.removedAt
+        self.targets.add(target)
+        numAdded = 0
+        for id, tilePosition in expandRange(command):
+            key = (target, id)
+            existing = entities.get(key)
+            if existing is not None and existing.getCreatedOrder() >= createdOrder:
+                continue
+            if key in removedAt and removedAt[key] >= createdOrder:
+                excludedIds.append(id)
+                continue
+            if existing is not None:
+                self.removeEntity(existing)
+            entities[key] = EntityState(target, id, tilePosition, data, created, modified, origin)
+            positionKey = (target, tilePosition)
+            if positionKey in idsAt:
+                idsAt[positionKey].add(id)
+            else:
+                idsAt[positionKey] = set((id,))
+            numAdded += 1
+        return numAdded
+
+    def mirror(self, command):
+        """ Bring an entity into line with an Add, Remove or Move that another server has already accepted, without
+        checking it is newer, versioning it or keeping it in the delta log. For entities kept only to show to clients
+        while another server decides their commands """
+        key = (command['target'], command['id'])
+        existing = self.entities.get(key)
+        commandType = command['type']
+        if commandType == 'Add':
+            if existing is not None:
+                self.removeEntity(existing)
+            self.addEntity(EntityState(key[0], key[1], self.toPosition(command['tilePosition']), command.get('data'),
+                                       command['created'], command['modified'], getOrigin(command)))
+        elif existing is None:
+            return
+        elif commandType == 'Remove':
+            self.removeEntity(existing)
+        else:
+            self.moveEntity(existing, self.toPosition(command['tilePosition']), command['modified'],
+                            getOrigin(command))
+        self.cachedSnapshot = None
+
+    def recordAccepted(self, accepted):
+        """ Give an accepted command the next version and keep it in the delta log """
+        self.version += 1
+        accepted['version'] = self.version
+        self.deltaLog.append(accepted)
+        return accepted
+
+    def applyAll(self, commands):
+        return [accepted for accepted in (self.apply(command) for command in commands) if accepted is not None]
+
+    def toPosition(self, tilePosition):
+        return (int(tilePosition[0]), int(tilePosition[1]))
+
+    def addEntity(self, entity):
+        self.targets.add(entity.target)
+        self.entities[(entity.target, entity.id)] = entity
+        self.idsAt[(entity.target, entity.tilePosition)].add(entity.id)
+
+    def removeEntity(self, entity):
+        del self.entities[(entity.target, entity.id)]
+        self.discardFromPosition(entity)
+
+    def moveEntity(self, entity, tilePosition, modified, modifiedBy=NO_ORIGIN):
+        self.discardFromPosition(entity)
+        entity.tilePosition = tilePosition
+        entity.modified = modified
+        entity.modifiedBy = modifiedBy
+        self.idsAt[(entity.target, tilePosition)].add(entity.id)
+
+    def discardFromPosition(self, entity):
+        positionKey = (entity.target, entity.tilePosition)
+        ids = self.idsAt[positionKey]
+        ids.discard(entity.id)
+        if not ids:
+            del self.idsAt[positionKey]
+
+    def getEntity(self, target, id):
+        return self.entities.get((target, id))
+
+    def getIdsAt(self, target, tilePosition):
+        return self.idsAt.get((target, self.toPosition(tilePosition)), set())
+
+    def getEntitiesAt(self, tilePosition):
+        """ Every entity of any target at the position """
+        tilePosition = self.toPosition(tilePosition)
+        return [self.entities[(target, id)] for target in self.targets
+                                            for id in self.idsAt.get((target, tilePosition), ())]
+
+    def getEntities(self, target=None):
+        return [entity for entity in self.entities.itervalues() if target is None or entity.target == target]
+
+    def getSnapshot(self, tilePositions=None):
+        """ A single message holding every entity on the board, or only those at tilePositions if given, and the
+        version it is current as of. The whole board snapshot is built at most once per version, so many clients
+        joining together share it """
+        if tilePositions is not None:
+            entities = [entity for tilePosition in tilePositions for entity in self.getEntitiesAt(tilePosition)]
+            return self.buildSnapshot(entities)
+        if self.cachedSnapshot is None or self.cachedSnapshot['version'] != self.version:
+            self.cachedSnapshot = self.buildSnapshot(self.entities.itervalues())
+        return self.cachedSnapshot
+
+    def buildSnapshot(self, entities):
+        # Every target is listed, even with no entities, as clients replace all they hold for each target listed
+        entitiesByTarget = dict((target, []) for target in self.targets)
+        for entity in entities:
+            entitiesByTarget[entity.target].append(entity.toSnapshotEntry())
+        return {'type': 'Snapshot', 'version': self.version, 'entities': entitiesByTarget}
+
+    def getCompactedCommands(self, entities=None):
+        """ The fewest commands that rebuild the current state, an Add for each entity followed by a Move for those
+        changed since, and a Remove for each entity that has been removed so it is never resurrected by a stale Add.
+        Only the given entities are included if there are any """
+        commands = []
+        for entity in (entities if entities is not None else self.entities.itervalues()):
+            commands.append(entity.toCommand())
+            if entity.modifiedBy != entity.createdBy:
+                commands.append(entity.toMoveCommand())
+        commands.extend({'type': 'Remove', 'target': target, 'id': id, 'modified': modified, 'origin': origin,
+                         'seq': seq} for (target, id), (modified, origin, seq) in self.removedAt.iteritems())
+        return commands
+
+    def restore(self, version, commands):
+        """ Replace the state with that given by getCompactedCommands at version """
+        self.clear()
+        gcWasEnabled = gc.isenabled()
+        gc.disable()
+        try:
+            for command in commands:
+                key = (command['target'], command['id'])
+                if command['type'] == 'Remove':
+                    self.removedAt[key] = (command['modified'],) + getOrigin(command)
+                elif command['type'] == 'Move':
+                    entity = self.entities[key]
+                    entity.modified = command['modified']
+                    entity.modifiedBy = getOrigin(command)
+                else:
+                    self.addEntity(EntityState(key[0], key[1], self.toPosition(command['tilePosition']),
+                                               command.get('data'), command['created'], command['modified'],
+                                               getOrigin(command)))
+        finally:
+            if gcWasEnabled:
+                gc.enable()
+        self.version = version
+
+    def getChangesSince(self, version):
+        """ The accepted commands after version in the order they were applied, or None if some are no longer in the
+        delta log and a snapshot is needed instead """
+        if version is None or version > self.version:
+            return None
+        numChanges = self.version - version
+        if numChanges > len(self.deltaLog):
+            return None
+        return list(self.deltaLog)[len(self.deltaLog) - numChanges:]
@@ -0,0 +1,100 @@
+from collections import defaultdict
+
+# Tiles are grouped into square buckets of axial coordinates this many tiles across
+BUCKET_SIZE = 8
+
+def hexDistance(position1, position2):
+    dRow = position1[0] - position2[0]
+    dCol = position1[1] - position2[1]
+    return (abs(dRow) + abs(dCol) + abs(dRow + dCol)) // 2
+
+def getSectorOf(position, numSectors=6):
+    """ Which of the six wedges of the board between its spokes the position is in, each wedge including the spoke on
+    its clockwise side and the center in the first. Fewer than six sectors are made from neighbouring wedges """
+    row, col = position
+    x, y, z = col, -col - row, row
+    if x > 0 and z >= 0:
+        wedge = 0
+    elif x <= 0 and y < 0:
+        wedge = 1
+    elif y >= 0 and z > 0:
+        wedge = 2
+    elif z <= 0 and x < 0:
+        wedge = 3
+    elif x >= 0 and y > 0:
+        wedge = 4
+    elif y <= 0 and z < 0:
+        wedge = 5
+    else:
+        wedge = 0
+    return wedge * numSectors // 6
+
+def getBucketOf(position):
+    return (position[0] // BUCKET_SIZE, position[1] // BUCKET_SIZE)
+
+def getPositionsWithin(radius, center):
+    """ Every position within radius of center, as in HexCoordSys.getTilesWithin but on plain row, col tuples """
+    row, col = center
+    return [(row + dRow, col + dCol) for dRow in range(-radius, radius + 1)
+                                     for dCol in range(max(-radius, -dRow - radius), min(radius, -dRow + radius) + 1)]
+
+class InterestRegion(object):
+    """ The hex of tiles within radius of center that a client wants updates for """
+    __slots__ = ('center', 'radius')
+
+    def __init__(self, center, radius):
+        self.center = (int(center[0]), int(center[1]))
+        self.radius = int(radius)
+
+    def contains(self, position):
+        return hexDistance(self.center, position) <= self.radius
+
+    def getBuckets(self):
+        """ Every bucket the region overlaps. The hex's bounding box in axial coordinates is a parallelogram, so this
+        is a superset and membership is still checked exactly against the region """
+        row, col = self.center
+        lowRow, lowCol = getBucketOf((row - self.radius, col - self.radius))
+        highRow, highCol = getBucketOf((row + self.radius, col + self.radius))
+        return [(bucketRow, bucketCol) for bucketRow in range(lowRow, highRow + 1)
+                                       for bucketCol in range(lowCol, highCol + 1)]
+
+    def getPositions(self):
+        return getPositionsWithin(self.radius, self.center)
+
+class InterestIndex(object):
+    """ The regions of the board each client is interested in, indexed by bucket so finding the clients interested in a
+    position only checks the regions near it. Clients without a region are interested in everything """
+    def __init__(self):
+        self.regions = dict()
+        self.uidsInBucket = defaultdict(set)
+
+    def setRegion(self, uid, region):
+        """ Set the region for uid, returning the region it replaces or None """
+        previous = self.removeRegion(uid)
+        self.regions[uid] = region
+        for bucket in region.getBuckets():
+            self.uidsInBucket[bucket].add(uid)
+        return previous
+
+    def removeRegion(self, uid):
+        region = self.regions.pop(uid, None)
+        if region is not None:
+            for bucket in region.getBuckets():
+                uids = self.uidsInBucket[bucket]
+                uids.discard(uid)
+                if not uids:
+                    del self.uidsInBucket[bucket]
+        return region
+
+    def getRegion(self, uid):
+        return self.regions.get(uid)
+
+    def hasRegion(self, uid):
+        return uid in self.regions
+
+    def getInterestedIn(self, position):
+        """ The uids with a region containing position """
+        if position is None:
+            return set()
+        return set(uid for uid in self.uidsInBucket.get(getBucketOf(position), ())
+                   if self.regions[uid].contains(position))
@@ -0,0 +1,115 @@
+import os, mmap, struct, time, logging
+from Session import frame_msg, HEADER_LENGTH
+from WireCodec import encodeMessage, decodeMessage, BINARY_CODEC
+
+JOURNAL_DIRECTORY = 'journal'
+LOG_FILE_NAME = 'commands.log'
+SNAPSHOT_FILE_NAME = 'snapshot.bin'
+# Writes to the log are buffered, and the buffer is written out at least this often while the server is running
+FLUSH_INTERVAL_SEC = 0.1
+LOG_BUFFER_SIZE = 1 << 16
+# A snapshot is written and the log truncated after this many commands, so a restart never replays more than this
+COMMANDS_PER_SNAPSHOT = 50000
+
+class Journal(object):
+    """ Keeps the game state on disk so it survives the server restarting. Each batch of accepted commands is appended
+    to a log as a binary message, and every COMMANDS_PER_SNAPSHOT commands the whole state is written as a compacted
+    snapshot and the log truncated. Restoring reads the snapshot and replays only the commands logged after it """
+    def __init__(self, directory=JOURNAL_DIRECTORY):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.logPath = os.path.join(directory, LOG_FILE_NAME)
+        self.snapshotPath = os.path.join(directory, SNAPSHOT_FILE_NAME)
+        self.log = None
+        self.numLogged = 0
+        self.lastFlushTime = time.time()
+
+    def hasState(self):
+        return os.path.exists(self.snapshotPath) or os.path.exists(self.logPath)
+
+    def restore(self, gameState):
+        """ Rebuild gameState from the latest snapshot and the commands logged since, then open the log for appending.
+        A command only partly written when the server stopped is discarded """
+        if os.path.exists(self.snapshotPath) and os.path.getsize(self.snapshotPath):
+            with open(self.snapshotPath, 'rb') as snapshotFile:
+                snapshot = mmap.mmap(snapshotFile.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    commands = decodeMessage(snapshot)
+                finally:
+                    snapshot.close()
+            # The first record holds the version the snapshot was taken at
+            gameState.restore(commands[0]['version'], commands[1:])
+        snapshotVersion = gameState.version
+        validLength = 0
+        if os.path.exists(self.logPath):
+            with open(self.logPath, 'rb') as logFile:
+                log = logFile.read()
+            for payload, end in iterFrames(log):
+                for command in decodeMessage(payload):
+                    # Commands before the snapshot remain if the server stopped between writing it and truncating
+                    if command['version'] > snapshotVersion:
+                        gameState.apply(command)
+                    self.numLogged += 1
+                validLength = end
+            if validLength < len(log):
+                logging.warning("Discarding %d bytes of partly written commands", len(log) - validLength)
+        logging.info("Restored state at version %s from %s, replaying %d logged commands", gameState.version,
+                     self.directory, self.numLogged)
+        self.openLog(validLength)
+
+    def openLog(self, length=0):
+        self.log = open(self.logPath, 'ab' if length else 'wb', LOG_BUFFER_SIZE)
+        self.log.truncate(length)
+
+    def append(self, commands):
+        """ Log a batch of accepted commands. They reach the disk on the next flush """
+        if self.log is None:
+            self.openLog()
+        self.log.write(frame_msg(encodeMessage(commands, BINARY_CODEC)))
+        self.numLogged += len(commands)
+
+    def isSnapshotDue(self):
+        return self.numLogged >= COMMANDS_PER_SNAPSHOT
+
+    def flushIfDue(self):
+        if time.time() - self.lastFlushTime >= FLUSH_INTERVAL_SEC:
+            self.flush()
+
+    def flush(self):
+        self.lastFlushTime = time.time()
+        if self.log is not None:
+            self.log.flush()
+
+    def writeSnapshot(self, gameState):
+        """ Write the whole state of gameState as a snapshot and truncate the log. The snapshot is written beside the
+        old one and renamed over it, so there is always a complete snapshot to restore from """
+        startTime = time.time()
+        commands = [{'type': 'Snapshot', 'version': gameState.version}] + gameState.getCompactedCommands()
+        tempPath = self.snapshotPath + '.tmp'
+        with open(tempPath, 'wb') as snapshotFile:
+            snapshotFile.write(encodeMessage(commands, BINARY_CODEC))
+            snapshotFile.flush()
+            os.fsync(snapshotFile.fileno())
+        os.rename(tempPath, self.snapshotPath)
+        if self.log is not None:
+            self.log.close()
+        self.openLog()
+        self.numLogged = 0
+        logging.info("Wrote snapshot at version %s with %d commands in %.3fs", gameState.version, len(commands) - 1,
+                     time.time() - startTime)
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+def iterFrames(data):
+    """ Each complete length prefixed message in data and the offset it ends at """
+    offset = 0
+    while len(data) - offset >= HEADER_LENGTH:
+        end = offset + HEADER_LENGTH + struct.unpack_from('>I', data, offset)[0]
+        if end > len(data):
+            return
+        yield data[offset + HEADER_LENGTH:end], end
+        offset = end
@@ -0,0 +1,125 @@
+import time
+
+# Histogram buckets double in size from 1 microsecond, values beyond the last bucket are counted in it
+NUM_BUCKETS = 32
+PERCENTILES = (50, 90, 99)
+
+class Histogram(object):
+    """ A count of durations in buckets that double in size, cheap enough to record one for every message. Percentiles
+    are given as the upper bound of the bucket they fall in, so are within a factor of two """
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * NUM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[min(int(seconds * 1000000).bit_length(), NUM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def getPercentile(self, percentile):
+        """ The upper bound in seconds of the bucket the percentile falls in """
+        remaining = self.count * percentile / 100.0
+        for bucket, count in enumerate(self.counts):
+            remaining -= count
+            if remaining <= 0:
+                return min((1 << bucket) / 1000000.0, self.max)
+        return self.max
+
+    def toDict(self):
+        stats = {'count': self.count, 'meanMs': 1000 * self.total / self.count if self.count else 0,
+                 'maxMs': 1000 * self.max}
+        for percentile in PERCENTILES:
+            stats['p%dMs' % percentile] = 1000 * self.getPercentile(percentile) if self.count else 0
+        return stats
+
+class ConnectionMetrics(object):
+    """ Counts of what has gone in and out of one connection, which are also added to the totals of a parent """
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.messagesIn = 0
+        self.messagesOut = 0
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.dataItemsIn = 0
+        self.decodeTime = Histogram()
+        self.encodeTime = Histogram()
+        # The most bytes waiting to be written to the socket at once, and how often writing had to wait for it
+        self.peakBacklogBytes = 0
+        self.blockedWrites = 0
+        # Data items dropped as superseded while the client was backed up
+        self.coalescedDataItems = 0
+
+    def recordIn(self, numMessages, numBytes, numDataItems, decodeSec):
+        self.messagesIn += numMessages
+        self.bytesIn += numBytes
+        self.dataItemsIn += numDataItems
+        if numMessages:
+            self.decodeTime.record(decodeSec)
+        if self.parent is not None:
+            self.parent.recordIn(numMessages, numBytes, numDataItems, decodeSec)
+
+    def recordOut(self, numBytes):
+        self.messagesOut += 1
+        self.bytesOut += numBytes
+        if self.parent is not None:
+            self.parent.recordOut(numBytes)
+
+    def recordEncode(self, encodeSec):
+        self.encodeTime.record(encodeSec)
+        if self.parent is not None:
+            self.parent.recordEncode(encodeSec)
+
+    def recordCoalesced(self, numDataItems):
+        self.coalescedDataItems += numDataItems
+        if self.parent is not None:
+            self.parent.recordCoalesced(numDataItems)
+
+    def recordBacklog(self, backlogBytes):
+        if backlogBytes:
+            self.blockedWrites += 1
+            self.peakBacklogBytes = max(self.peakBacklogBytes, backlogBytes)
+            if self.parent is not None:
+                self.parent.recordBacklog(backlogBytes)
+
+    def toDict(self):
+        return {'messagesIn': self.messagesIn, 'messagesOut': self.messagesOut, 'bytesIn': self.bytesIn,
+                'bytesOut': self.bytesOut, 'dataItemsIn': self.dataItemsIn, 'decodeTime': self.decodeTime.toDict(),
+                'encodeTime': self.encodeTime.toDict(), 'peakBacklogBytes': self.peakBacklogBytes,
+                'blockedWrites': self.blockedWrites, 'coalescedDataItems': self.coalescedDataItems}
+
+class ServerMetrics(object):
+    """ Server wide totals of every connection, and how long relaying changes takes """
+    def __init__(self):
+        self.startTime = time.time()
+        self.totals = ConnectionMetrics()
+        # From a change being read to it being written to each client it is relayed to
+        self.relayLatency = Histogram()
+        self.connectionsAccepted = 0
+        self.commandsAccepted = 0
+        self.commandsRejected = 0
+        self.slowConsumerDisconnects = 0
+
+    def createConnectionMetrics(self):
+        self.connectionsAccepted += 1
+        return ConnectionMetrics(self.totals)
+
+    def toDict(self, connections):
+        """ The server's metrics and those of each of its open connections, by uid or by address for connections that
+        have not yet identified themselves """
+        sessions = dict()
+        for connection in connections:
+            stats = connection.metrics.toDict()
+            stats['backlogBytes'] = connection.getBacklogBytes()
+            stats['heldDataItems'] = len(connection.heldData)
+            sessions[connection.uid or '%s:%s' % connection.address] = stats
+        return {'uptimeSec': time.time() - self.startTime, 'connectionsAccepted': self.connectionsAccepted,
+                'openConnections': len(sessions), 'commandsAccepted': self.commandsAccepted,
+                'commandsRejected': self.commandsRejected, 'slowConsumerDisconnects': self.slowConsumerDisconnects,
+                'relayLatency': self.relayLatency.toDict(),
+                'totals': self.totals.toDict(), 'sessions': sessions}
@@ -1,67 +1,486 @@
-import sys, logging, socket, time, threading, json, uuid
-from Session import Session, ServerSession
+import sys, time, logging, socket, select, json
+from Session import ClientConnection, createListenSocket, coalesceMessages, RETRY_ERRNOS, COMMAND_TYPES
+from WireCodec import chooseCodec, encodeMessage
+from GameState import GameStateStore, getCurrentTimestamp
+from Interest import InterestIndex, InterestRegion
+from Journal import Journal, JOURNAL_DIRECTORY
+from Metrics import ServerMetrics
+
+PORT = 12344
+# Connecting to this port on the server's host gets the server's metrics as JSON
+STATS_PORT = 12345
+# How long a stats connection has to take the metrics before it is dropped
+STATS_SEND_TIMEOUT_SEC = 1
+# How often the loop wakes with no socket activity to check if it should stop
+POLL_TIMEOUT_SEC = 1
+# How often every backed up client is checked for being too slow, as those no longer sent anything are not otherwise
+SLOW_CONSUMER_CHECK_SEC = 1
+
+class EventPoller(object):
+    """ Waits for any of many sockets to be ready, using epoll where the platform has it and select otherwise """
+    READ = 1
+    WRITE = 2
 
-class Server:
     def __init__(self):
-        self.session = ServerSession()
+        self.epoll = select.epoll() if hasattr(select, 'epoll') else None
+        self.readers = set()
+        self.writers = set()
+
+    def register(self, fileno, events):
+        if self.epoll is not None:
+            self.epoll.register(fileno, self.toEpollMask(events))
+        self.updateSelectSets(fileno, events)
+
+    def modify(self, fileno, events):
+        if self.epoll is not None:
+            self.epoll.modify(fileno, self.toEpollMask(events))
+        self.updateSelectSets(fileno, events)
+
+    def unregister(self, fileno):
+        if self.epoll is not None:
+            self.epoll.unregister(fileno)
+        self.readers.discard(fileno)
+        self.writers.discard(fileno)
+
+    def poll(self, timeout):
+        """ A list of (fileno, events) for each registered socket that is ready, waiting up to timeout seconds """
+        if self.epoll is not None:
+            ready = []
+            for fileno, epollMask in self.epoll.poll(timeout):
+                events = 0
+                # Report errors and hang ups as readable, the following read will find the failure
+                if epollMask & (select.EPOLLIN | select.EPOLLERR | select.EPOLLHUP):
+                    events |= self.READ
+                if epollMask & select.EPOLLOUT:
+                    events |= self.WRITE
+                ready.append((fileno, events))
+            return ready
+        readable, writable, _ = select.select(self.readers, self.writers, [], timeout)
+        ready = dict((fileno, self.READ) for fileno in readable)
+        for fileno in writable:
+            ready[fileno] = ready.get(fileno, 0) | self.WRITE
+        return ready.items()
+
+    def toEpollMask(self, events):
+        return (select.EPOLLIN if events & self.READ else 0) | (select.EPOLLOUT if events & self.WRITE else 0)
+
+    def updateSelectSets(self, fileno, events):
+        for eventSet, event in ((self.readers, self.READ), (self.writers, self.WRITE)):
+            if events & event:
+                eventSet.add(fileno)
+            else:
+                eventSet.discard(fileno)
+
+class StatsConnection(object):
+    """ A local connection being written the metrics without blocking, so a slow reader does not hold up the clients """
+    def __init__(self, statsSocket, payload):
+        statsSocket.setblocking(0)
+        self.socket = statsSocket
+        self.payload = payload
+        self.sentOffset = 0
+        self.deadline = time.time() + STATS_SEND_TIMEOUT_SEC
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def sendPendingData(self):
+        """ Write as much of the metrics as the socket will take, returning True once all of them have been written.
+        Raises socket.error if the connection has failed """
+        while self.sentOffset < len(self.payload):
+            try:
+                self.sentOffset += self.socket.send(buffer(self.payload, self.sentOffset))
+            except socket.error as e:
+                if e.args[0] in RETRY_ERRNOS:
+                    return False
+                raise
+        return True
+
+    def isTimedOut(self):
+        return time.time() > self.deadline
+
+class Server:
+    """ Relays data between clients, multiplexing every socket on a single thread """
+    def __init__(self, host=None, port=PORT, configFile='server.config', journalDirectory=JOURNAL_DIRECTORY,
+                 statsPort=STATS_PORT):
+        self.metrics = ServerMetrics()
+        self.gameState = self.createGameState()
+        self.interest = InterestIndex()
+        # The state is restored from the journal if there is one, otherwise the game starts from the config
+        self.journal = Journal(journalDirectory) if journalDirectory is not None else None
+        if self.journal is not None and self.journal.hasState():
+            self.journal.restore(self.gameState)
+        else:
+            with open(configFile) as config:
+                self.logAccepted(self.gameState.applyAll(json.load(config)["startCommands"]))
+        self.poller = EventPoller()
+        # Without a port the server only serves the connections it is given
+        self.listenSocket = None
+        if port is not None:
+            self.listenSocket = createListenSocket(host if host is not None else socket.gethostname(), port)
+            self.poller.register(self.listenSocket.fileno(), EventPoller.READ)
+        # Only local connections are given the metrics
+        self.statsListenSocket = createListenSocket('127.0.0.1', statsPort) if statsPort is not None else None
+        if self.statsListenSocket is not None:
+            self.poller.register(self.statsListenSocket.fileno(), EventPoller.READ)
+        # All open connections by socket fileno, and those that have identified themselves by uid
+        self.connections = dict()
         self.clientSessions = dict()
+        # Stats connections still being written the metrics by socket fileno
+        self.statsConnections = dict()
+        self.lastSlowConsumerCheckTime = time.time()
         self.running = True
 
-    def acceptConnectionLoop(self):
-        while self.running:
-            data = self.session.getUnreadDataQueue()
-            newConnectionSocket, newConnectionUid = data.get() # Blocking call
-            logging.info('Connection from new client %s', newConnectionUid)
-            # Replace any existing session with this uid
-            self.clientSessions[newConnectionUid] = Session(newConnectionSocket)
-        logging.info("Stopping server listening")
-
-    # TODO this would be better implemented as a coroutine
-    def manageClientsLoop(self):
-        while self.running:
-            for uid, clientSession in self.clientSessions:
-                # Not sure if python supports non-blocking queue iteration, so do this as a while
-                unreadData = clientSession.unreadData.get(block=False)
-                while (unreadData is not None):
-                    logging.info("Received data %s", unreadData)
-                    for otherUid in self.clientSessions.keys().remove(uid):
-                        logging.info("Sending to %s", otherUid)
-                        self.clientSessions[otherUid].addDataToSend(unreadData)
-                    clientSession.unreadData.remove(unreadData)
-                    unreadData = clientSession.unreadData.get(block=False)
-            time.sleep(5)
-        logging.info("Removing client management thread")
-    # TODO state maagement, using timestamp
-#     def updateAllData(self, newDataItems):
-#         for newDataItem in newDataItems:
-#             if newDataItem['type'] == 'Add' and (newDataItem['id'] not in self.allData.keys() or
-#                                                  self.allData[newDataItem['id']]['created'] < newDataItem['created']):
-#                 self.allData[newDataItem['id']] = newDataItem
-#             elif newDataItem['type'] == 'Remove' and newDataItem['id'] in self.allData.keys() and \
-#                                                    self.allData[newDataItem['id']]['created'] < newDataItem['modified']:
-#                 del self.allData[newDataItem['id']]
-#             elif newDataItem['type'] == 'Move' and newDataItem['id'] in self.allData.keys() and \
-#                                                    self.allData[newDataItem['id']]['modified'] < newDataItem['modified']:
-#                 self.allData[newDataItem['id']]['modified'] = newDataItem['modified']
-#                 self.allData[newDataItem['id']]['tilePosition'] = newDataItem['tilePosition']
-# TODO
-# def closeConnections(fromServer):
-#     while fromServer.running:
-#         for session in list(fromServer.sessions.values()):
-#             if session.isTimedOut():
-#                 #TODO send disconnect message
-#                 logging.info("Session %s timed out, removing", session.getUid())
-#                 session.closeSocket()
-#                 del fromServer.sessions[session.getUid()]
-#         # yield for main connection loop to run
-#         time.sleep(1)
+    def createGameState(self):
+        return GameStateStore()
+
+    def run(self):
+        try:
+            while self.running:
+                for fileno, events in self.poller.poll(POLL_TIMEOUT_SEC):
+                    self.handleEvent(fileno, events)
+                if self.journal is not None:
+                    self.journal.flushIfDue()
+                if time.time() - self.lastSlowConsumerCheckTime >= SLOW_CONSUMER_CHECK_SEC:
+                    self.closeSlowConsumers()
+                    self.closeTimedOutStatsConnections()
+        finally:
+            # Also reached on an interrupt, so everything journaled is written out
+            logging.info("Stopping server listening")
+            if self.journal is not None:
+                self.journal.close()
+            for connection in self.connections.values():
+                self.closeConnection(connection)
+            for statsConnection in self.statsConnections.values():
+                self.closeStatsConnection(statsConnection)
+            if self.listenSocket is not None:
+                self.listenSocket.close()
+            if self.statsListenSocket is not None:
+                self.statsListenSocket.close()
+
+    def handleEvent(self, fileno, events):
+        if self.listenSocket is not None and fileno == self.listenSocket.fileno():
+            self.acceptConnections()
+            return
+        if self.statsListenSocket is not None and fileno == self.statsListenSocket.fileno():
+            self.acceptStatsConnections()
+            return
+        statsConnection = self.statsConnections.get(fileno)
+        if statsConnection is not None:
+            self.sendStats(statsConnection)
+            return
+        connection = self.connections.get(fileno)
+        if connection is None:
+            return
+        if events & EventPoller.READ:
+            self.processIncoming(connection)
+        if events & EventPoller.WRITE and fileno in self.connections:
+            self.flush(connection)
+
+    def acceptConnections(self):
+        while True:
+            try:
+                newConnectionSocket, address = self.listenSocket.accept()
+            except socket.error as e:
+                if e.args[0] not in RETRY_ERRNOS:
+                    logging.error("Could not accept connection: %s", e)
+                return
+            self.addConnection(newConnectionSocket, address)
+
+    def addConnection(self, connectionSocket, address):
+        connection = ClientConnection(connectionSocket, address, self.metrics.createConnectionMetrics())
+        self.connections[connection.fileno()] = connection
+        self.poller.register(connection.fileno(), EventPoller.READ)
+        logging.info('Connection from %s', address)
+        return connection
+
+    def acceptStatsConnections(self):
+        """ Start writing the metrics as JSON to each waiting stats connection, which is closed once they are written """
+        while True:
+            try:
+                statsSocket, _ = self.statsListenSocket.accept()
+            except socket.error as e:
+                if e.args[0] not in RETRY_ERRNOS:
+                    logging.error("Could not accept stats connection: %s", e)
+                return
+            stats = self.metrics.toDict(self.connections.values())
+            stats['version'] = self.gameState.version
+            statsConnection = StatsConnection(statsSocket, json.dumps(stats, indent=2, sort_keys=True))
+            self.statsConnections[statsConnection.fileno()] = statsConnection
+            self.poller.register(statsConnection.fileno(), EventPoller.WRITE)
+            self.sendStats(statsConnection)
+
+    def sendStats(self, statsConnection):
+        try:
+            if not statsConnection.sendPendingData():
+                return
+        except socket.error as e:
+            logging.warning("Could not send stats: %s", e)
+        self.closeStatsConnection(statsConnection)
+
+    def closeTimedOutStatsConnections(self):
+        for statsConnection in self.statsConnections.values():
+            if statsConnection.isTimedOut():
+                logging.warning("Dropping a stats connection that did not take the metrics in time")
+                self.closeStatsConnection(statsConnection)
+
+    def closeStatsConnection(self, statsConnection):
+        fileno = statsConnection.fileno()
+        if self.statsConnections.pop(fileno, None) is not None:
+            self.poller.unregister(fileno)
+        statsConnection.socket.close()
+
+    def processIncoming(self, connection):
+        receivedTime = time.time()
+        dataItems = connection.readMessages()
+        if dataItems is None:
+            self.closeConnection(connection)
+            return
+        self.processDataItems(connection, dataItems, receivedTime)
+
+    def processDataItems(self, connection, dataItems, receivedTime):
+        changes = []
+        rejected = []
+        for data in dataItems:
+            if data.get('type') == 'Connect':
+                self.identifyConnection(connection, data['id'])
+                self.negotiateCodec(connection, data.get('codecs'))
+                interest = data.get('interest')
+                if interest is not None:
+                    self.interest.setRegion(connection.uid, InterestRegion(interest['center'], interest['radius']))
+                self.sendInitialState(connection, data.get('version'))
+                continue
+            if data.get('type') == 'Subscribe':
+                self.changeInterest(connection, InterestRegion(data['center'], data['radius']))
+                continue
+            # Which session a command came from breaks timestamp ties, so is set here rather than trusted to the client
+            data['origin'] = connection.uid
+            if not self.applyCommand(data, changes):
+                rejected.append(data)
+        if changes:
+            self.commitChanges(connection, changes, receivedTime)
+        if rejected:
+            self.sendCorrections(connection, rejected)
+
+    def applyCommand(self, data, changes):
+        """ Apply a command to the authoritative state, adding it to changes and returning True if it was accepted.
+        Only changes are relayed, stale and duplicate commands are dropped. Where the entity was before the change
+        decides who else needs to hear about it """
+        existing = self.gameState.getEntity(data.get('target'), data.get('id'))
+        previousPosition = existing.tilePosition if existing is not None else None
+        acceptedData = self.gameState.apply(data)
+        if acceptedData is None:
+            self.metrics.commandsRejected += 1
+            if logging.root.isEnabledFor(logging.DEBUG):
+                logging.debug("Rejected stale data %s", data)
+            return False
+        changes.append((acceptedData, previousPosition))
+        return True
+
+    def sendCorrections(self, connection, rejected):
+        """ Send a client the current state of each entity it sent a rejected command for, as it will already have
+        applied the command itself """
+        corrections = []
+        correctedKeys = set()
+        for data in rejected:
+            key = (data.get('target'), data.get('id'))
+            if key not in correctedKeys:
+                correctedKeys.add(key)
+                correction = self.getCorrection(data)
+                if correction is not None:
+                    corrections.append(correction)
+        if corrections:
+            connection.addDataToSend(*corrections)
+            self.flush(connection)
+
+    def getCorrection(self, data):
+        """ What undoes a rejected command for the client that sent it, a Move or Add putting the entity back where it
+        is or a Remove if there is no such entity, or None if the client cannot have changed anything """
+        if data.get('type') not in COMMAND_TYPES:
+            return None
+        entity = self.gameState.getEntity(data.get('target'), data.get('id'))
+        if entity is None:
+            if data['type'] == 'Remove':
+                return None
+            return {'type': 'Remove', 'target': data.get('target'), 'id': data.get('id'),
+                    'modified': getCurrentTimestamp()}
+        if data['type'] == 'Remove':
+            return entity.toCommand()
+        return entity.toMoveCommand()
+
+    def commitChanges(self, fromConnection, changes, receivedTime):
+        """ Journal accepted changes and relay them to every client but the one they came from """
+        self.metrics.commandsAccepted += len(changes)
+        self.logAccepted([data for data, _ in changes])
+        self.relay(fromConnection, changes, receivedTime)
+
+    def logAccepted(self, commands):
+        """ Journal accepted commands, compacting the journal when enough have been logged since it last was """
+        if self.journal is None or not commands:
+            return
+        self.journal.append(commands)
+        if self.journal.isSnapshotDue():
+            self.journal.writeSnapshot(self.gameState)
+
+    def identifyConnection(self, connection, uid):
+        logging.info('Connection from new client %s', uid)
+        # Replace any existing session with this uid
+        existing = self.clientSessions.get(uid)
+        if existing is not None and existing is not connection:
+            self.closeConnection(existing)
+        connection.uid = uid
+        self.clientSessions[uid] = connection
+
+    def negotiateCodec(self, connection, codecs):
+        """ Tell the client which codec will be used in both directions, clients that do not list any get JSON """
+        connection.codec = chooseCodec(codecs)
+
+    def sendInitialState(self, connection, lastVersion):
+        """ Bring a joining client up to date. A client interested in a region is sent a snapshot of just that region.
+        Otherwise it is sent only the changes it missed if it has seen an earlier version of the state and they are
+        still in the delta log, or a snapshot of the current state """
+        region = self.interest.getRegion(connection.uid)
+        if region is not None:
+            changes = [self.gameState.getSnapshot(region.getPositions())]
+        else:
+            changes = self.gameState.getChangesSince(lastVersion)
+            if changes is None:
+                logging.info("Sending snapshot at version %s to %s", self.gameState.version, connection.uid)
+                changes = [self.gameState.getSnapshot()]
+        # The Welcome naming the codec and the initial state go out together as one message
+        connection.addDataToSend({'type': 'Welcome', 'codec': connection.codec}, *changes)
+        self.flush(connection)
+
+    def changeInterest(self, connection, region):
+        """ Move a client's region of interest, sending it the entities that are now in view and removing those that
+        are not. A client that was interested in everything is sent a snapshot of its new region instead """
+        previous = self.interest.setRegion(connection.uid, region)
+        if previous is None:
+            connection.addDataToSend(self.gameState.getSnapshot(region.getPositions()))
+        else:
+            newPositions = set(region.getPositions())
+            oldPositions = set(previous.getPositions())
+            entering = [entity.toCommand() for tilePosition in newPositions - oldPositions
+                                           for entity in self.gameState.getEntitiesAt(tilePosition)]
+            leaving = [self.getRemoveCommand(entity) for tilePosition in oldPositions - newPositions
+                                                     for entity in self.gameState.getEntitiesAt(tilePosition)]
+            if not entering and not leaving:
+                return
+            connection.addDataToSend(*(leaving + entering))
+        self.flush(connection)
+
+    def getRemoveCommand(self, entity, version=None):
+        command = {'type': 'Remove', 'target': entity.target, 'id': entity.id, 'modified': entity.modified}
+        if version is not None:
+            command['version'] = version
+        return command
+
+    def relay(self, fromConnection, changes, receivedTime):
+        """ Forward accepted changes, each paired with the position of its entity before the change, to every other
+        client as one message. It is written straight away rather than waiting for the next poll. Only clients that
+        have connected and been sent the initial state are forwarded to, so they never see a change before the
+        snapshot it applies to. How long after receivedTime each client is written to is the relay latency """
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("Received data %s", changes)
+        routes = [self.routeChange(data, previousPosition) for data, previousPosition in changes]
+        # Clients seeing the same changes share one encoding for each codec
+        payloads = dict()
+        for connection in self.clientSessions.values():
+            if connection is fromConnection:
+                continue
+            dataItems = []
+            for route in routes:
+                data = route(connection.uid)
+                if data is not None:
+                    dataItems.append(data)
+            if not dataItems:
+                continue
+            if connection.isBackedUp():
+                connection.addDataToSend(*dataItems)
+                self.flush(connection)
+                continue
+            payloadKey = (connection.codec, tuple(id(data) for data in dataItems))
+            payload = payloads.get(payloadKey)
+            if payload is None:
+                encodeStartTime = time.time()
+                payload = payloads[payloadKey] = encodeMessage(coalesceMessages(dataItems), connection.codec)
+                self.metrics.totals.recordEncode(time.time() - encodeStartTime)
+            connection.addPayloadToSend(payload)
+            self.flush(connection)
+            self.metrics.relayLatency.record(time.time() - receivedTime)
+
+    def routeChange(self, data, previousPosition):
+        """ A function giving what, if anything, the client with a uid should be sent for a change. Clients without a
+        region of interest get every change. Otherwise a client is sent a change if it is interested in where the entity
+        was or is, and when a Move takes an entity into or out of its region it is sent an Add or a Remove instead """
+        if data['type'] == 'AddRange':
+            # Ranges are sent whole as they are small, clients expand them to the tiles they cover
+            return lambda uid: data
+        newPosition = tuple(data['tilePosition']) if data['type'] != 'Remove' else None
+        interestedBefore = self.interest.getInterestedIn(previousPosition)
+        interestedAfter = self.interest.getInterestedIn(newPosition)
+        entity = self.gameState.getEntity(data['target'], data['id'])
+        entering = None
+        leaving = None
+        if entity is not None:
+            entering = entity.toCommand()
+            entering['tilePosition'] = data.get('tilePosition')
+            entering['version'] = data['version']
+            leaving = self.getRemoveCommand(entity, data['version'])
+        elif data['type'] == 'Remove':
+            leaving = data
+
+        def route(uid):
+            if not self.interest.hasRegion(uid):
+                return data
+            before = uid in interestedBefore
+            after = uid in interestedAfter
+            if after:
+                return data if before or data['type'] == 'Add' else entering
+            return leaving if before else None
+        return route
+
+    def flush(self, connection):
+        if not connection.sendPendingData():
+            self.closeConnection(connection)
+            return
+        if connection.isSlowConsumer():
+            self.closeSlowConsumer(connection)
+            return
+        # Only wait for the socket to become writable while there is a backlog it could not yet take
+        self.poller.modify(connection.fileno(), EventPoller.READ |
+                           (EventPoller.WRITE if connection.hasDataToSend() else 0))
+
+    def closeSlowConsumers(self):
+        self.lastSlowConsumerCheckTime = time.time()
+        for connection in self.connections.values():
+            if connection.isSlowConsumer():
+                self.closeSlowConsumer(connection)
+
+    def closeSlowConsumer(self, connection):
+        """ Disconnect a client that cannot keep up, which can reconnect and be sent the current state afresh """
+        logging.warning("Disconnecting %s as it is not keeping up, with %d bytes and %d data items waiting",
+                        connection.uid, connection.getBacklogBytes(), len(connection.heldData))
+        self.metrics.slowConsumerDisconnects += 1
+        self.closeConnection(connection)
 
+    def closeConnection(self, connection):
+        fileno = connection.fileno()
+        if self.connections.pop(fileno, None) is None:
+            return
+        self.poller.unregister(fileno)
+        if connection.uid is not None and self.clientSessions.get(connection.uid) is connection:
+            del self.clientSessions[connection.uid]
+            self.interest.removeRegion(connection.uid)
+        connection.close()
+        logging.info("Closed connection from %s", connection.address)
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
-    server = Server()
-    t = threading.Thread(target=server.manageClientsLoop)
-    t.daemon = True
-    t.start()
-    server.acceptConnectionLoop()
-    logging.info("Exiting server session")
\ No newline at end of file
+    # Load tests run with --no-journal so their traffic is not kept
+    server = Server(journalDirectory=None if '--no-journal' in sys.argv[1:] else JOURNAL_DIRECTORY)
+    logging.info("Serving metrics on local port %s", STATS_PORT)
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    logging.info("Exiting server session")
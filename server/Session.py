@@ -1,16 +1,41 @@
-import struct, time, json, logging, uuid, socket, threading
-from Queue import Queue
+import struct, time, logging, uuid, socket, threading, errno, itertools
+from collections import defaultdict
+from Queue import Queue, Empty
+from WireCodec import encodeMessage, decodeMessage, chooseCodec, JSON_CODEC, SUPPORTED_CODECS
+from Metrics import ConnectionMetrics
 
 DISCONNECT_TIME_SEC = 30
+HEADER_LENGTH = 4
+RECV_SIZE = 65536
+# Errors from a non blocking socket that mean try again later rather than the connection has failed
+RETRY_ERRNOS = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+# How long the send thread waits after the first queued item for more to batch with it. With no wait a batch is
+# whatever was queued while the previous one was being sent, which adds no latency
+FLUSH_WINDOW_SEC = 0
+COMMAND_TYPES = ('Add', 'Remove', 'Move')
+# Once more than the high watermark of bytes are waiting to be written to a client it is backed up, and data for it is
+# held back unencoded so superseded changes can be coalesced away, until the backlog drains below the low watermark
+HIGH_WATERMARK_BYTES = 1 << 20
+LOW_WATERMARK_BYTES = 1 << 18
+# Held data is coalesced whenever this many items are held. A client with more than half this many left after
+# coalescing, or that stays backed up for longer than the timeout, is too slow to keep up and is disconnected
+MAX_HELD_DATA_ITEMS = 10000
+SLOW_CONSUMER_TIMEOUT_SEC = 10
+# How often a wait for queued data to be sent checks the send thread can still send it
+SEND_WAIT_POLL_SEC = 0.1
+# Bytes written from the front of a connection's outgoing buffer are only removed once this many have built up
+COMPACT_BYTES = 1 << 16
 
-def send_msg(sock, msg):
+def frame_msg(msg):
     # Prefix each message with a 4-byte length (network byte order)
-    msg = struct.pack('>I', len(msg)) + msg
-    sock.sendall(msg)
+    return struct.pack('>I', len(msg)) + msg
+
+def send_msg(sock, msg):
+    sock.sendall(frame_msg(msg))
 
 def recv_msg(sock):
     # Read message length and unpack it into an integer
-    raw_msglen = recvall(sock, 4)
+    raw_msglen = recvall(sock, HEADER_LENGTH)
     if not raw_msglen:
         return None
     msglen = struct.unpack('>I', raw_msglen)[0]
@@ -27,96 +52,214 @@ def recvall(sock, n):
         data += packet
     return data
 
+class FrameReader(object):
+    """ Reassembles length prefixed messages from the partial reads of a non blocking socket """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def feed(self, data):
+        """ Add newly read bytes, returning a list of every message they complete """
+        self.buffer.extend(data)
+        messages = []
+        while len(self.buffer) - self.offset >= HEADER_LENGTH:
+            msglen = struct.unpack_from('>I', self.buffer, self.offset)[0]
+            end = self.offset + HEADER_LENGTH + msglen
+            if end > len(self.buffer):
+                break
+            messages.append(str(self.buffer[self.offset + HEADER_LENGTH:end]))
+            self.offset = end
+        # Drop consumed bytes once per feed rather than once per message
+        if self.offset:
+            del self.buffer[:self.offset]
+            self.offset = 0
+        return messages
+
+def coalesceMessages(dataItems):
+    """ Reduce a batch of data items to the fewest with the same effect. Only the last of several Moves of an entity is
+    kept, a Move is dropped if the entity is then removed, and an Add followed by a Remove cancels out. Everything else
+    keeps its order """
+    coalesced = list(dataItems)
+    # Index in coalesced of the pending Add and latest Move of each entity
+    pendingAdds = dict()
+    pendingMoves = dict()
+    for index, data in enumerate(dataItems):
+        commandType = data.get('type')
+        if commandType not in COMMAND_TYPES:
+            continue
+        key = (data.get('target'), data.get('id'))
+        previousMove = pendingMoves.pop(key, None)
+        if commandType == 'Move':
+            pendingMoves[key] = index
+        if previousMove is not None:
+            coalesced[previousMove] = None
+        if commandType == 'Add':
+            pendingAdds[key] = index
+        elif commandType == 'Remove':
+            previousAdd = pendingAdds.pop(key, None)
+            if previousAdd is not None:
+                coalesced[previousAdd] = None
+                coalesced[index] = None
+    return [data for data in coalesced if data is not None]
+
 # Client,              server,          server client - set up with a socket, reads all client data from socket until disconnect
 # send/recv blocking, recv non blocking, send/recv blocking
 # TODO should use type object pattern
 class Session(object):
-    """ Base Session that gets given a socket"""
+    """ Base Session that gets given a socket, and reads and writes it on its own threads """
+    # The codec outgoing messages are encoded with
+    codec = JSON_CODEC
+
     def __init__(self, socket):
         logging.basicConfig(level=logging.INFO)
-        self.unsentData = list()
+        self.unsentData = Queue()
         self.unreadData = Queue()
         self.socket = socket
+        self.lastConnectTime = time.time()
+        self.metrics = ConnectionMetrics()
         self.startThreads()
-        print "Exiting session"
 
     def startThreads(self):
         self.processIncoming = True
         self.startThread(self.processIncomingMessages)
         self.processOutgoing = True
-        self.startThread(self.sendOutgoingMessages)
+        self.sendThread = self.startThread(self.sendOutgoingMessages)
 
     def startThread(self, processMethod):
         t = threading.Thread(target=processMethod)
         t.daemon = True
         t.start()
+        return t
 
     def processIncomingMessages(self):
-        incomingData = None
         while self.processIncoming and self.socket is not None:
-            socketToRecvFrom = None
+            socketToRecvFrom = self.socket
             try:
-                socketToRecvFrom = self.getRecvSocket()
                 msg = recv_msg(socketToRecvFrom)
-                self.lastConnectTime = time.time()
-                logging.info("Received msg %s", msg)
-                incomingData = json.loads(msg) if msg is not None else None
+                if msg is None:
+                    raise socket.error("Connection closed")
             except socket.error:
-                if socketToRecvFrom is not None:
-                    socketToRecvFrom.close()
+                socketToRecvFrom.close()
                 if socketToRecvFrom is self.socket:
                     self.socket = self.initSocket()
-            if incomingData is not None:
-                for data in incomingData: # TODO if single JSON entry check this doesnt split into elements
-                    self.addUnreadData(socketToRecvFrom, data)
-            else:
-                time.sleep(0.5)
-        print logging.info("Shutting down listening")
+                continue
+            self.lastConnectTime = time.time()
+            # Checked first as formatting every message would cost more than handling it
+            if logging.root.isEnabledFor(logging.DEBUG):
+                logging.debug("Received msg %s", msg)
+            # Each message is a list of data items
+            decodeStartTime = time.time()
+            dataItems = decodeMessage(msg)
+            self.metrics.recordIn(1, HEADER_LENGTH + len(msg), len(dataItems), time.time() - decodeStartTime)
+            for data in dataItems:
+                self.addUnreadData(socketToRecvFrom, data)
+        logging.info("Shutting down listening")
 
     def sendOutgoingMessages(self):
         while self.processOutgoing and self.socket is not None:
-            clientSocket = None
+            # Block until there is data. Python 2 implements waits with a timeout by polling, so wait without one
+            dataItems = [self.unsentData.get()]
             try:
-                for data in list(self.unsentData):
-                    self.unsentData.remove(data)
-                    toSend = json.dumps(data)
-                    logging.debug("Sending data %s", toSend)
-                    send_msg(clientSocket, toSend)
-                    self.lastConnectTime = time.time()
-                time.sleep(1)
-            except socket.error:
-                if clientSocket is not None:
-                    clientSocket.close()
-                if clientSocket is self.socket:
-                    self.socket = self.initSocket()
+                if FLUSH_WINDOW_SEC:
+                    time.sleep(FLUSH_WINDOW_SEC)
+                dataItems.extend(self.takeUnsentData())
+                self.sendDataItems(dataItems)
+            finally:
+                # Whatever happened to them, so nothing waiting until they are sent waits forever
+                for _ in dataItems:
+                    self.unsentData.task_done()
+
+    def sendDataItems(self, dataItems):
+        toSend = coalesceMessages(dataItems)
+        socketToSendOn = self.socket
+        # The connection was lost while waiting for data, and could not be made again
+        if not toSend or socketToSendOn is None:
+            return
+        try:
+            if logging.root.isEnabledFor(logging.DEBUG):
+                logging.debug("Sending data %s", toSend)
+            # Everything queued goes out as a single message
+            encodeStartTime = time.time()
+            msg = encodeMessage(toSend, self.codec)
+            self.metrics.recordEncode(time.time() - encodeStartTime)
+            send_msg(socketToSendOn, msg)
+            self.metrics.recordOut(HEADER_LENGTH + len(msg))
+            self.lastConnectTime = time.time()
+        except socket.error:
+            socketToSendOn.close()
+            if socketToSendOn is self.socket:
+                self.socket = self.initSocket()
+
+    def takeUnsentData(self):
+        """ Everything currently queued to send, without blocking """
+        dataItems = []
+        while True:
+            try:
+                dataItems.append(self.unsentData.get_nowait())
+            except Empty:
+                return dataItems
+
+    def waitUntilSent(self):
+        """ Block until all the data queued so far has been sent, or there is no connection left to send it on """
+        allSent = self.unsentData.all_tasks_done
+        with allSent:
+            while self.unsentData.unfinished_tasks and self.canSend():
+                allSent.wait(SEND_WAIT_POLL_SEC)
+
+    def canSend(self):
+        return self.processOutgoing and self.socket is not None and self.sendThread.is_alive()
 
     def initSocket(self):
         return None
 
-    def getRecvSocket(self):
-        return self.socket
+    def close(self):
+        """ Stop reading and writing and close the socket, without reconnecting """
+        self.processIncoming = False
+        self.processOutgoing = False
+        socketToClose, self.socket = self.socket, None
+        if socketToClose is not None:
+            # Shutting down wakes the thread blocked reading the socket, which closing alone does not
+            try:
+                socketToClose.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            socketToClose.close()
 
     def getUnreadDataQueue(self):
         return self.unreadData
 
+    def getStats(self):
+        """ The metrics of this session's connection and how much data is queued in each direction """
+        stats = self.metrics.toDict()
+        stats['unreadData'] = self.getUnreadDataQueue().qsize()
+        stats['unsentData'] = self.unsentData.qsize()
+        return stats
+
     def isTimedOut(self):
         cutoffTime = time.time() - DISCONNECT_TIME_SEC
         return self.lastConnectTime < cutoffTime
 
     def addDataToSend(self, **data):
-        self.unsentData.append(data)
+        self.unsentData.put(data)
 
     def addUnreadData(self, socket, data):
-        timestamp = data["timestamp"]
-        del data["timestamp"]
-        # TODO this hsould be common
-        self.unreadData.put((timestamp, data))
+        self.unreadData.put(data)
 
 class ClientSession(Session):
     """ A Session with a uid that creates a new socket which it connects to a server, it reads and writes to that """
-    def __init__(self):
+    def __init__(self, codecs=SUPPORTED_CODECS, interest=None):
+        self.uid = str(uuid.uuid4())
+        # The codecs this client can send with, in order of preference
+        self.codecs = codecs
+        # The region of the board this client wants updates for as a dict of center and radius, or None for everything
+        self.interest = interest
+        # The version of the server state this client has seen, so a reconnection only needs the changes since then
+        self.lastVersion = None
+        # Incoming data is queued separately for each target so each processor only sees its own events
+        self.unreadDataByTarget = defaultdict(Queue)
+        # Numbers everything sent in order, so the server keeps the order of commands sent within the same millisecond
+        self.sequenceNumbers = itertools.count(1)
         super(ClientSession, self).__init__(self.initSocket())
-        self.unsentData = list({id:str(uuid.uuid4())})
 
     def initSocket(self):
         soc = socket.socket()
@@ -126,6 +269,7 @@ class ClientSession(Session):
             soc.connect((host, port))
             logging.debug("Connected socket to %s %s", host, port)
         except Exception:
+            soc = socket.socket()
             host = '127.0.0.1'
             try:
                 soc.connect((host, port))
@@ -133,46 +277,205 @@ class ClientSession(Session):
             except Exception:
                 logging.error("%s could not connect to server.", host)
                 self.running = False
-                soc = None
+                return None
+        # The first message on every connection identifies this client, so the server can replace any older connection.
+        # It is always JSON, and the server replies with the codec to use from then on
+        self.codec = JSON_CODEC
+        send_msg(soc, encodeMessage([self.getConnectData()]))
         return soc
 
+    def getConnectData(self):
+        connectData = {'type': 'Connect', 'id': self.uid, 'codecs': list(self.codecs)}
+        if self.lastVersion is not None:
+            connectData['version'] = self.lastVersion
+        if self.interest is not None:
+            connectData['interest'] = self.interest
+        return connectData
+
+    def setInterest(self, center, radius):
+        """ Only receive updates for tiles within radius of center """
+        self.interest = {'center': list(center), 'radius': radius}
+        self.addDataToSend(type='Subscribe', **self.interest)
+
     def addDataToSend(self, **data):
         now = time.time()
         milliseconds = '%03d' % int((now - int(now)) * 1000)
         data["timestamp"] = time.strftime('%Y%m%d%H%M%S', time.localtime(now)) + milliseconds
-        self.unsentData.append(data)
+        data["seq"] = next(self.sequenceNumbers)
+        self.unsentData.put(data)
+
+    def getUnreadDataQueue(self, target=None):
+        return self.unreadDataByTarget[target] if target is not None else self.unreadData
+
+    def getStats(self):
+        stats = super(ClientSession, self).getStats()
+        stats['unreadData'] += sum(queue.qsize() for queue in self.unreadDataByTarget.values())
+        return stats
 
     def addUnreadData(self, socket, data):
-        self.unreadData.put(data)
+        if data.get('version') is not None:
+            self.lastVersion = max(self.lastVersion, data['version'])
+        if data.get('type') == 'Welcome':
+            self.codec = chooseCodec((data['codec'],))
+            return
+        if data.get('type') == 'Snapshot':
+            # Split the snapshot so each target's processor is given the entities it manages
+            for target, entities in data['entities'].items():
+                self.getUnreadDataQueue(target).put({'type': 'Snapshot', 'target': target, 'entities': entities})
+            return
+        self.getUnreadDataQueue(data.get('target')).put(data)
 
-class ServerSession(Session):
-    """ A Session that can accept multiple connections without blocking """
-    def __init__(self):
-        super(ServerSession, self).__init__(self.initSocket())
+class ClientConnection(object):
+    """ The server end of a client's socket, never blocks and is read and written by the server's event loop """
+    def __init__(self, socket, address, metrics=None):
+        socket.setblocking(0)
+        self.socket = socket
+        # Kept so the connection can still be found by fileno after the socket is closed
+        self.socketFileno = socket.fileno()
+        self.address = address
+        self.uid = None
+        self.codec = JSON_CODEC
+        self.frameReader = FrameReader()
+        # Encoded messages waiting to be written, of which the bytes before sentOffset already have been
+        self.outgoing = bytearray()
+        self.sentOffset = 0
+        # Data items held back while the client is backed up, and when it became backed up
+        self.heldData = []
+        self.backedUpSince = None
+        self.heldDataOverflowed = False
+        self.lastConnectTime = time.time()
+        self.metrics = metrics if metrics is not None else ConnectionMetrics()
 
-    def initSocket(self):
-        soc = socket.socket()
-        port = 12344
-        try:
-            host = socket.gethostname() # TODO read server hostname from config, this only works while they share a socket
-            soc.bind((host, port))
-            soc.listen(5) # TODO max num connections should be read from config
-            logging.debug("Connected socket to %s %s", host, port)
-        except Exception:
-            logging.error("could not set up server.")
-            self.running = False
-            soc = None
-        return soc
+    def fileno(self):
+        return self.socketFileno
 
-    def startThreads(self):
-        self.processIncoming = True
-        self.startThread(self.processIncomingMessages)
+    def readMessages(self):
+        """ Read everything available on the socket, returning the data items of every complete message or None if
+        the connection has been closed """
+        messages = self.readFrames()
+        if messages is None:
+            return None
+        return self.decodeMessages(messages)
 
-    def getRecvSocket(self):
-        socketToRecvFrom, (addr, port) = self.socket.accept()
-        return socketToRecvFrom
+    def readFrames(self):
+        """ Read everything available on the socket, returning every complete message still encoded or None if the
+        connection has been closed """
+        messages = []
+        while True:
+            try:
+                packet = self.socket.recv(RECV_SIZE)
+            except socket.error as e:
+                if e.args[0] in RETRY_ERRNOS:
+                    break
+                return None
+            if not packet:
+                return None
+            self.metrics.recordIn(0, len(packet), 0, 0)
+            messages.extend(self.frameReader.feed(packet))
+            if len(packet) < RECV_SIZE:
+                break
+        return messages
 
-    def addUnreadData(self, socket, data):
-        uid = data["id"]
-        del data["id"]
-        self.unreadData.put((socket, uid))
\ No newline at end of file
+    def decodeMessages(self, messages):
+        """ The data items of each message read from the socket """
+        decodeStartTime = time.time()
+        if messages:
+            self.lastConnectTime = decodeStartTime
+        dataItems = []
+        for msg in messages:
+            dataItems.extend(decodeMessage(msg))
+        self.metrics.recordIn(len(messages), 0, len(dataItems), time.time() - decodeStartTime)
+        return dataItems
+
+    def addDataToSend(self, *dataItems):
+        """ Queue data items to go to the client together as one message, or hold them back if it is backed up """
+        if self.isBackedUp():
+            self.holdData(dataItems)
+            return
+        encodeStartTime = time.time()
+        payload = encodeMessage(coalesceMessages(dataItems), self.codec)
+        self.metrics.recordEncode(time.time() - encodeStartTime)
+        self.addPayloadToSend(payload)
+
+    def addPayloadToSend(self, payload):
+        """ Queue a message already encoded with this connection's codec. Only for clients that are not backed up, as
+        the message would otherwise go ahead of the data being held back """
+        self.outgoing.extend(frame_msg(payload))
+        self.metrics.recordOut(HEADER_LENGTH + len(payload))
+        if self.backedUpSince is None and self.getBacklogBytes() > HIGH_WATERMARK_BYTES:
+            self.backedUpSince = time.time()
+
+    def isBackedUp(self):
+        return self.backedUpSince is not None
+
+    def holdData(self, dataItems):
+        self.heldData.extend(dataItems)
+        if len(self.heldData) >= MAX_HELD_DATA_ITEMS:
+            numHeld = len(self.heldData)
+            self.heldData = coalesceMessages(self.heldData)
+            self.metrics.recordCoalesced(numHeld - len(self.heldData))
+            self.heldDataOverflowed = len(self.heldData) > MAX_HELD_DATA_ITEMS // 2
+
+    def releaseHeldData(self):
+        """ Queue the data held back while the client was backed up as one message, which ends it being backed up
+        unless that takes it over the high watermark again """
+        dataItems, self.heldData = self.heldData, []
+        self.backedUpSince = None
+        self.heldDataOverflowed = False
+        if dataItems:
+            self.addDataToSend(*dataItems)
+
+    def isSlowConsumer(self):
+        """ Whether the client is not keeping up with what it is sent, so should be disconnected to bound the memory it
+        takes and the latency of everyone else """
+        if self.backedUpSince is None:
+            return False
+        return self.heldDataOverflowed or time.time() - self.backedUpSince > SLOW_CONSUMER_TIMEOUT_SEC
+
+    def getBacklogBytes(self):
+        return len(self.outgoing) - self.sentOffset
+
+    def hasDataToSend(self):
+        return self.getBacklogBytes() > 0
+
+    def sendPendingData(self):
+        """ Write as much queued data as the socket will take, returning False if the connection has failed. Held data
+        is queued once a backed up client has taken enough for its backlog to fall below the low watermark """
+        while True:
+            while self.sentOffset < len(self.outgoing):
+                try:
+                    # A buffer writes from the offset without copying the rest of the backlog
+                    sent = self.socket.send(buffer(self.outgoing, self.sentOffset))
+                except socket.error as e:
+                    if e.args[0] in RETRY_ERRNOS:
+                        break
+                    return False
+                self.sentOffset += sent
+            if self.sentOffset == len(self.outgoing) or self.sentOffset >= COMPACT_BYTES:
+                del self.outgoing[:self.sentOffset]
+                self.sentOffset = 0
+            if not self.isBackedUp() or self.getBacklogBytes() > LOW_WATERMARK_BYTES:
+                break
+            self.releaseHeldData()
+        self.metrics.recordBacklog(self.getBacklogBytes())
+        return True
+
+    def isTimedOut(self):
+        cutoffTime = time.time() - DISCONNECT_TIME_SEC
+        return self.lastConnectTime < cutoffTime
+
+    def close(self):
+        try:
+            self.socket.close()
+        except socket.error:
+            pass
+
+def createListenSocket(host, port, backlog=socket.SOMAXCONN):
+    """ A non blocking socket accepting connections on the given host and port """
+    soc = socket.socket()
+    soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    soc.bind((host, port))
+    soc.listen(backlog)
+    soc.setblocking(0)
+    logging.debug("Listening on %s %s", host, port)
+    return soc
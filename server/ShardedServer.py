@@ -0,0 +1,383 @@
+import sys, os, time, logging, socket, json, multiprocessing
+from collections import defaultdict
+from multiprocessing import reduction
+from Session import ClientConnection, createListenSocket, frame_msg, send_msg, recv_msg, RETRY_ERRNOS, COMMAND_TYPES
+from WireCodec import encodeMessage, decodeMessage, BINARY_CODEC
+from Server import Server, EventPoller, PORT, POLL_TIMEOUT_SEC
+from GameState import GameStateStore
+from Interest import getSectorOf
+from Journal import JOURNAL_DIRECTORY
+
+# Shards own the wedges of the board between its six spokes, so there can be at most one for each
+MAX_SHARDS = 6
+# The destination of a message between shards that goes to every shard but the one that sent it
+BROADCAST = 255
+
+class SectorState(GameStateStore):
+    """ The state a shard keeps. Entities in the shard's own sector are decided and journaled by it, while those
+    elsewhere are only mirrored from what the other shards accept, to route changes and send snapshots to its clients """
+    def __init__(self, shardIndex, numShards):
+        self.shardIndex = shardIndex
+        self.numShards = numShards
+        GameStateStore.__init__(self)
+
+    def isOwned(self, tilePosition):
+        return getSectorOf(tilePosition, self.numShards) == self.shardIndex
+
+    def getOwnedEntities(self):
+        return [entity for entity in self.entities.itervalues() if self.isOwned(entity.tilePosition)]
+
+    def getCompactedCommands(self, entities=None):
+        return GameStateStore.getCompactedCommands(self, entities if entities is not None else self.getOwnedEntities())
+
+    def discardMirrored(self):
+        """ Remove every entity outside the sector, as after a restart the journal only has them as they were when
+        they left it """
+        for entity in self.entities.values():
+            if not self.isOwned(entity.tilePosition):
+                self.removeEntity(entity)
+        self.cachedSnapshot = None
+
+class ShardServer(Server):
+    """ A server in its own process that owns a sector of the board. It serves the clients the ShardRouter hands it
+    and only decides commands for entities in its own sector, forwarding those for other entities to the shard that owns
+    them. Every change a shard accepts is broadcast to the others through the router. Each applies and journals only
+    the changes to its own sector, and mirrors the rest so it can relay them to its own clients """
+    def __init__(self, shardIndex, numShards, routerSocket, handoffSocket, configFile='server.config',
+                 journalDirectory=JOURNAL_DIRECTORY):
+        self.shardIndex = shardIndex
+        self.numShards = numShards
+        Server.__init__(self, port=None, configFile=configFile, statsPort=None,
+                        journalDirectory=os.path.join(journalDirectory, 'shard%d' % shardIndex)
+                                         if journalDirectory is not None else None)
+        self.router = ClientConnection(routerSocket, ('router', shardIndex))
+        self.poller.register(self.router.fileno(), EventPoller.READ)
+        # Blocking, as the router only uses it to hand over client connections
+        self.handoffSocket = handoffSocket
+        self.poller.register(self.handoffSocket.fileno(), EventPoller.READ)
+        # Commands waiting to be forwarded to each shard, and the shard commands for entities not yet mirrored were
+        # forwarded to, so later commands for them follow
+        self.forwards = defaultdict(list)
+        self.pendingOwners = dict()
+        # Each shard starts from its own sector and is sent the rest of the board by the other shards
+        self.gameState.discardMirrored()
+        self.sendToShard(BROADCAST, [{'type': 'Sync'}] + [command for command in self.gameState.getCompactedCommands()
+                                                          if command['type'] != 'Remove'])
+
+    def createGameState(self):
+        return SectorState(self.shardIndex, self.numShards)
+
+    def handleEvent(self, fileno, events):
+        if fileno == self.router.fileno():
+            if events & EventPoller.READ:
+                self.processShardMessages()
+            if events & EventPoller.WRITE:
+                self.flushRouter()
+            return
+        if fileno == self.handoffSocket.fileno():
+            self.adoptConnection()
+            return
+        Server.handleEvent(self, fileno, events)
+
+    def adoptConnection(self):
+        """ Take over a client connection from the router, along with what the router read from it to choose this
+        shard, which is processed as if this shard had read it """
+        header = recv_msg(self.handoffSocket)
+        initialBytes = recv_msg(self.handoffSocket)
+        if header is None or initialBytes is None:
+            logging.error("Shard %d lost the router", self.shardIndex)
+            self.running = False
+            return
+        handle = reduction.recv_handle(self.handoffSocket)
+        connectionSocket = socket.fromfd(handle, socket.AF_INET, socket.SOCK_STREAM)
+        os.close(handle)
+        connection = self.addConnection(connectionSocket, tuple(json.loads(header)['address']))
+        receivedTime = time.time()
+        self.processDataItems(connection, connection.decodeMessages(connection.frameReader.feed(initialBytes)),
+                              receivedTime)
+
+    def sendInitialState(self, connection, lastVersion):
+        # Versions are local to each shard's replica and a reconnecting client may be handed to a different shard, so
+        # joining clients are always sent a snapshot
+        Server.sendInitialState(self, connection, None)
+
+    def getOwnerOf(self, data):
+        """ The shard that decides a command, the one whose sector its entity is in. Commands that are not for a single
+        entity are decided by the shard they arrive at """
+        commandType = data.get('type')
+        if commandType == 'Add':
+            return getSectorOf(self.gameState.toPosition(data['tilePosition']), self.numShards)
+        if commandType in ('Move', 'Remove'):
+            key = (data.get('target'), data.get('id'))
+            entity = self.gameState.getEntity(*key)
+            if entity is None:
+                return self.pendingOwners.get(key, self.shardIndex)
+            return getSectorOf(entity.tilePosition, self.numShards)
+        return self.shardIndex
+
+    def applyCommand(self, data, changes):
+        owner = self.getOwnerOf(data)
+        if owner == self.shardIndex:
+            return Server.applyCommand(self, data, changes)
+        self.pendingOwners[(data.get('target'), data.get('id'))] = owner
+        self.forwards[owner].append(data)
+        # The owner sends any correction back to this shard if it rejects the command
+        return True
+
+    def processDataItems(self, connection, dataItems, receivedTime):
+        Server.processDataItems(self, connection, dataItems, receivedTime)
+        self.sendForwards(connection.uid, self.shardIndex, receivedTime)
+
+    def commitChanges(self, fromConnection, changes, receivedTime):
+        self.commitFrom(fromConnection.uid, changes, receivedTime)
+
+    def commitFrom(self, originUid, changes, receivedTime):
+        """ Commit changes this shard has accepted, relaying them to its own clients other than the one they came from
+        and broadcasting them to the other shards """
+        Server.commitChanges(self, self.clientSessions.get(originUid), changes, receivedTime)
+        self.sendToShard(BROADCAST, [{'type': 'Accepted', 'origin': originUid, 'receivedTime': receivedTime}] +
+                                    [data for data, _ in changes])
+
+    def sendForwards(self, originUid, originShard, receivedTime):
+        """ Send the commands owned by other shards on to them, with the shard serving the client they came from """
+        for owner, commands in self.forwards.items():
+            self.sendToShard(owner, [{'type': 'Forward', 'origin': originUid, 'shard': originShard,
+                                      'receivedTime': receivedTime}] + commands)
+        self.forwards.clear()
+
+    def processShardMessages(self):
+        messages = self.router.readFrames()
+        if messages is None:
+            logging.error("Shard %d lost the router", self.shardIndex)
+            self.running = False
+            return
+        for message in messages:
+            dataItems = decodeMessage(message)
+            header = dataItems[0]
+            if header['type'] == 'Forward':
+                self.processForwarded(header, dataItems[1:])
+            elif header['type'] == 'Accepted':
+                self.processAccepted(header, dataItems[1:])
+            elif header['type'] == 'Correction':
+                self.processCorrections(header, dataItems[1:])
+            elif header['type'] == 'Sync':
+                for data in dataItems[1:]:
+                    self.gameState.mirror(data)
+
+    def processForwarded(self, header, commands):
+        """ Decide commands forwarded by another shard. Any for entities that have since left this shard's sector are
+        forwarded on to their new owner """
+        changes = []
+        corrections = []
+        for data in commands:
+            if not self.applyCommand(data, changes):
+                correction = self.getCorrection(data)
+                if correction is not None:
+                    corrections.append(correction)
+        if changes:
+            self.commitFrom(header['origin'], changes, header['receivedTime'])
+        if corrections:
+            self.sendToShard(header['shard'], [{'type': 'Correction', 'origin': header['origin']}] + corrections)
+        self.sendForwards(header['origin'], header['shard'], header['receivedTime'])
+
+    def processCorrections(self, header, corrections):
+        """ Pass corrections from the shard that rejected a client's forwarded commands on to the client """
+        connection = self.clientSessions.get(header['origin'])
+        if connection is not None:
+            connection.addDataToSend(*corrections)
+            self.flush(connection)
+
+    def processAccepted(self, header, commands):
+        """ Relay changes another shard accepted to this shard's clients. Those to this shard's sector, including
+        entities moving into it, are applied and journaled as if accepted here, the rest only update the mirror """
+        changes = []
+        journaled = []
+        for data in commands:
+            key = (data.get('target'), data.get('id'))
+            self.pendingOwners.pop(key, None)
+            existing = self.gameState.getEntity(*key)
+            previousPosition = existing.tilePosition if existing is not None else None
+            acceptedData = self.gameState.apply(data) if self.isInSector(data, previousPosition) else None
+            if acceptedData is not None:
+                if data['type'] == 'Move' and not self.gameState.isOwned(previousPosition):
+                    # The journal has nothing of an entity before it entered the sector, so it is journaled whole
+                    entering = self.gameState.getEntity(*key).toCommand()
+                    entering['modified'] = entering['created']
+                    entering['version'] = acceptedData['version']
+                    journaled.append(entering)
+                journaled.append(acceptedData)
+            elif data['type'] in COMMAND_TYPES:
+                self.gameState.mirror(data)
+                acceptedData = data
+            else:
+                continue
+            changes.append((acceptedData, previousPosition))
+        self.logAccepted(journaled)
+        if changes:
+            self.relay(self.clientSessions.get(header['origin']), changes, header['receivedTime'])
+
+    def isInSector(self, data, previousPosition):
+        """ Whether a change is to this shard's sector, so must be journaled here. Ranges are, as they cover the
+        board """
+        if data['type'] == 'AddRange':
+            return True
+        if previousPosition is not None and self.gameState.isOwned(previousPosition):
+            return True
+        return 'tilePosition' in data and self.gameState.isOwned(self.gameState.toPosition(data['tilePosition']))
+
+    def sendToShard(self, destination, dataItems):
+        self.router.addPayloadToSend(chr(destination) + encodeMessage(dataItems, BINARY_CODEC))
+        self.flushRouter()
+
+    def flushRouter(self):
+        if not self.router.sendPendingData():
+            logging.error("Shard %d lost the router", self.shardIndex)
+            self.running = False
+            return
+        self.poller.modify(self.router.fileno(), EventPoller.READ |
+                           (EventPoller.WRITE if self.router.hasDataToSend() else 0))
+
+def runShard(shardIndex, numShards, routerSocket, handoffSocket, configFile, journalDirectory):
+    shard = ShardServer(shardIndex, numShards, routerSocket, handoffSocket, configFile, journalDirectory)
+    try:
+        shard.run()
+    except KeyboardInterrupt:
+        pass
+
+class ShardRouter(object):
+    """ The front of a server split into a ShardServer process for each sector of the board. It accepts client
+    connections and hands each to a shard, choosing the one owning the center of the client's region of interest or
+    taking turns for clients interested in everything, and passes the messages between shards without decoding them """
+    def __init__(self, numShards, host=None, port=PORT, configFile='server.config',
+                 journalDirectory=JOURNAL_DIRECTORY):
+        if not 1 <= numShards <= MAX_SHARDS:
+            raise ValueError("A server can have from 1 to %d shards, not %d" % (MAX_SHARDS, numShards))
+        self.numShards = numShards
+        self.poller = EventPoller()
+        self.links = []
+        self.handoffSockets = []
+        self.processes = []
+        for shardIndex in xrange(numShards):
+            routerEnd, shardEnd = socket.socketpair()
+            handoffEnd, shardHandoffEnd = socket.socketpair()
+            process = multiprocessing.Process(target=runShard, args=(shardIndex, numShards, shardEnd, shardHandoffEnd,
+                                                                     configFile, journalDirectory))
+            process.daemon = True
+            process.start()
+            shardEnd.close()
+            shardHandoffEnd.close()
+            link = ClientConnection(routerEnd, ('shard', shardIndex))
+            self.poller.register(link.fileno(), EventPoller.READ)
+            self.links.append(link)
+            self.handoffSockets.append(handoffEnd)
+            self.processes.append(process)
+        self.linksByFileno = dict((link.fileno(), link) for link in self.links)
+        # Listening starts after the shards are started so they do not inherit the socket
+        self.listenSocket = createListenSocket(host if host is not None else socket.gethostname(), port)
+        self.poller.register(self.listenSocket.fileno(), EventPoller.READ)
+        # Connections that have not yet sent the Connect message that decides their shard, by fileno
+        self.newConnections = dict()
+        self.nextShard = 0
+        self.running = True
+
+    def run(self):
+        try:
+            while self.running:
+                for fileno, events in self.poller.poll(POLL_TIMEOUT_SEC):
+                    if fileno == self.listenSocket.fileno():
+                        self.acceptConnections()
+                    elif fileno in self.newConnections:
+                        self.handOverConnection(self.newConnections[fileno])
+                    elif fileno in self.linksByFileno:
+                        link = self.linksByFileno[fileno]
+                        if events & EventPoller.READ:
+                            self.routeShardMessages(link)
+                        if events & EventPoller.WRITE:
+                            self.flush(link)
+        finally:
+            logging.info("Stopping router")
+            self.listenSocket.close()
+            for connection in self.newConnections.values():
+                connection.close()
+            for process in self.processes:
+                process.terminate()
+                process.join()
+
+    def acceptConnections(self):
+        while True:
+            try:
+                newConnectionSocket, address = self.listenSocket.accept()
+            except socket.error as e:
+                if e.args[0] not in RETRY_ERRNOS:
+                    logging.error("Could not accept connection: %s", e)
+                return
+            connection = ClientConnection(newConnectionSocket, address)
+            self.newConnections[connection.fileno()] = connection
+            self.poller.register(connection.fileno(), EventPoller.READ)
+
+    def handOverConnection(self, connection):
+        """ Once a new connection's Connect message has arrived, pass its socket and everything read from it to the
+        shard that will serve it """
+        messages = connection.readFrames()
+        if messages is None or messages:
+            del self.newConnections[connection.fileno()]
+            self.poller.unregister(connection.fileno())
+        if not messages:
+            if messages is None:
+                connection.close()
+            return
+        connectData = decodeMessage(messages[0])[0]
+        shardIndex = self.chooseShard(connectData.get('interest'))
+        # The shard is given the messages framed as they were sent, and any part of the next message read so far
+        initialBytes = ''.join(frame_msg(message) for message in messages) + str(connection.frameReader.buffer)
+        handoffSocket = self.handoffSockets[shardIndex]
+        send_msg(handoffSocket, json.dumps({'address': list(connection.address)}))
+        send_msg(handoffSocket, initialBytes)
+        reduction.send_handle(handoffSocket, connection.socket.fileno(), self.processes[shardIndex].pid)
+        connection.close()
+        logging.info("Handed connection from %s to shard %d", connection.address, shardIndex)
+
+    def chooseShard(self, interest):
+        if interest is not None:
+            return getSectorOf((int(interest['center'][0]), int(interest['center'][1])), self.numShards)
+        shardIndex = self.nextShard
+        self.nextShard = (self.nextShard + 1) % self.numShards
+        return shardIndex
+
+    def routeShardMessages(self, link):
+        """ Pass each message from a shard on to the shard or shards named by its first byte """
+        messages = link.readFrames()
+        if messages is None:
+            logging.error("Lost shard %d", link.address[1])
+            self.running = False
+            return
+        touched = set()
+        for message in messages:
+            destination = ord(message[0])
+            targets = [other for other in self.links if other is not link] if destination == BROADCAST \
+                else [self.links[destination]]
+            payload = message[1:]
+            for target in targets:
+                target.addPayloadToSend(payload)
+                touched.add(target)
+        for target in touched:
+            self.flush(target)
+
+    def flush(self, link):
+        if not link.sendPendingData():
+            logging.error("Lost shard %d", link.address[1])
+            self.running = False
+            return
+        self.poller.modify(link.fileno(), EventPoller.READ | (EventPoller.WRITE if link.hasDataToSend() else 0))
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    arguments = [argument for argument in sys.argv[1:] if not argument.startswith('--')]
+    numShards = int(arguments[0]) if arguments else min(multiprocessing.cpu_count(), MAX_SHARDS)
+    router = ShardRouter(numShards, journalDirectory=None if '--no-journal' in sys.argv[1:] else JOURNAL_DIRECTORY)
+    logging.info("Serving with %d shards", numShards)
+    try:
+        router.run()
+    except KeyboardInterrupt:
+        pass
+    logging.info("Exiting sharded server")
@@ -0,0 +1,184 @@
+import struct, json, binascii
+from GameState import parseTimestamp
+
+# Codecs a message can be encoded with, JSON is always understood and kept for debugging
+JSON_CODEC = 'json'
+BINARY_CODEC = 'binary'
+SUPPORTED_CODECS = (BINARY_CODEC, JSON_CODEC)
+# Binary messages start with this byte, which can never start a JSON message as those are always a list
+BINARY_MAGIC = '\xb1'
+
+# Record opcodes. Anything that is not an Add, Remove or Move of a known target is sent as an embedded JSON record
+OPCODE_JSON = 0
+OPCODES = {'Add': 1, 'Remove': 2, 'Move': 3}
+OPCODE_TYPES = dict((opcode, commandType) for commandType, opcode in OPCODES.items())
+TARGETS = {'Tile': 1, 'Piece': 2}
+TARGET_NAMES = dict((code, target) for target, code in TARGETS.items())
+# Record flags
+FLAG_UUID_ID = 1
+FLAG_HAS_DATA = 2
+FLAG_HAS_VERSION = 4
+# The session a command came from and its sequence number there, which break ties between equal timestamps
+FLAG_HAS_ORIGIN = 8
+FLAG_UUID_ORIGIN = 16
+FLAG_HAS_SEQ = 32
+
+# opcode, target, flags
+RECORD_HEADER = struct.Struct('>BBB')
+UUID_ID_LENGTH = 16
+STRING_LENGTH = struct.Struct('>B')
+JSON_LENGTH = struct.Struct('>I')
+# The fields after the id of each opcode's record, row, col and then the created and modified timestamps an opcode has
+RECORD_FIELDS = {OPCODES['Add']: struct.Struct('>hhqq'),
+                 OPCODES['Remove']: struct.Struct('>q'),
+                 OPCODES['Move']: struct.Struct('>hhq')}
+# The whole fixed part of each record when its id is a UUID, packed in one call as this is the common case
+UUID_RECORDS = dict((opcode, struct.Struct('>BBB16s' + fields.format[1:])) for opcode, fields in RECORD_FIELDS.items())
+VERSION = struct.Struct('>I')
+SEQ = struct.Struct('>I')
+RECORD_COUNT = struct.Struct('>I')
+
+def encodeMessage(dataItems, codec=JSON_CODEC):
+    """ Encode a list of data items as the payload of one message """
+    if codec == BINARY_CODEC:
+        return encodeBinary(dataItems)
+    return json.dumps(dataItems, separators=(',', ':'))
+
+def decodeMessage(payload):
+    """ The list of data items in a message payload, in whichever codec it was encoded with """
+    if payload[:1] == BINARY_MAGIC:
+        return decodeBinary(payload)
+    return json.loads(payload)
+
+def chooseCodec(codecs):
+    """ The preferred codec from those a client supports """
+    for codec in SUPPORTED_CODECS:
+        if codecs is not None and codec in codecs:
+            return codec
+    return JSON_CODEC
+
+# --------------------------- Binary codec --------------------------------------------
+def encodeBinary(dataItems):
+    parts = [BINARY_MAGIC, RECORD_COUNT.pack(len(dataItems))]
+    for data in dataItems:
+        record = encodeRecord(data)
+        parts.append(record if record is not None else encodeJsonRecord(data))
+    return ''.join(parts)
+
+def encodeRecord(data):
+    """ The compact binary encoding of an Add, Remove or Move, or None if data cannot be represented in one """
+    opcode = OPCODES.get(data.get('type'))
+    target = TARGETS.get(data.get('target'))
+    modified = data.get('modified', data.get('timestamp'))
+    id = data.get('id')
+    if opcode is None or target is None or modified is None or not isinstance(id, basestring):
+        return None
+    flags = 0
+    try:
+        modified = parseTimestamp(modified)
+        if opcode == OPCODES['Remove']:
+            fields = (modified,)
+        elif opcode == OPCODES['Add']:
+            fields = tuple(data['tilePosition']) + (parseTimestamp(data.get('created', modified)), modified)
+        else:
+            fields = tuple(data['tilePosition']) + (modified,)
+        optionalParts = []
+        if data.get('data') is not None:
+            flags |= FLAG_HAS_DATA
+            optionalParts.append(packString(data['data']))
+        if data.get('version') is not None:
+            flags |= FLAG_HAS_VERSION
+            optionalParts.append(VERSION.pack(data['version']))
+        if data.get('origin'):
+            originBytes = uuidToBytes(data['origin'])
+            if originBytes is not None:
+                flags |= FLAG_HAS_ORIGIN | FLAG_UUID_ORIGIN
+                optionalParts.append(originBytes)
+            else:
+                flags |= FLAG_HAS_ORIGIN
+                optionalParts.append(packString(data['origin']))
+        if data.get('seq'):
+            flags |= FLAG_HAS_SEQ
+            optionalParts.append(SEQ.pack(data['seq']))
+        idBytes = uuidToBytes(id)
+        if idBytes is not None:
+            record = UUID_RECORDS[opcode].pack(opcode, target, flags | FLAG_UUID_ID, idBytes, *fields)
+        else:
+            record = RECORD_HEADER.pack(opcode, target, flags) + packString(id) + RECORD_FIELDS[opcode].pack(*fields)
+    except (struct.error, KeyError, ValueError, TypeError, AttributeError):
+        return None
+    return record + ''.join(optionalParts)
+
+def encodeJsonRecord(data):
+    encoded = json.dumps(data, separators=(',', ':'))
+    return RECORD_HEADER.pack(OPCODE_JSON, 0, 0) + JSON_LENGTH.pack(len(encoded)) + encoded
+
+def decodeBinary(payload):
+    count = RECORD_COUNT.unpack_from(payload, 1)[0]
+    offset = 1 + RECORD_COUNT.size
+    dataItems = []
+    for _ in xrange(count):
+        opcode, target, flags = RECORD_HEADER.unpack_from(payload, offset)
+        offset += RECORD_HEADER.size
+        if opcode == OPCODE_JSON:
+            length = JSON_LENGTH.unpack_from(payload, offset)[0]
+            offset += JSON_LENGTH.size
+            dataItems.append(json.loads(payload[offset:offset + length]))
+            offset += length
+            continue
+        data = {'type': OPCODE_TYPES[opcode], 'target': TARGET_NAMES[target]}
+        if flags & FLAG_UUID_ID:
+            data['id'] = bytesToUuid(payload[offset:offset + UUID_ID_LENGTH])
+            offset += UUID_ID_LENGTH
+        else:
+            data['id'], offset = unpackString(payload, offset)
+        fieldsStruct = RECORD_FIELDS[opcode]
+        fields = fieldsStruct.unpack_from(payload, offset)
+        offset += fieldsStruct.size
+        if opcode == OPCODES['Add']:
+            data['tilePosition'] = [fields[0], fields[1]]
+            data['created'], data['modified'] = fields[2], fields[3]
+        elif opcode == OPCODES['Move']:
+            data['tilePosition'] = [fields[0], fields[1]]
+            data['modified'] = fields[2]
+        else:
+            data['modified'] = fields[0]
+        if flags & FLAG_HAS_DATA:
+            data['data'], offset = unpackString(payload, offset)
+        if flags & FLAG_HAS_VERSION:
+            data['version'] = VERSION.unpack_from(payload, offset)[0]
+            offset += VERSION.size
+        if flags & FLAG_UUID_ORIGIN:
+            data['origin'] = bytesToUuid(payload[offset:offset + UUID_ID_LENGTH])
+            offset += UUID_ID_LENGTH
+        elif flags & FLAG_HAS_ORIGIN:
+            data['origin'], offset = unpackString(payload, offset)
+        if flags & FLAG_HAS_SEQ:
+            data['seq'] = SEQ.unpack_from(payload, offset)[0]
+            offset += SEQ.size
+        dataItems.append(data)
+    return dataItems
+
+def packString(value):
+    encoded = value.encode('utf-8')
+    if len(encoded) > 255:
+        raise ValueError("String too long for the binary codec: %s" % value)
+    return STRING_LENGTH.pack(len(encoded)) + encoded
+
+def unpackString(payload, offset):
+    length = STRING_LENGTH.unpack_from(payload, offset)[0]
+    start = offset + STRING_LENGTH.size
+    return payload[start:start + length].decode('utf-8'), start + length
+
+def uuidToBytes(id):
+    """ The 16 bytes of a canonically formatted lower case UUID string, or None if id is not one """
+    if len(id) != 36 or id[8] != '-' or id[13] != '-' or id[18] != '-' or id[23] != '-' or id != id.lower():
+        return None
+    try:
+        return binascii.unhexlify(id.replace('-', ''))
+    except (TypeError, ValueError):
+        return None
+
+def bytesToUuid(idBytes):
+    hexId = binascii.hexlify(idBytes)
+    return '%s-%s-%s-%s-%s' % (hexId[:8], hexId[8:12], hexId[12:16], hexId[16:20], hexId[20:])
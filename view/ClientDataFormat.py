@@ -1,25 +1,55 @@
+from Queue import Empty
 from thor.view import HexCoordSys
+from graeae.GameState import expandRange
 
 class TileEventProcessor(object):
     def __init__(self, targetType, session):
         self.targetType = targetType
         self.session = session
-        self.incomingEventQueue = self.session.getUnreadDataQueue()
+        self.incomingEventQueue = self.session.getUnreadDataQueue(targetType)
 
     """ Mixin allowing a class to receive an external event encoding as an add or remove method call """
     def processAnyNewData(self):
-        # Not sure if python supports non-blocking queue iteration, so do this as a while
-        event = self.incomingEventQueue.get(block=False)
-        while (event is not None):
+        while True:
+            try:
+                event = self.incomingEventQueue.get(block=False)
+            except Empty:
+                return
+            if event["type"] == "Snapshot":
+                self.processSnapshot(event["entities"])
+                continue
+            if event["type"] == "AddRange":
+                self.processRange(event)
+                continue
             data = event.get("data")
             id = event["id"]
             # TODO handle multiple moves
-            if event["type"] == "Remove" or event["type"] == "Move":
-                data = self.remove(id)
-            if event["type"] == "Add" or event["type"] == "Move":
-                tilePosition = HexCoordSys.getTilePosition(int(event["tilePosition"][0]), int(event["tilePosition"][1]))
+            if event["type"] == "Remove":
+                self.remove(id)
+                continue
+            tilePosition = HexCoordSys.getTilePosition(int(event["tilePosition"][0]), int(event["tilePosition"][1]))
+            if event["type"] == "Move":
+                self.move(id, tilePosition)
+            elif event["type"] == "Add":
                 self.add(id, tilePosition, data)
-            event = self.incomingEventQueue.get(block=False)
+
+    def move(self, id, tilePosition):
+        """ Move by removing and re-adding, processors that can move in place override this """
+        data = self.remove(id)
+        self.add(id, tilePosition, data)
+
+    def processSnapshot(self, entities):
+        """ Replace everything this processor manages with the entities in a snapshot of the server state """
+        for id in list(self.getIds()):
+            self.remove(id)
+        for id, row, col, data, created, modified in entities:
+            self.add(id, HexCoordSys.getTilePosition(int(row), int(col)), data)
+
+    def processRange(self, event):
+        """ Add everything in a bulk AddRange, which is expanded here rather than sent an Add at a time """
+        data = event.get("data")
+        for id, (row, col) in expandRange(event):
+            self.add(id, HexCoordSys.getTilePosition(row, col), data)
 
     def createRemoveEvent(self, id):
         self.session.addDataToSend(**{'type':'Remove', 'target':self.targetType, 'id':str(id)})
@@ -1,5 +1,10 @@
 import math, logging
 from collections import namedtuple
+try:
+    import numpy
+except ImportError:
+    # Only the batch conversion functions need numpy
+    numpy = None
 
 TileCubePosition = namedtuple("TileCubePosition", "x y z")
 def getCubePosOf(tilePosition):
@@ -65,6 +70,13 @@ borders={"NE": (lambda tilePos, posns: edgeDirections["NE"](tilePos) not in posn
                                    and edgeDirections["NW"](tilePos) not in posns),
          "N": (lambda tilePos, posns: edgeDirections["NW"](tilePos) not in posns
                                    and edgeDirections["NE"](tilePos) not in posns)}
+# Offsets (row, col) to each of the neighbours, matching the keys of edgeDirections and diagonalDirections
+EDGE_DIRECTION_KEYS = ("NE", "E", "SE", "SW", "W", "NW")
+EDGE_OFFSETS = ((-1, 1), (0, 1), (1, 0), (1, -1), (0, -1), (-1, 0))
+DIAGONAL_DIRECTION_KEYS = ("N", "ENE", "ESE", "S", "WSW", "WNW")
+DIAGONAL_OFFSETS = ((-2, 1), (-1, 2), (1, 1), (2, -1), (1, -2), (-1, -1))
+# Each border is formed by a missing pair of adjacent edge neighbours, edge i and edge i + 1
+BORDER_KEYS = ("NE", "SE", "S", "SW", "NW", "N")
 
 # --------------------------- TilePosition comparison functions --------------------------------------------
 def distanceBetween(tilePos1, tilePos2):
@@ -115,7 +127,6 @@ def getTilesWithin(distance, ofTilePosition):
 
 # ------------------------ Pixel conversion functions -----------------------------------------------------
 ScreenCoordinate = namedtuple("ScreenCoordinate", "x y")
-#TODO pixel functions would be clearer and more efficient if written as matrix operations and run in numpy
 def hexToPixel(tilePosition, hexEdgeLength, centerPixel):
     x = round(hexEdgeLength * math.sqrt(3) * (tilePosition.col + tilePosition.row/2.0))
     y = round(hexEdgeLength * 3/2.0 * tilePosition.row)
@@ -128,4 +139,63 @@ def pixelToHex(screenCoordinate, hexEdgeLength, centerPixel):
     y = screenCoordinate.y - centerPixel.y
     # Need to use roundPosition() to translate this to a valid hex
     return TilePosition(row=2/3.0 * y / float(hexEdgeLength),
-                        col=(1/3.0 * math.sqrt(3) * x - 1/3.0 * y) / float(hexEdgeLength)).roundPosn()
\ No newline at end of file
+                        col=(1/3.0 * math.sqrt(3) * x - 1/3.0 * y) / float(hexEdgeLength)).roundPosn()
+
+def getPositionsInRect(left, top, right, bottom, hexEdgeLength, centerPixel):
+    """ Every position whose center pixel is within the rectangle, found row by row from the bounds rather than by
+    checking positions, so it costs only as much as the number of positions in view """
+    rowHeight = 3/2.0 * hexEdgeLength
+    colWidth = math.sqrt(3) * hexEdgeLength
+    positions = []
+    for row in xrange(int(math.ceil((top - centerPixel.y) / rowHeight)),
+                      int(math.floor((bottom - centerPixel.y) / rowHeight)) + 1):
+        rowShift = centerPixel.x + colWidth * row/2.0
+        positions.extend(TilePosition(row=row, col=col)
+                         for col in xrange(int(math.ceil((left - rowShift) / colWidth)),
+                                           int(math.floor((right - rowShift) / colWidth)) + 1))
+    return positions
+
+def hexToPixelBatch(tilePositions, hexEdgeLength, centerPixel):
+    """ Convert an (N,2) array of row, col tile positions into an (N,2) int array of x, y screen coordinates of their
+    centers, the same as hexToPixel gives for each. The positions will be centered around centerPixel """
+    tilePositions = numpy.asarray(tilePositions, dtype=float).reshape(-1, 2)
+    # The same operations in the same order as hexToPixel, so each coordinate is rounded from the same float
+    x = hexEdgeLength * math.sqrt(3) * (tilePositions[:, 1] + tilePositions[:, 0]/2.0)
+    y = hexEdgeLength * 3/2.0 * tilePositions[:, 0]
+    return numpy.column_stack((roundHalfAwayFromZero(x) + centerPixel.x, roundHalfAwayFromZero(y) + centerPixel.y))
+
+def pixelToHexBatch(screenCoordinates, hexEdgeLength, centerPixel):
+    """ Convert an (N,2) array of x, y screen coordinates into an (N,2) int array of the row, col of the tiles under
+    them, the same as pixelToHex gives for each. The tiles are centered around centerPixel """
+    offsets = numpy.asarray(screenCoordinates, dtype=float).reshape(-1, 2) - (centerPixel.x, centerPixel.y)
+    x = offsets[:, 0]
+    y = offsets[:, 1]
+    return roundPositionsBatch(numpy.column_stack((2/3.0 * y / float(hexEdgeLength),
+                                                   (1/3.0 * math.sqrt(3) * x - 1/3.0 * y) / float(hexEdgeLength))))
+
+def roundPositionsBatch(tilePositions):
+    """ The vectorised form of TilePosition.roundPosn, rounding an (N,2) float array of row, col positions to an int
+    array of the nearest valid tiles """
+    tilePositions = numpy.asarray(tilePositions, dtype=float).reshape(-1, 2)
+    z = tilePositions[:, 0]
+    x = tilePositions[:, 1]
+    y = -x - z
+    rx = roundHalfAwayFromZero(x)
+    ry = roundHalfAwayFromZero(y)
+    rz = roundHalfAwayFromZero(z)
+    xDiff = numpy.abs(rx - x)
+    yDiff = numpy.abs(ry - y)
+    zDiff = numpy.abs(rz - z)
+    fixX = (xDiff > yDiff) & (xDiff > zDiff)
+    fixZ = ~fixX & (yDiff <= zDiff)
+    rx = numpy.where(fixX, -ry - rz, rx)
+    rz = numpy.where(fixZ, -rx - ry, rz)
+    return numpy.column_stack((rz, rx))
+
+def roundHalfAwayFromZero(values):
+    """ Round a float array to an int array the same way as the builtin round, as numpy rounds halves to even """
+    magnitudes = numpy.abs(values)
+    rounded = numpy.floor(magnitudes)
+    # The fractional part is exact, unlike adding a half before flooring
+    rounded += magnitudes - rounded >= 0.5
+    return (numpy.sign(values) * rounded).astype(int)
@@ -0,0 +1,153 @@
+import argparse, gc, json, math, platform, random, sys, time
+
+from thor.view import HexCoordSys
+from thor.view.HexCoordSys import TilePosition, ScreenCoordinate
+
+RADII = (5, 10, 50, 100, 200, 500)
+# Each measurement repeats calls until they take at least this long, and the fastest of REPEATS measurements is kept
+MIN_MEASURE_SEC = 0.1
+REPEATS = 5
+# How many different inputs each function is called with, in turn
+NUM_INPUTS = 1000
+# By default a result is a regression if it is this fraction slower than its baseline, or if it allocates more
+SLOWDOWN_TOLERANCE = 0.1
+EDGE_LENGTH = 30
+CENTER_PIXEL = ScreenCoordinate(x=400, y=300)
+CENTER = TilePosition(row=0, col=0)
+
+def getRandomPosition(radius):
+    row = random.randint(-radius, radius)
+    return TilePosition(row=row, col=random.randint(max(-radius, -row - radius), min(radius, -row + radius)))
+
+def getRandomFraction(radius):
+    position = getRandomPosition(radius)
+    return TilePosition(row=position.row + random.uniform(-0.5, 0.5), col=position.col + random.uniform(-0.5, 0.5))
+
+def getOppositeCorners(radius):
+    """ A pair of positions as far apart as the board allows, as the path between them is the longest """
+    row = random.randint(-radius, 0)
+    return TilePosition(row=row, col=-radius - min(row, 0)), TilePosition(row=-row, col=radius + min(row, 0))
+
+# For each function, a function of the board radius giving the function and the argument tuples to call it with
+BENCHMARKS = {
+    'roundPosn': lambda radius: (TilePosition.roundPosn,
+                                 [(getRandomFraction(radius),) for _ in xrange(NUM_INPUTS)]),
+    'distanceBetween': lambda radius: (HexCoordSys.distanceBetween,
+                                       [(getRandomPosition(radius), getRandomPosition(radius))
+                                        for _ in xrange(NUM_INPUTS)]),
+    'getTilesWithin': lambda radius: (HexCoordSys.getTilesWithin, [(radius, CENTER)]),
+    'getShortestTilePathBetween': lambda radius: (HexCoordSys.getShortestTilePathBetween,
+                                                  [getOppositeCorners(radius) for _ in xrange(NUM_INPUTS)]),
+    'getPositionsDefinedByHexWithRowRange': lambda radius: (HexCoordSys.getPositionsDefinedByHexWithRowRange,
+                                                            [(-radius, radius)]),
+    'hexToPixel': lambda radius: (HexCoordSys.hexToPixel,
+                                  [(getRandomPosition(radius), EDGE_LENGTH, CENTER_PIXEL) for _ in xrange(NUM_INPUTS)]),
+    'pixelToHex': lambda radius: (HexCoordSys.pixelToHex,
+                                  [(HexCoordSys.hexToPixel(getRandomFraction(radius), EDGE_LENGTH, CENTER_PIXEL),
+                                    EDGE_LENGTH, CENTER_PIXEL) for _ in xrange(NUM_INPUTS)]),
+}
+
+def timeCalls(function, argsList, numCalls):
+    numArgs = len(argsList)
+    startTime = time.time()
+    for callNum in xrange(numCalls):
+        function(*argsList[callNum % numArgs])
+    return time.time() - startTime
+
+def measureOpsPerSec(function, argsList):
+    """ The most calls a second of the function over REPEATS measurements, each calling it enough times to be timed
+    reliably. The garbage collector is paused while timing, as timeit does """
+    numCalls = 1
+    while True:
+        elapsed = timeCalls(function, argsList, numCalls)
+        if elapsed >= MIN_MEASURE_SEC:
+            break
+        numCalls *= 2 if elapsed <= 0 else max(2, int(math.ceil(MIN_MEASURE_SEC / elapsed)))
+    bestElapsed = min([elapsed] + [timeCalls(function, argsList, numCalls) for _ in xrange(REPEATS - 1)])
+    return numCalls / bestElapsed
+
+def measureAllocationsPerCall(function, argsList):
+    """ How many objects tracked by the garbage collector each call leaves allocated, which is an approximation of its
+    allocations as Python 2 has no tracemalloc. The collector counts tracked objects created less those freed since it
+    last ran, so results are kept until counted and temporaries freed during a call are not included """
+    gc.collect()
+    before = gc.get_count()[0]
+    results = [function(*args) for args in argsList]
+    allocations = gc.get_count()[0] - before
+    # The list of results is not part of any call
+    return (allocations - 1) / float(len(results))
+
+def runBenchmarks(names, radii):
+    """ The ops a second and allocations per call of each named benchmark at each radius, by name then radius """
+    results = dict()
+    gcWasEnabled = gc.isenabled()
+    gc.disable()
+    try:
+        for name in names:
+            results[name] = dict()
+            for radius in radii:
+                random.seed(radius)
+                function, argsList = BENCHMARKS[name](radius)
+                results[name][str(radius)] = {'opsPerSec': measureOpsPerSec(function, argsList),
+                                              'allocationsPerCall': measureAllocationsPerCall(function, argsList)}
+                printResult(name, radius, results[name][str(radius)])
+    finally:
+        if gcWasEnabled:
+            gc.enable()
+    return results
+
+def printResult(name, radius, result, baseline=None, tolerance=SLOWDOWN_TOLERANCE):
+    line = '%-38s %6d %14.1f %12.1f' % (name, radius, result['opsPerSec'], result['allocationsPerCall'])
+    if baseline is not None:
+        line += ' %+8.1f%% %+10.1f %s' % (100 * (result['opsPerSec'] / baseline['opsPerSec'] - 1),
+                                         result['allocationsPerCall'] - baseline['allocationsPerCall'],
+                                         'REGRESSED' if isRegression(result, baseline, tolerance) else '')
+    print line
+    sys.stdout.flush()
+
+def isRegression(result, baseline, tolerance=SLOWDOWN_TOLERANCE):
+    return (result['opsPerSec'] < baseline['opsPerSec'] * (1 - tolerance) or
+            result['allocationsPerCall'] > baseline['allocationsPerCall'] + 0.5)
+
+def compare(results, baseline, tolerance=SLOWDOWN_TOLERANCE):
+    """ Print each result against the baseline it has one in, returning the number that regressed """
+    print '\nCompared with the baseline, ops/sec change and allocations per call change'
+    numRegressions = 0
+    for name in sorted(results):
+        for radius in sorted(results[name], key=int):
+            baselineResult = baseline['results'].get(name, dict()).get(radius)
+            if baselineResult is None:
+                continue
+            printResult(name, int(radius), results[name][radius], baselineResult, tolerance)
+            numRegressions += isRegression(results[name][radius], baselineResult, tolerance)
+    return numRegressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the HexCoordSys functions on the input and render paths "
+                                                 "across board radii")
+    parser.add_argument('--radii', default=','.join(str(radius) for radius in RADII),
+                        help="comma separated board radii to run each benchmark at")
+    parser.add_argument('--functions', default=','.join(sorted(BENCHMARKS)),
+                        help="comma separated names of the functions to benchmark")
+    parser.add_argument('--save', help="file to save the results to as a JSON baseline")
+    parser.add_argument('--compare', help="JSON baseline file to compare the results against, exits with a failure "
+                                          "status if any have regressed")
+    parser.add_argument('--tolerance', type=float, default=SLOWDOWN_TOLERANCE,
+                        help="fraction slower than the baseline a result can be before it is a regression")
+    args = parser.parse_args()
+    names = args.functions.split(',')
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error("No benchmark for %s" % name)
+    print '%-38s %6s %14s %12s' % ('function', 'radius', 'ops/sec', 'allocs/call')
+    results = runBenchmarks(names, [int(radius) for radius in args.radii.split(',')])
+    if args.save:
+        with open(args.save, 'w') as baselineFile:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(), 'results': results},
+                      baselineFile, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as baselineFile:
+            numRegressions = compare(results, json.load(baselineFile), args.tolerance)
+        if numRegressions:
+            print '%d results regressed' % numRegressions
+            sys.exit(1)
@@ -0,0 +1,249 @@
+import logging
+from array import array
+
+from thor.view import HexCoordSys
+from thor.view.HexCoordSys import TilePosition, numpy
+
+# Each tile has NUM_NEIGHBOURS slots in the neighbour table, the six edge neighbours in the order of
+# HexCoordSys.EDGE_DIRECTION_KEYS followed by the six diagonal neighbours in the order of DIAGONAL_DIRECTION_KEYS
+NUM_EDGE_NEIGHBOURS = len(HexCoordSys.EDGE_OFFSETS)
+NUM_NEIGHBOURS = NUM_EDGE_NEIGHBOURS + len(HexCoordSys.DIAGONAL_OFFSETS)
+NEIGHBOUR_OFFSETS = HexCoordSys.EDGE_OFFSETS + HexCoordSys.DIAGONAL_OFFSETS
+NEIGHBOUR_SLOTS = dict((key, slot) for slot, key in
+                       enumerate(HexCoordSys.EDGE_DIRECTION_KEYS + HexCoordSys.DIAGONAL_DIRECTION_KEYS))
+BORDER_BITS = dict((key, 1 << bit) for bit, key in enumerate(HexCoordSys.BORDER_KEYS))
+OFF_BOARD = -1
+# The distance in a DistanceField of tiles that have not been reached
+UNREACHED = -1
+
+class HexTopology(object):
+    """ The positions and adjacency of every tile in a hex board of the given radius, compiled into flat arrays.
+    Tiles are numbered in row-major order from the top row, so all queries are index arithmetic and array lookups """
+    def __init__(self, radius):
+        self.radius = radius
+        numRows = 2 * radius + 1
+        self.rowStarts = array('l', [0] * (numRows + 1))
+        self.rowColMins = array('l', [0] * numRows)
+        self.rows = array('l')
+        self.cols = array('l')
+        for rowIndex in range(numRows):
+            row = rowIndex - radius
+            colMin = -radius - min(0, row)
+            colMax = radius - max(0, row)
+            self.rowColMins[rowIndex] = colMin
+            self.rowStarts[rowIndex + 1] = self.rowStarts[rowIndex] + colMax - colMin + 1
+            self.rows.extend([row] * (colMax - colMin + 1))
+            self.cols.extend(range(colMin, colMax + 1))
+        self.numTiles = self.rowStarts[numRows]
+        self.neighbours = array('l', [OFF_BOARD] * (self.numTiles * NUM_NEIGHBOURS))
+        edgeNeighbours = []
+        for slot, (dRow, dCol) in enumerate(NEIGHBOUR_OFFSETS):
+            slotNeighbours = self.compileNeighbourSlot(dRow, dCol)
+            self.neighbours[slot::NUM_NEIGHBOURS] = array('l', slotNeighbours)
+            if slot < NUM_EDGE_NEIGHBOURS:
+                edgeNeighbours.append(slotNeighbours)
+        self.borderMasks = array('B', [0] * self.numTiles)
+        for bit in range(NUM_EDGE_NEIGHBOURS):
+            bitValue = 1 << bit
+            for index, (first, second) in enumerate(zip(edgeNeighbours[bit],
+                                                        edgeNeighbours[(bit + 1) % NUM_EDGE_NEIGHBOURS])):
+                if first == OFF_BOARD and second == OFF_BOARD:
+                    self.borderMasks[index] |= bitValue
+        logging.debug("Compiled topology of radius %s with %s tiles", radius, self.numTiles)
+
+    def compileNeighbourSlot(self, dRow, dCol):
+        """ The index of the neighbour at the offset dRow, dCol from every tile, computed a row at a time as the
+        neighbours of a contiguous row of tiles are a contiguous run of indices in the neighbouring row """
+        numRows = 2 * self.radius + 1
+        slotNeighbours = []
+        for rowIndex in range(numRows):
+            rowLength = self.rowStarts[rowIndex + 1] - self.rowStarts[rowIndex]
+            neighbourRowIndex = rowIndex + dRow
+            if neighbourRowIndex < 0 or neighbourRowIndex >= numRows:
+                slotNeighbours.extend([OFF_BOARD] * rowLength)
+                continue
+            neighbourStart = self.rowStarts[neighbourRowIndex]
+            neighbourLength = self.rowStarts[neighbourRowIndex + 1] - neighbourStart
+            # Offset within the neighbouring row of the neighbour of the first tile in this row
+            firstOffset = self.rowColMins[rowIndex] + dCol - self.rowColMins[neighbourRowIndex]
+            slotNeighbours.extend(neighbourStart + offset if 0 <= offset < neighbourLength else OFF_BOARD
+                                  for offset in xrange(firstOffset, firstOffset + rowLength))
+        return slotNeighbours
+
+    # --------------------------- Index conversion --------------------------------------------
+    def indexOfRowCol(self, row, col):
+        """ The flat index of the tile at row, col or OFF_BOARD """
+        rowIndex = row + self.radius
+        if rowIndex < 0 or rowIndex > 2 * self.radius:
+            return OFF_BOARD
+        colOffset = col - self.rowColMins[rowIndex]
+        if colOffset < 0 or colOffset >= self.rowStarts[rowIndex + 1] - self.rowStarts[rowIndex]:
+            return OFF_BOARD
+        return self.rowStarts[rowIndex] + colOffset
+
+    def indexOf(self, tilePosition):
+        return self.indexOfRowCol(tilePosition.row, tilePosition.col)
+
+    def indicesOfArray(self, positionArray):
+        """ The vectorised form of indexOf, for an (N,2) numpy array of row, col positions """
+        positionArray = numpy.asarray(positionArray, dtype=int).reshape(-1, 2)
+        rowIndices = positionArray[:, 0] + self.radius
+        onBoard = (rowIndices >= 0) & (rowIndices <= 2 * self.radius)
+        clippedRows = numpy.clip(rowIndices, 0, 2 * self.radius)
+        rowStarts = numpy.asarray(self.rowStarts, dtype=int)
+        colOffsets = positionArray[:, 1] - numpy.asarray(self.rowColMins, dtype=int)[clippedRows]
+        onBoard &= (colOffsets >= 0) & (colOffsets < rowStarts[clippedRows + 1] - rowStarts[clippedRows])
+        return numpy.where(onBoard, rowStarts[clippedRows] + colOffsets, OFF_BOARD)
+
+    def positionOf(self, index):
+        return TilePosition(row=self.rows[index], col=self.cols[index])
+
+    def positionsOf(self, indices):
+        return [TilePosition(row=self.rows[index], col=self.cols[index]) for index in indices]
+
+    def isOnBoard(self, tilePosition):
+        return self.indexOf(tilePosition) != OFF_BOARD
+
+    # --------------------------- Neighbourhood queries --------------------------------------------
+    def getNeighbourIndex(self, index, directionKey):
+        """ The index of the neighbour in the edge or diagonal direction with the given key, or OFF_BOARD """
+        return self.neighbours[index * NUM_NEIGHBOURS + NEIGHBOUR_SLOTS[directionKey]]
+
+    def getEdgeNeighbourIndices(self, index):
+        """ The indices of the six edge neighbours, OFF_BOARD for any that are not on the board """
+        base = index * NUM_NEIGHBOURS
+        return self.neighbours[base:base + NUM_EDGE_NEIGHBOURS]
+
+    def getIndicesWithin(self, distance, index):
+        """ The indices of every tile on the board within distance of the tile at index, including itself """
+        row, col = self.rows[index], self.cols[index]
+        indices = []
+        for dRow in range(max(-distance, -self.radius - row), min(distance, self.radius - row) + 1):
+            rowIndex = row + dRow + self.radius
+            rowStart = self.rowStarts[rowIndex]
+            colMin = self.rowColMins[rowIndex]
+            colMax = colMin + self.rowStarts[rowIndex + 1] - rowStart - 1
+            # Clip the hex range of cols at this row to the cols on the board
+            firstCol = max(col + max(-distance, -dRow - distance), colMin)
+            lastCol = min(col + min(distance, -dRow + distance), colMax)
+            indices.extend(range(rowStart + firstCol - colMin, rowStart + lastCol - colMin + 1))
+        return indices
+
+    def hasBorder(self, index, borderKey):
+        return self.borderMasks[index] & BORDER_BITS[borderKey] != 0
+
+    def getIndicesOnBorder(self, borderKey):
+        bit = BORDER_BITS[borderKey]
+        return [index for index, mask in enumerate(self.borderMasks) if mask & bit]
+
+    def getIndicesAlong(self, directionKey, index):
+        """ The indices from index in a straight line in the given direction until the edge of the board """
+        slot = NEIGHBOUR_SLOTS[directionKey]
+        indices = []
+        while index != OFF_BOARD:
+            indices.append(index)
+            index = self.neighbours[index * NUM_NEIGHBOURS + slot]
+        return indices
+
+    # --------------------------- Pathfinding --------------------------------------------
+    def getDistanceField(self, sourceIndices, costs):
+        """ A DistanceField from the tiles at sourceIndices. costs is a sequence indexed by tile index giving the cost
+        of entering that tile, at least 1, or 0 if the tile cannot be entered. Source tiles are never costed """
+        return DistanceField(self, sourceIndices, costs)
+
+class DistanceField(object):
+    """ The cheapest cost of reaching each tile from the nearest of a set of source tiles, and the tile it is reached
+    from, as arrays indexed by tile. Found by Dijkstra's algorithm with a bucket for each cost as costs are small
+    integers, which with unit costs is a breadth first search. The search only goes as far as it has been asked about
+    and continues from where it stopped when asked about further tiles, so every query on a field shares the work """
+    def __init__(self, topology, sourceIndices, costs):
+        self.topology = topology
+        self.costs = costs
+        # Distances are final for settled tiles, and the best found so far for others
+        self.distances = array('l', [UNREACHED]) * topology.numTiles
+        self.parents = array('l', [OFF_BOARD]) * topology.numTiles
+        self.settled = bytearray(topology.numTiles)
+        # The settled tiles in the order they were settled, which is in order of distance
+        self.reached = []
+        self.buckets = {0: list(sourceIndices)}
+        self.numQueued = len(self.buckets[0])
+        # Every tile at this distance or less has been settled
+        self.settledDistance = -1
+        for index in sourceIndices:
+            self.distances[index] = 0
+
+    def expandTo(self, maxDistance):
+        """ Settle every tile within maxDistance """
+        distances, parents, settled, costs = self.distances, self.parents, self.settled, self.costs
+        neighbours = self.topology.neighbours
+        buckets, reached = self.buckets, self.reached
+        while self.numQueued and self.settledDistance < maxDistance:
+            distance = self.settledDistance + 1
+            self.settledDistance = distance
+            bucket = buckets.pop(distance, None)
+            if bucket is None:
+                continue
+            self.numQueued -= len(bucket)
+            for index in bucket:
+                # Skip entries superseded by a shorter route found since they were queued
+                if settled[index] or distances[index] != distance:
+                    continue
+                settled[index] = 1
+                reached.append(index)
+                base = index * NUM_NEIGHBOURS
+                for nextIndex in neighbours[base:base + NUM_EDGE_NEIGHBOURS]:
+                    if nextIndex == OFF_BOARD or settled[nextIndex]:
+                        continue
+                    stepCost = costs[nextIndex]
+                    if not stepCost:
+                        continue
+                    nextDistance = distance + stepCost
+                    if distances[nextIndex] == UNREACHED or nextDistance < distances[nextIndex]:
+                        distances[nextIndex] = nextDistance
+                        parents[nextIndex] = index
+                        buckets.setdefault(nextDistance, []).append(nextIndex)
+                        self.numQueued += 1
+
+    def isReachable(self, index):
+        """ Whether index can be reached, searching as far as needed to find out """
+        while not self.settled[index] and self.numQueued:
+            self.expandTo(max(self.settledDistance + 1, self.distances[index]))
+        return self.settled[index] != 0
+
+    def getDistance(self, index):
+        """ The cost of reaching index from the nearest source, or UNREACHED """
+        return self.distances[index] if self.isReachable(index) else UNREACHED
+
+    def getIndicesWithin(self, distance):
+        """ The indices of every tile that can be reached at a cost of at most distance, nearest first """
+        self.expandTo(distance)
+        distances = self.distances
+        indices = []
+        for index in self.reached:
+            if distances[index] > distance:
+                break
+            indices.append(index)
+        return indices
+
+    def getPathTo(self, index):
+        """ The cheapest path of indices from the nearest source to index inclusive, or None if it cannot be reached """
+        if not self.isReachable(index):
+            return None
+        parents = self.parents
+        path = []
+        while index != OFF_BOARD:
+            path.append(index)
+            index = parents[index]
+        path.reverse()
+        return path
+
+cachedTopologies = dict()
+def getTopologyForRadius(radius):
+    """ The shared topology for a board of the given radius, compiled on first use """
+    topology = cachedTopologies.get(radius)
+    if topology is None:
+        topology = cachedTopologies[radius] = HexTopology(radius)
+    return topology
+
+def getTopologyForEdge(edgeLength):
+    return getTopologyForRadius(edgeLength - 1)
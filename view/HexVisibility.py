@@ -0,0 +1,133 @@
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from fractions import gcd
+
+from thor.view import HexCoordSys
+from thor.view.HexTopology import OFF_BOARD
+
+# Angles are fractions of a full turn around the source. Shadow edges and tile centers from different rings are computed
+# with different denominators, so they are compared with this tolerance. Distinct angles on a board of radius r differ
+# by at least 1 / (72 * r * r), far more than this for any board that fits in memory
+ANGLE_TOLERANCE = 1e-9
+# Walking a ring of radius r starts r tiles in this direction from its center, then goes r tiles in each edge direction
+RING_START_OFFSET = HexCoordSys.EDGE_OFFSETS[4]
+
+class Shadows(object):
+    """ The arcs around the source hidden behind blockers, as sorted open intervals of a turn. Intervals that only
+    touch are kept apart, as a line through the point where they meet passes between the blockers rather than through
+    either of them """
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+
+    def covers(self, angle):
+        i = bisect_right(self.starts, angle - ANGLE_TOLERANCE) - 1
+        return i >= 0 and self.ends[i] > angle + ANGLE_TOLERANCE
+
+    def add(self, start, end):
+        starts, ends = self.starts, self.ends
+        # Merge with every interval the new one overlaps
+        first = bisect_right(ends, start + ANGLE_TOLERANCE)
+        last = bisect_left(starts, end - ANGLE_TOLERANCE)
+        if first < last:
+            start = min(start, starts[first])
+            end = max(end, ends[last - 1])
+        starts[first:last] = [start]
+        ends[first:last] = [end]
+
+    def isComplete(self):
+        return len(self.starts) == 1 and self.starts[0] < -ANGLE_TOLERANCE and self.ends[0] > 1 - ANGLE_TOLERANCE
+
+def getTieRings(position, ring):
+    """ The nearer rings a line from the source to the tile at position in ring passes exactly between two tiles of.
+    The line crosses ring k at position * k / ring, which is halfway between two positions when 2 * position * k is an
+    odd multiple of ring """
+    offset = position % ring
+    period = ring // gcd(offset, ring) if offset else 1
+    if period % 2:
+        return ()
+    return xrange(period // 2, ring, period)
+
+def getVisibleIndices(topology, sourceIndex, radius, blockers):
+    """ The indices of every tile within radius of sourceIndex that can be seen from it, including the source. blockers
+    is a sequence indexed by tile that is non zero for tiles that block sight, which are visible themselves but hide
+    what is behind them. This is the same as there being no blocker between them on getShortestTilePathBetween.
+
+    A single shadowcasting sweep goes out a ring at a time, where each tile covers an equal arc of its ring. A line from
+    the source crosses each nearer ring at the same angle as the center of the tile it goes to, so a tile is hidden when
+    its center is within the arc of a nearer blocker. Where the line passes exactly between two tiles of a ring the
+    tile it goes through is found as getShortestTilePathBetween rounds it """
+    visible = [sourceIndex]
+    shadows = Shadows()
+    sourceRow, sourceCol = topology.rows[sourceIndex], topology.cols[sourceIndex]
+    source = topology.positionOf(sourceIndex)
+    indexOfRowCol = topology.indexOfRowCol
+    for ring in xrange(1, radius + 1):
+        numInRing = 6 * ring
+        halfArc = 0.5 / numInRing
+        row = sourceRow + RING_START_OFFSET[0] * ring
+        col = sourceCol + RING_START_OFFSET[1] * ring
+        position = 0
+        ringBlockers = []
+        for dRow, dCol in HexCoordSys.EDGE_OFFSETS:
+            for _ in xrange(ring):
+                index = indexOfRowCol(row, col)
+                if index != OFF_BOARD:
+                    if not shadows.covers(float(position) / numInRing):
+                        tieRings = getTieRings(position, ring)
+                        if not tieRings or not isBlockedAt(topology, source, row, col, ring, tieRings, blockers):
+                            visible.append(index)
+                    # Hidden blockers still cast shadows, as they block every line through them
+                    if blockers[index]:
+                        ringBlockers.append(position)
+                position += 1
+                row += dRow
+                col += dCol
+        # Added once the ring is done, as tiles in the same ring do not hide each other
+        for position in ringBlockers:
+            center = float(position) / numInRing
+            shadows.add(center - halfArc, center + halfArc)
+            # The first tile of each ring straddles the start of the turn
+            if position == 0:
+                shadows.add(1 - halfArc, 1 + halfArc)
+        if shadows.isComplete():
+            break
+    return visible
+
+def isBlockedAt(topology, source, row, col, distance, rings, blockers):
+    """ Whether the line from source to row, col goes through a blocker in any of rings, rounded to tiles with the
+    same arithmetic as getShortestTilePathBetween """
+    diffFactor = HexCoordSys.TilePosition(row=row, col=col) - source
+    ratioFactor = 1.0 / float(distance)
+    for ring in rings:
+        tilePosition = source + (diffFactor * ring) * ratioFactor
+        index = topology.indexOf(tilePosition)
+        if index != OFF_BOARD and blockers[index]:
+            return True
+    return False
+
+def getVisibilityMask(topology, sourceIndex, radius, blockers):
+    """ A bytearray indexed by tile that is 1 for the tiles visible as for getVisibleIndices """
+    mask = bytearray(topology.numTiles)
+    for index in getVisibleIndices(topology, sourceIndex, radius, blockers):
+        mask[index] = 1
+    return mask
+
+def haveLineOfSight(topology, indexPairs, blockers):
+    """ Whether the second tile of each (from, to) pair of indices can be seen from the first, as for
+    getVisibleIndices. Pairs are grouped by the tile they are seen from, so each is swept once out to its furthest
+    target however many targets it has """
+    pairsFrom = defaultdict(list)
+    for pairNum, (fromIndex, toIndex) in enumerate(indexPairs):
+        pairsFrom[fromIndex].append((pairNum, toIndex))
+    results = [False] * len(indexPairs)
+    for fromIndex, targets in pairsFrom.iteritems():
+        radius = max(HexCoordSys.distanceBetween(topology.positionOf(fromIndex), topology.positionOf(toIndex))
+                     for _, toIndex in targets)
+        mask = getVisibilityMask(topology, fromIndex, radius, blockers)
+        for pairNum, toIndex in targets:
+            results[pairNum] = mask[toIndex] != 0
+    return results
+
+def hasLineOfSight(topology, fromIndex, toIndex, blockers):
+    return haveLineOfSight(topology, ((fromIndex, toIndex),), blockers)[0]
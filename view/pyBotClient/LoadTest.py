@@ -0,0 +1,238 @@
+import argparse, logging, multiprocessing, os, random, subprocess, sys, time, uuid
+
+from thor.view import HexCoordSys
+from thor.view.ClientDataFormat import TileEventProcessor
+from graeae.Session import ClientSession, COMMAND_TYPES
+
+SERVER_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'server')
+# Players act and read what they have been sent this often
+TICK_SEC = 0.005
+# Samples from the start of each step are dropped, while the players are still connecting and catching up
+WARMUP_SEC = 1.0
+# How a player chooses what to do when it has pieces, anything else is a Move
+ADD_CHANCE = 0.2
+REMOVE_CHANCE = 0.1
+# Each player keeps roughly this many pieces, adding more often when it has fewer
+TARGET_PIECES = 10
+PERCENTILES = (50, 90, 99)
+
+class BotSession(ClientSession):
+    """ A ClientSession that measures how long each command it is relayed took to arrive. Commands carry the time they
+    were sent as their modified timestamp, which is comparable as every player runs on the same host """
+    def __init__(self, *args, **kwargs):
+        self.latenciesMs = []
+        self.numReceived = 0
+        super(BotSession, self).__init__(*args, **kwargs)
+
+    def addUnreadData(self, socket, data):
+        if data.get('type') in COMMAND_TYPES and isinstance(data.get('modified'), (int, long)):
+            self.latenciesMs.append(time.time() * 1000 - data['modified'])
+            self.numReceived += 1
+        super(BotSession, self).addUnreadData(socket, data)
+
+class BotPlayer(TileEventProcessor):
+    """ A simulated player without a display, that adds, moves and removes its own pieces at random at a given rate
+    and keeps track of every piece on the board from what it is sent """
+    def __init__(self, rate, radius):
+        self.interval = 1.0 / rate
+        self.radius = radius
+        self.center = HexCoordSys.getTilePosition(0, 0)
+        self.pieces = dict()
+        self.ownIds = []
+        self.numSent = 0
+        self.nextActionTime = time.time() + random.random() * self.interval
+        super(BotPlayer, self).__init__('Piece', BotSession())
+
+    def isConnected(self):
+        return self.session.socket is not None
+
+    def update(self, now):
+        self.processAnyNewData()
+        while now >= self.nextActionTime:
+            self.act()
+            self.nextActionTime += self.interval
+
+    def act(self):
+        choice = random.random()
+        if not self.ownIds or choice < ADD_CHANCE * TARGET_PIECES / max(len(self.ownIds), 1):
+            id = str(uuid.uuid4())
+            tilePosition = self.getRandomPosition()
+            self.ownIds.append(id)
+            self.pieces[id] = tilePosition
+            self.createAddEvent(id, (tilePosition.row, tilePosition.col))
+        elif choice > 1 - REMOVE_CHANCE:
+            id = self.ownIds.pop(random.randrange(len(self.ownIds)))
+            self.pieces.pop(id, None)
+            self.createRemoveEvent(id)
+        else:
+            id = random.choice(self.ownIds)
+            tilePosition = self.pieces[id]
+            neighbours = [HexCoordSys.getTilePosition(tilePosition.row + dRow, tilePosition.col + dCol)
+                          for dRow, dCol in HexCoordSys.EDGE_OFFSETS]
+            tilePosition = random.choice([neighbour for neighbour in neighbours
+                                          if HexCoordSys.distanceBetween(self.center, neighbour) <= self.radius])
+            self.pieces[id] = tilePosition
+            self.createMoveEvent(id, (tilePosition.row, tilePosition.col))
+        self.numSent += 1
+
+    def getRandomPosition(self):
+        row = random.randint(-self.radius, self.radius)
+        col = random.randint(max(-self.radius, -row - self.radius), min(self.radius, -row + self.radius))
+        return HexCoordSys.getTilePosition(row, col)
+
+    def add(self, id, tilePosition, data):
+        self.pieces[id] = tilePosition
+
+    def remove(self, id):
+        self.pieces.pop(id, None)
+
+    def getIds(self):
+        return self.pieces.keys()
+
+    def close(self):
+        self.session.close()
+
+def runPlayers(numPlayers, rate, radius, duration, results):
+    """ Run players in this process for duration seconds, putting the latencies and counts measured after the warm up
+    on the results queue """
+    random.seed()
+    players = [BotPlayer(rate, radius) for _ in xrange(numPlayers)]
+    startTime = time.time()
+    measureFrom = startTime + WARMUP_SEC
+    endTime = measureFrom + duration
+    measuring = False
+    numSentBefore = 0
+    while True:
+        now = time.time()
+        if now >= endTime:
+            break
+        if not measuring and now >= measureFrom:
+            measuring = True
+            numSentBefore = sum(player.numSent for player in players)
+            for player in players:
+                del player.session.latenciesMs[:]
+                player.session.numReceived = 0
+        for player in players:
+            player.update(now)
+        time.sleep(TICK_SEC)
+    latenciesMs = [latency for player in players for latency in player.session.latenciesMs]
+    numSent = sum(player.numSent for player in players) - numSentBefore
+    numReceived = sum(player.session.numReceived for player in players)
+    numDisconnected = sum(1 for player in players if not player.isConnected())
+    for player in players:
+        player.close()
+    results.put((latenciesMs, numSent, numReceived, numDisconnected))
+
+class ProcessStats(object):
+    """ The CPU time and memory of another process, read from /proc so only available on Linux """
+    def __init__(self, pid):
+        self.pid = pid
+        self.clockTicks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+    def getCpuSec(self):
+        try:
+            with open('/proc/%d/stat' % self.pid) as stat:
+                # The fields after the command name, which is in brackets and may contain spaces
+                fields = stat.read().rsplit(')', 1)[1].split()
+        except IOError:
+            return None
+        return (int(fields[11]) + int(fields[12])) / float(self.clockTicks)
+
+    def getRssMb(self):
+        try:
+            with open('/proc/%d/status' % self.pid) as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) / 1024.0
+        except IOError:
+            pass
+        return None
+
+def getPercentile(sortedValues, percentile):
+    if not sortedValues:
+        return None
+    return sortedValues[min(len(sortedValues) - 1, int(len(sortedValues) * percentile / 100.0))]
+
+def runStep(numPlayers, numProcesses, rate, radius, duration, serverStats):
+    """ Run numPlayers spread across processes against the server, returning what was measured """
+    results = multiprocessing.Queue()
+    numProcesses = max(1, min(numProcesses, numPlayers))
+    processes = [multiprocessing.Process(target=runPlayers,
+                                         args=(numPlayers // numProcesses + (1 if n < numPlayers % numProcesses else 0),
+                                               rate, radius, duration, results))
+                 for n in xrange(numProcesses)]
+    for process in processes:
+        process.start()
+    time.sleep(WARMUP_SEC)
+    cpuBefore = serverStats.getCpuSec() if serverStats is not None else None
+    measureStart = time.time()
+    latenciesMs = []
+    numSent = numReceived = numDisconnected = 0
+    for _ in processes:
+        processLatencies, processSent, processReceived, processDisconnected = results.get()
+        latenciesMs.extend(processLatencies)
+        numSent += processSent
+        numReceived += processReceived
+        numDisconnected += processDisconnected
+    elapsed = time.time() - measureStart
+    cpuAfter = serverStats.getCpuSec() if serverStats is not None else None
+    for process in processes:
+        process.join()
+    latenciesMs.sort()
+    step = {'players': numPlayers, 'sentPerSec': numSent / float(duration),
+            'receivedPerSec': numReceived / float(duration), 'disconnected': numDisconnected}
+    for percentile in PERCENTILES:
+        step['p%d' % percentile] = getPercentile(latenciesMs, percentile)
+    step['max'] = latenciesMs[-1] if latenciesMs else None
+    step['serverCpu'] = (100 * (cpuAfter - cpuBefore) / elapsed) if cpuBefore is not None and cpuAfter is not None \
+        else None
+    step['serverRssMb'] = serverStats.getRssMb() if serverStats is not None else None
+    return step
+
+def formatValue(value, format):
+    return format % value if value is not None else '-'
+
+def printStep(step):
+    print '%7d %10s %10s %8s %8s %8s %8s %8s %8s %6d' % (
+        step['players'], formatValue(step['sentPerSec'], '%.0f'), formatValue(step['receivedPerSec'], '%.0f'),
+        formatValue(step['p50'], '%.1f'), formatValue(step['p90'], '%.1f'), formatValue(step['p99'], '%.1f'),
+        formatValue(step['max'], '%.1f'), formatValue(step['serverCpu'], '%.0f%%'),
+        formatValue(step['serverRssMb'], '%.1f'), step['disconnected'])
+
+def startServer():
+    """ A server for the test to run against, which does not journal the test's traffic """
+    server = subprocess.Popen([sys.executable, 'Server.py', '--no-journal'], cwd=SERVER_DIRECTORY)
+    # Give it time to start listening
+    time.sleep(1)
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Ramp up simulated players against a server on this host, "
+                                                 "reporting relay latency, throughput and the server's resource use")
+    parser.add_argument('--players', default='1,2,5,10,20,50',
+                        help="comma separated player counts to step through")
+    parser.add_argument('--rate', type=float, default=5, help="commands each player sends a second")
+    parser.add_argument('--duration', type=float, default=10, help="seconds each step is measured for")
+    parser.add_argument('--radius', type=int, default=20, help="radius of the board players move pieces on")
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),
+                        help="processes the players are spread across")
+    parser.add_argument('--server-pid', type=int,
+                        help="pid of an already running server to measure, otherwise one is started")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    server = None
+    serverPid = args.server_pid
+    if serverPid is None:
+        server = startServer()
+        serverPid = server.pid
+    serverStats = ProcessStats(serverPid) if os.path.exists('/proc/%d' % serverPid) else None
+    print '%7s %10s %10s %8s %8s %8s %8s %8s %8s %6s' % ('players', 'sent/s', 'recv/s', 'p50 ms', 'p90 ms',
+                                                        'p99 ms', 'max ms', 'cpu', 'rss MB', 'lost')
+    try:
+        for numPlayers in [int(count) for count in args.players.split(',')]:
+            printStep(runStep(numPlayers, args.processes, args.rate, args.radius, args.duration, serverStats))
+            sys.stdout.flush()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
@@ -0,0 +1,59 @@
+# Images, fonts and rendered text shared between every view that draws them, so each is only loaded or rendered once
+from collections import OrderedDict
+import pygame
+from pygame.locals import RLEACCEL
+from thor.view.ClientDataFormat import ConfigReader
+
+DEFAULT_FONT_SIZE = 12
+# How many rendered text surfaces are kept, enough for the labels of every tile on a large board
+TEXT_CACHE_SIZE = 16384
+
+images = dict()
+fonts = dict()
+colours = dict()
+# Rendered text by (text, colour, size), least recently used first
+renderedText = OrderedDict()
+
+def getImage(path, size=None, colourKeyId='TRANSPARENT_COLOR_KEY'):
+    """ The image at path converted to the display format, with the colour colourKeyId drawn as transparent, and
+    scaled to size if given """
+    key = (path, size, colourKeyId)
+    image = images.get(key)
+    if image is None:
+        if size is None:
+            image = pygame.image.load(path).convert()
+            if colourKeyId is not None:
+                image.set_colorkey(ConfigReader.getColourForId(colourKeyId), RLEACCEL)
+        else:
+            image = getImage(path, None, colourKeyId)
+            if size != image.get_size():
+                # Scaled without smoothing so the colour key is not blended into the edges
+                image = pygame.transform.scale(image, size)
+                if colourKeyId is not None:
+                    image.set_colorkey(ConfigReader.getColourForId(colourKeyId), RLEACCEL)
+        images[key] = image
+    return image
+
+def getColour(colourId):
+    """ The colour with colourId in the config, read once however many views are drawn in it """
+    colour = colours.get(colourId)
+    if colour is None:
+        colour = colours[colourId] = ConfigReader.getColourForId(colourId)
+    return colour
+
+def getFont(size=DEFAULT_FONT_SIZE):
+    font = fonts.get(size)
+    if font is None:
+        font = fonts[size] = pygame.font.Font(pygame.font.get_default_font(), size)
+    return font
+
+def getText(text, colour, size=DEFAULT_FONT_SIZE):
+    """ A surface with text rendered on it. Views only blit it, so the same surface is shared by all of them """
+    key = (text, colour, size)
+    surface = renderedText.pop(key, None)
+    if surface is None:
+        surface = getFont(size).render(text, 0, colour)
+        if len(renderedText) >= TEXT_CACHE_SIZE:
+            renderedText.popitem(last=False)
+    renderedText[key] = surface
+    return surface
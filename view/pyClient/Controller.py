@@ -1,55 +1,75 @@
-import logging
+import logging, gc
 from collections import defaultdict
 
 import pygame
-from pygame import QUIT, KEYDOWN, K_ESCAPE, MOUSEMOTION, MOUSEBUTTONDOWN, MOUSEBUTTONUP
+from pygame import QUIT, KEYDOWN, K_ESCAPE, K_LEFT, K_RIGHT, K_UP, K_DOWN, MOUSEMOTION, MOUSEBUTTONDOWN, MOUSEBUTTONUP
 
 from thor.view import HexCoordSys
+from thor.view.HexTopology import OFF_BOARD
 
 from thor.view.pyClient.Model import SelectionModel, BoardTileModel, BoardPiecesModel, PieceDataModel
-from thor.view.pyClient.View import ScreenView, TileView, OverlayView, PieceView
+from thor.view.pyClient.View import ScreenView, TileView, TileChunkLayer, OverlayLayer, PieceView, ZOOM_STEP
 from thor.view.ClientDataFormat import ConfigReader, TileEventProcessor
+from graeae.GameState import expandRange
 from graeae.Session import ClientSession
 
+# The most frames drawn a second, only the areas that have changed are redrawn in each
+FRAME_RATE = 60
+# How many pixels the arrow keys move the view by
+KEY_PAN_PIXELS = 60
+KEY_PAN_DIRECTIONS = {K_LEFT: (-1, 0), K_RIGHT: (1, 0), K_UP: (0, -1), K_DOWN: (0, 1)}
+
 class ScreenController:
     """ Manages a ScreenView and controllers for other views on the screen """
     def __init__(self):
         self.screenView = ScreenView()
-        self.controllers = list()
+        self.controllers = dict()
         self.running = True
         self.mouseDragButton = None
         self.lastTileOverPosition = HexCoordSys.getTilePosition(0, 0)
-        self.session = ClientSession()
-        self.controllers.append(TileController("Tile", self.session))
-        self.controllers.append(PieceController("Piece", self.session, self.controllers["Tile"].tilePositionModel))
+        self.interest = self.screenView.camera.getViewportInterest()
+        self.session = ClientSession(interest=self.interest)
+        self.controllers["Tile"] = TileController("Tile", self.session)
+        self.controllers["Piece"] = PieceController("Piece", self.session, self.controllers["Tile"].tilePositionModel)
         self.mainLoop()
 
     def mainLoop(self):
         logging.info("Starting main client loop")
         clock = pygame.time.Clock()
         while self.running:
-            # Limit to 10 loops a second. The rendering code is quick so this avoids excess CPU utilization.
-            clock.tick(10)
-            for ctrl in self.controllers:
+            clock.tick(FRAME_RATE)
+            for ctrl in self.controllers.values():
                 ctrl.processAnyNewData()
             for event in pygame.event.get():
                 self.processUpdate(event)
-            # Clear screen and redraw everything every loop to avoid logic for passing display.update dirty rects
-            self.screenView.clearSurface()
-            for controller in self.controllers:
-                controller.draw(self.screenView.getSurface())
-            self.screenView.draw()
+            # Tiles rarely change so are drawn onto the cached background, pieces and selections are drawn over it
+            tileController = self.controllers["Tile"]
+            pieceController = self.controllers["Piece"]
+            self.screenView.redraw(tileController.takeDirtyPositions(), pieceController.takeDirtyPositions(),
+                                   (tileController,), (pieceController,))
 
     def processUpdate(self, event):
+        camera = self.screenView.camera
         if event.type == QUIT or (event.type == KEYDOWN and event.key == K_ESCAPE):
             self.running = False
+        elif event.type == KEYDOWN and event.key in KEY_PAN_DIRECTIONS:
+            dx, dy = KEY_PAN_DIRECTIONS[event.key]
+            camera.pan(dx * KEY_PAN_PIXELS, dy * KEY_PAN_PIXELS)
+            self.cameraChanged()
         elif event.type == MOUSEMOTION:
-            self.screenView.cursor.setPosition(event.pos[0],event.pos[1])
+            # Drag Middle click to pan
+            if self.mouseDragButton is 2:
+                camera.pan(-event.rel[0], -event.rel[1])
+                self.cameraChanged()
+            self.screenView.cursor.setPosition(event.pos[0], event.pos[1], camera)
             oldTilePosition = self.lastTileOverPosition
             self.lastTileOverPosition = self.screenView.cursor.getTilePosition()
             # Drag Right/Info click to a new tile
             if self.mouseDragButton is 3 and oldTilePosition != self.lastTileOverPosition:
                 self.controllers["Piece"].trialMoveSelectedEvent(self.lastTileOverPosition)
+        elif event.type == MOUSEBUTTONDOWN and event.button in (4, 5): # Scroll wheel to zoom
+            camera.zoom(ZOOM_STEP if event.button == 4 else 1 / ZOOM_STEP, event.pos)
+            self.cameraChanged()
         elif event.type == MOUSEBUTTONDOWN:
             self.mouseDragButton = event.button
             if event.button == 1: # Left/action click
@@ -58,37 +78,78 @@ class ScreenController:
             if self.mouseDragButton is 3: # Release Right/Info click
                 self.controllers["Piece"].moveSelectedEvent(self.lastTileOverPosition)
                 self.controllers["Piece"].selectEvent(self.lastTileOverPosition)
+            if event.button not in (4, 5):
                 self.mouseDragButton = None
 
-if __name__ == '__main__':
-    logging.basicConfig(level=logging.INFO)
-    ScreenController()
-    print "Exiting client session"
+    def cameraChanged(self):
+        """ Redraw for the camera's new view, and only hear about the part of the board now in it """
+        self.screenView.cameraChanged()
+        self.lastTileOverPosition = self.screenView.cursor.getTilePosition()
+        interest = self.screenView.camera.getViewportInterest()
+        if interest != self.interest:
+            self.interest = interest
+            self.session.setInterest(interest['center'], interest['radius'])
+
+class DirtyTracker(object):
+    """ Mixin recording the tile positions where what a controller draws has changed since the screen was redrawn """
+    def markDirty(self, *tilePositions):
+        self.dirtyPositions.update(tilePositions)
 
-class TileController(TileEventProcessor):
+    def takeDirtyPositions(self):
+        dirtyPositions = self.dirtyPositions
+        self.dirtyPositions = set()
+        return dirtyPositions
+
+class TileController(TileEventProcessor, DirtyTracker):
     """ Manages the display of board tiles for the ScreenController """
     def __init__(self, eventId, session):
         super(TileController, self).__init__(eventId, session)
-        self.tileViews = []
+        self.tileLayer = TileChunkLayer()
         self.tilePositionModel = BoardTileModel()
+        self.dirtyPositions = set()
+
+    def getIds(self):
+        return self.tilePositionModel.idToTile.keys()
 
     def remove(self, id):
         tilePositionRemoved = self.tilePositionModel.removeTilePositionWithId(id)
-        if tilePositionRemoved is not None:
-            self.tileViews.remove(TileView(tilePositionRemoved))
+        if tilePositionRemoved is not None and not self.tilePositionModel.containsTile(tilePositionRemoved):
+            self.tileLayer.removeTile(tilePositionRemoved)
+            self.markDirty(tilePositionRemoved)
 
     def add(self, id, tilePosition, data):
-        if self.tilePositionModel.addTilePositionWithId(id, tilePosition) is not None:
-            self.tileViews.append(TileView(tilePosition))
+        if self.tilePositionModel.addTilePositionWithId(id, tilePosition) is not None and \
+                not self.tileLayer.hasTile(tilePosition):
+            self.tileLayer.addTile(TileView(tilePosition))
+            self.markDirty(tilePosition)
+
+    def processRange(self, event):
+        """ Add every tile of an AddRange to the model in one go, as a board can have hundreds of thousands """
+        center = HexCoordSys.getTilePosition(int(event["center"][0]), int(event["center"][1]))
+        radius = HexCoordSys.distanceBetween(center, HexCoordSys.getTilePosition(0, 0)) + int(event["radius"])
+        getTilePosition = HexCoordSys.getTilePosition
+        # The cyclic garbage collector is paused as for applying a range on the server
+        gcWasEnabled = gc.isenabled()
+        gc.disable()
+        try:
+            added = self.tilePositionModel.addTilePositionsWithIds(
+                ((id, getTilePosition(row, col)) for id, (row, col) in expandRange(event)), radius)
+            self.tileLayer.addTilesAt(added)
+        finally:
+            if gcWasEnabled:
+                gc.enable()
+        self.markDirty(*added)
 
-    def draw(self, drawOnto):
-        for tileView in self.tileViews:
-            tileView.draw(drawOnto)
+    def drawAt(self, drawOnto, camera, tilePositions=None):
+        self.tileLayer.drawAt(drawOnto, camera, tilePositions)
 
-class SelectionController:
-    """ Manages the display of user selections for the ScreenController """
+class SelectionController(DirtyTracker):
+    """ Manages the display of user selections for the ScreenController. Selections shown as hex overlays share one
+    overlay layer, others have a view for each selected tile """
     def __init__(self):
         self.selectionViews = defaultdict(dict)
+        self.overlayLayer = OverlayLayer()
+        self.dirtyPositions = set()
 
     def setSelectedTile(self, tilePosition, selectionKey=None, colour=None):
         logging.debug("Changing primary selection for model %s from %s to %s", selectionKey,
@@ -97,51 +158,82 @@ class SelectionController:
             selectionKey = SelectionModel()
         selectionKey.setPrimarySelection(tilePosition)
         if colour is not None:
-            self.selectionViews[selectionKey][tilePosition] = (OverlayView((tilePosition,), colour))
+            self.addView(selectionKey, tilePosition, colour)
         return selectionKey
 
-    def setInfoTiles(self, newSelections, selectionKey, colour, viewTypeToUse):
+    def setInfoTiles(self, newSelections, selectionKey, colour, viewTypeToUse=None):
+        """ Change the extended selection to newSelections, shown as viewTypeToUse(tilePositions, colour) views or as
+        hex overlays when no view type is given """
         logging.debug("Changing info selection for model %s from %s to %s", selectionKey,
                       selectionKey.getExtendedSelection(), newSelections)
         # Go through each of the current extended selections and remove any not in the new selection
         for noLongerSelected in selectionKey.getExtendedSelection() - newSelections:
             if selectionKey.reduceSelection(noLongerSelected):
-                del self.selectionViews[selectionKey][noLongerSelected]
+                self.removeView(selectionKey, noLongerSelected)
         # For each position that is on the board and not already selected, select it
         for newSelection in newSelections - selectionKey.getExtendedSelection():
             if selectionKey.extendSelection(newSelection):
-                self.selectionViews[selectionKey][newSelection] = viewTypeToUse((newSelection,), colour)
+                self.addView(selectionKey, newSelection, colour, viewTypeToUse)
+
+    def addView(self, selectionKey, tilePosition, colour, viewTypeToUse=None):
+        if viewTypeToUse is None:
+            self.overlayLayer.setTile(tilePosition, colour)
+            self.selectionViews[selectionKey][tilePosition] = self.overlayLayer
+        else:
+            self.selectionViews[selectionKey][tilePosition] = viewTypeToUse((tilePosition,), colour)
+        self.markDirty(tilePosition)
+
+    def removeView(self, selectionKey, tilePosition):
+        if self.selectionViews[selectionKey].pop(tilePosition, None) is self.overlayLayer:
+            self.overlayLayer.removeTile(tilePosition)
+        self.markDirty(tilePosition)
 
     def clearAllSelection(self, selectionKey):
         if selectionKey is not None:
             tilePosition = selectionKey.clearPrimarySelection()
             if tilePosition in self.selectionViews[selectionKey]:
                 logging.debug("Clearing primary selection %s for model %s", tilePosition, selectionKey)
-                del self.selectionViews[selectionKey][tilePosition]
+                self.removeView(selectionKey, tilePosition)
             for selectedPos in selectionKey.clearExtendedSelection():
                 if selectedPos in self.selectionViews[selectionKey]:
-                    del self.selectionViews[selectionKey][selectedPos]
+                    self.removeView(selectionKey, selectedPos)
             del self.selectionViews[selectionKey]
 
-    def draw(self, drawOnto):
+    def drawAt(self, drawOnto, camera, tilePositions=None):
+        self.overlayLayer.drawAt(drawOnto, camera, tilePositions)
         for selectModels in self.selectionViews.values():
-            for selectedView in selectModels.values():
-                selectedView.draw(drawOnto)
+            if tilePositions is None:
+                selectedViews = selectModels.values()
+            else:
+                selectedViews = [selectModels[tilePosition] for tilePosition in tilePositions
+                                                            if tilePosition in selectModels]
+            for selectedView in selectedViews:
+                if selectedView is not self.overlayLayer:
+                    selectedView.draw(drawOnto, camera)
 
-class PieceController(TileEventProcessor):
+class PieceController(TileEventProcessor, DirtyTracker):
     """ Manages the display of pieces on the board for the ScreenController """
     def __init__(self, eventId, session, tilePositionModel):
         super(PieceController, self).__init__(eventId, session)
-        self.pieceViews = []
+        self.dirtyPositions = set()
         self.selectionController = SelectionController()
         self.moveSelectionsModel = None
         self.pathSelectionModel = None
         self.piecesModel = BoardPiecesModel()
         self.tilePositionModel = tilePositionModel
+        self.moveCosts = None
+        self.moveCostsModificationCount = None
+        # Distance fields of moves from each tile they have been needed for, kept while the move costs are the same
+        self.distanceFields = dict()
+        self.distanceFieldCosts = None
+
+    def getIds(self):
+        return self.piecesModel.idToData.keys()
 
     def remove(self, id):
         data = self.piecesModel.removePieceWithId(id)
-        self.pieceViews.remove(data.view)
+        self.moveCosts = None
+        self.markDirty(data.location)
         if self.moveSelectionsModel is not None and \
                        data.location == self.moveSelectionsModel.getPrimarySelection():
             self.clearSelectEvent()
@@ -151,12 +243,59 @@ class PieceController(TileEventProcessor):
         if not self.piecesModel.containsId(id):
             dm = PieceDataModel(tilePosition, team)
             self.piecesModel.addPieceWithId(id, dm)
-            self.pieceViews.append(dm.view)
+            self.moveCosts = None
+            self.markDirty(tilePosition)
+
+    def move(self, id, tilePosition):
+        data = self.piecesModel.idToData.get(id)
+        if data is None:
+            return
+        if self.moveSelectionsModel is not None and data.location == self.moveSelectionsModel.getPrimarySelection():
+            self.clearSelectEvent()
+        self.markDirty(data.location, tilePosition)
+        self.piecesModel.movePieceWithId(id, tilePosition)
+        data.view = PieceView(data.colour, (tilePosition,))
+        self.moveCosts = None
+
+    def getMoveCosts(self):
+        """ Pathfinding costs for the board, built once and reused until a piece or tile is added or removed """
+        if self.moveCosts is None or self.moveCostsModificationCount != self.tilePositionModel.modificationCount:
+            topology = self.tilePositionModel.getTopology()
+            self.moveCosts = self.tilePositionModel.getMoveCosts()
+            self.moveCostsModificationCount = self.tilePositionModel.modificationCount
+            for occupied in self.piecesModel.getOccupiedPositions():
+                index = topology.indexOf(occupied)
+                if index != OFF_BOARD:
+                    self.moveCosts[index] = 0
+        return self.moveCosts
+
+    def getDistanceFieldFrom(self, tilePosition):
+        """ The distance field of moves from tilePosition, or None if it is not on the board """
+        costs = self.getMoveCosts()
+        if self.distanceFieldCosts is not costs:
+            self.distanceFields = dict()
+            self.distanceFieldCosts = costs
+        topology = self.tilePositionModel.getTopology()
+        index = topology.indexOf(tilePosition)
+        if index == OFF_BOARD:
+            return None
+        field = self.distanceFields.get(index)
+        if field is None:
+            field = self.distanceFields[index] = topology.getDistanceField((index,), costs)
+        return field
+
+    def takeDirtyPositions(self):
+        return super(PieceController, self).takeDirtyPositions() | self.selectionController.takeDirtyPositions()
 
-    def draw(self, drawSurface):
-        for pieceView in self.pieceViews:
-            pieceView.draw(drawSurface)
-        self.selectionController.draw(drawSurface)
+    def drawAt(self, drawSurface, camera, tilePositions=None):
+        if tilePositions is None:
+            piecesData = self.piecesModel.idToData.values()
+        else:
+            piecesData = [data for tilePosition in tilePositions
+                               for data in self.piecesModel.getDataForPiecesAt(tilePosition)]
+        for data in piecesData:
+            data.view.draw(drawSurface, camera)
+        self.selectionController.drawAt(drawSurface, camera, tilePositions)
 
     def selectEvent(self, tilePosition):
         self.clearSelectEvent()
@@ -164,9 +303,12 @@ class PieceController(TileEventProcessor):
             logging.debug("Select event for %s", tilePosition)
             pieceData = self.piecesModel.getDataForPiecesAt(tilePosition)[0]
             self.moveSelectionsModel = self.selectionController.setSelectedTile(tilePosition, colour=ConfigReader.getColourForId('SelectedTile'))
-            self.selectionController.setInfoTiles(self.tilePositionModel.positionsOnBoardIn(
-                HexCoordSys.getTilesWithin(pieceData.moves, tilePosition)),
-                self.moveSelectionsModel, ConfigReader.getColourForId('Info1Tile'), type(OverlayView((),())))
+            # Show the tiles the piece can reach around missing tiles and other pieces
+            field = self.getDistanceFieldFrom(tilePosition)
+            reachable = self.tilePositionModel.getTopology().positionsOf(field.getIndicesWithin(pieceData.moves)) \
+                        if field is not None else ()
+            self.selectionController.setInfoTiles(set(reachable), self.moveSelectionsModel,
+                                                  ConfigReader.getColourForId('Info1Tile'))
             self.pathSelectionModel = self.selectionController.setSelectedTile(tilePosition)
 
     def clearSelectEvent(self):
@@ -178,21 +320,26 @@ class PieceController(TileEventProcessor):
 
     def trialMoveSelectedEvent(self, tilePosition):
         # If a tile has been selected for the start of the path, and the specified path tile is on the board
-        if self.pathSelectionModel is not None and self.tilePositionModel.contains(tilePosition) and not \
+        if self.pathSelectionModel is not None and self.tilePositionModel.containsTile(tilePosition) and not \
                 self.pathSelectionModel.doesExtendedSelectionContain(tilePosition):
             logging.debug("Trial move to %s", tilePosition)
             pieceData = self.piecesModel.getDataForPiecesAt(self.pathSelectionModel.getPrimarySelection())[0]
-            self.selectionController.setInfoTiles(self.tilePositionModel.positionsOnBoardIn(
-                HexCoordSys.getShortestTilePathBetween(self.pathSelectionModel.getPrimarySelection(), tilePosition)),
-                self.pathSelectionModel, pieceData.movingColour, type(PieceView((),())))
+            # Path around missing and occupied tiles, showing no path if the tile cannot be reached
+            topology = self.tilePositionModel.getTopology()
+            field = self.getDistanceFieldFrom(self.pathSelectionModel.getPrimarySelection())
+            path = field.getPathTo(topology.indexOf(tilePosition)) if field is not None else None
+            self.selectionController.setInfoTiles(set(topology.positionsOf(path)) if path is not None else set(),
+                self.pathSelectionModel, pieceData.moveColour,
+                lambda tilePositions, colour: PieceView(colour, tilePositions))
 
     def moveSelectedEvent(self, tilePosition):
         if self.moveSelectionsModel is not None and self.tilePositionModel.containsTile(tilePosition):
             logging.debug("Move event to %s", tilePosition)
-            team = None
-            id = None
             for id in self.piecesModel.getIdForPiecesAt(self.moveSelectionsModel.getPrimarySelection()):
-                team = self.remove(id)
-                id = id
-            self.add(id, tilePosition, team)
-            self.createMoveEvent(id, tilePosition)
\ No newline at end of file
+                self.move(id, tilePosition)
+                self.createMoveEvent(id, tilePosition)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    ScreenController()
+    print "Exiting client session"
@@ -1,5 +1,8 @@
 # Models represent data that can be shared between controllers
+from collections import defaultdict
 from thor.view.ClientDataFormat import ConfigReader
+from thor.view import HexCoordSys, HexTopology
+from thor.view.HexCoordSys import numpy
 from thor.view.pyClient.View import PieceView
 
 class SelectionModel:
@@ -52,56 +55,163 @@ class SelectionModel:
 class BoardTileModel:
     def __init__(self):
         self.idToTile = dict()
+        # The ids of the tiles at each position, as more than one can share a position
+        self.positionToIds = defaultdict(set)
+        # The radius of the smallest hex board centered on the origin that contains every tile
+        self.radius = 0
+        self.modificationCount = 0
+        # One byte per tile of the topology for the radius, 1 where there is a tile. Rebuilt when next needed after
+        # the radius grows, so loading a board does not rebuild it for every tile that extends the radius
+        self.occupancy = None
 
     def addTilePositionWithId(self, id, tilePosition):
         if self.idToTile.get(id) is None:
             self.idToTile[id] = tilePosition
+            self.positionToIds[tilePosition].add(id)
+            distanceFromCenter = HexCoordSys.distanceBetween(tilePosition, HexCoordSys.getTilePosition(0, 0))
+            if distanceFromCenter > self.radius:
+                self.radius = distanceFromCenter
+                self.occupancy = None
+            elif self.occupancy is not None:
+                self.occupancy[self.getTopology().indexOf(tilePosition)] = 1
+            self.modificationCount += 1
             return tilePosition
         return None
 
+    def addTilePositionsWithIds(self, idsAndPositions, radius):
+        """ Add many tiles at once, such as those of an AddRange, where radius is at least the distance from the origin
+        of the furthest of them. Returns the positions of the tiles added """
+        added = []
+        idToTile = self.idToTile
+        positionToIds = self.positionToIds
+        if radius > self.radius:
+            self.radius = radius
+            self.occupancy = None
+        for id, tilePosition in idsAndPositions:
+            if id not in idToTile:
+                idToTile[id] = tilePosition
+                positionToIds[tilePosition].add(id)
+                added.append(tilePosition)
+        if self.occupancy is not None:
+            indexOf = self.getTopology().indexOf
+            for tilePosition in added:
+                self.occupancy[indexOf(tilePosition)] = 1
+        if added:
+            self.modificationCount += 1
+        return added
+
     def removeTilePositionWithId(self, id):
         tilePosition = self.idToTile.get(id)
         if tilePosition is not None:
             del self.idToTile[id]
+            ids = self.positionToIds[tilePosition]
+            ids.discard(id)
+            if not ids:
+                del self.positionToIds[tilePosition]
+                if self.occupancy is not None:
+                    self.occupancy[self.getTopology().indexOf(tilePosition)] = 0
+            self.modificationCount += 1
         return tilePosition
 
     def containsId(self, id):
-        return id in self.idToTile.keys()
+        return id in self.idToTile
 
-    def containsTile(self, id):
-        return id in self.idToTile.values()
+    def containsTile(self, tilePosition):
+        return tilePosition in self.positionToIds
 
     def positionsOnBoardIn(self, tilePositions):
-        return set(filter(lambda posn: self.containsTile(posn), tilePositions))
+        return set(posn for posn in tilePositions if posn in self.positionToIds)
+
+    def indicesOnBoardIn(self, indices):
+        """ The topology indices in indices that have a tile """
+        occupancy = self.getOccupancy()
+        return [index for index in indices if occupancy[index]]
+
+    def positionArrayOnBoardIn(self, positionArray):
+        """ The rows of an (N,2) numpy array of row, col positions that have a tile, for intersecting many positions
+        with the board at once """
+        indices = self.getTopology().indicesOfArray(positionArray)
+        onBoard = indices != HexTopology.OFF_BOARD
+        occupancy = numpy.frombuffer(self.getOccupancy(), dtype=numpy.uint8)
+        onBoard[onBoard] = occupancy[indices[onBoard]] != 0
+        return numpy.asarray(positionArray).reshape(-1, 2)[onBoard]
+
+    def getTopology(self):
+        return HexTopology.getTopologyForRadius(self.radius)
+
+    def getOccupancy(self):
+        if self.occupancy is None:
+            topology = self.getTopology()
+            self.occupancy = bytearray(topology.numTiles)
+            for tilePosition in self.positionToIds:
+                self.occupancy[topology.indexOf(tilePosition)] = 1
+        return self.occupancy
+
+    def getMoveCosts(self):
+        """ Pathfinding costs indexed by the board topology, 1 for every tile on the board and 0 elsewhere """
+        return bytearray(self.getOccupancy())
 
 class BoardPiecesModel:
     def __init__(self):
         self.idToData = dict()
+        # The ids of the pieces at each occupied position, kept in step with the location of each piece's data
+        self.positionToIds = defaultdict(set)
 
     def addPieceWithId(self, id, data):
         if self.idToData.get(id) is None:
             self.idToData[id] = data
+            self.positionToIds[data.location].add(id)
             return data
         return None
 
     def isPieceAt(self, tilePosition):
-        return len(self.getDataForPiecesAt(tilePosition)) > 0
+        return tilePosition in self.positionToIds
 
     def containsId(self, id):
-        return id in self.idToData.values()
+        return id in self.idToData
 
     def getDataForPiecesAt(self, tilePosition):
-        return [data for data in self.idToData.values() if data.location == tilePosition]
+        return [self.idToData[id] for id in self.positionToIds.get(tilePosition, ())]
 
     def getIdForPiecesAt(self, tilePosition):
-        return [id for id in self.idToData.keys() if self.idToData[id].location == tilePosition]
+        return list(self.positionToIds.get(tilePosition, ()))
+
+    def getIdsWithin(self, distance, tilePosition, topology):
+        """ The ids of every piece within distance of tilePosition, checking whichever is fewer of the pieces or the
+        tiles in range """
+        numTilesInRange = 3 * distance * (distance + 1) + 1
+        if len(self.positionToIds) < numTilesInRange:
+            return [id for position, ids in self.positionToIds.iteritems()
+                       if HexCoordSys.distanceBetween(position, tilePosition) <= distance for id in ids]
+        index = topology.indexOf(tilePosition)
+        positions = topology.positionsOf(topology.getIndicesWithin(distance, index)) if index != HexTopology.OFF_BOARD \
+                    else HexCoordSys.getTilesWithin(distance, tilePosition)
+        return [id for position in positions for id in self.positionToIds.get(position, ())]
+
+    def getOccupiedPositions(self):
+        return set(self.positionToIds.keys())
+
+    def movePieceWithId(self, id, tilePosition):
+        data = self.idToData.get(id)
+        if data is not None:
+            self.discardFromPosition(id, data.location)
+            data.location = tilePosition
+            self.positionToIds[tilePosition].add(id)
+        return data
 
     def removePieceWithId(self, id):
         data = self.idToData.get(id)
         if data is not None:
             del self.idToData[id]
+            self.discardFromPosition(id, data.location)
         return data
 
+    def discardFromPosition(self, id, tilePosition):
+        ids = self.positionToIds[tilePosition]
+        ids.discard(id)
+        if not ids:
+            del self.positionToIds[tilePosition]
+
     def removeAllPieces(self):
         pieceValuesRemoved = list()
         for id in self.idToData.keys():
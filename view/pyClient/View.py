@@ -4,15 +4,113 @@ import pygame.gfxdraw
 from pygame.locals import *
 from thor.view.ClientDataFormat import ConfigReader
 from thor.view import HexCoordSys
+from thor.view.pyClient import Assets
 
 # TODO should be in config or from pygame.display.Info().current_w current_h
 WINDOW_WIDTH = 640
 WINDOW_HEIGHT = 480
-CENTER = HexCoordSys.ScreenCoordinate(x=WINDOW_WIDTH/2, y=WINDOW_HEIGHT/2)
 # TODO could be scaled from window width/heigh div num tiles
 TILE_EDGE_LENGTH = 20
 TILE_HEIGHT = TILE_EDGE_LENGTH * 2
 TILE_WIDTH = math.sqrt(3)/2 * TILE_HEIGHT
+# The area drawn for a tile at a scale of one, the size of the tile image, which only overlaps the tiles next to it
+TILE_AREA_WIDTH = 38
+TILE_AREA_HEIGHT = 41
+# Redrawing many separate tile areas costs more than redrawing the whole screen once
+FULL_REDRAW_TILES = 400
+# Tiles are pre-rendered in chunks this many rows high and tiles across
+CHUNK_SIZE = 16
+# How far the camera zooms out and in, and by how much for each step of the mouse wheel
+MIN_SCALE = 0.25
+MAX_SCALE = 2.0
+ZOOM_STEP = 1.25
+# Tile labels are not drawn when they would be smaller than this
+MIN_LABEL_SIZE = 6
+# The angles of the corners of a pointy topped hex
+HEX_VERTEX_ANGLES = tuple((2 * math.pi / 6) * (i + 0.5) for i in range(0, 6))
+# The corners of a hex relative to its center for each edge length drawn at
+hexVertexOffsets = dict()
+
+def getHexVertices(center, edgeLength):
+    offsets = hexVertexOffsets.get(edgeLength)
+    if offsets is None:
+        offsets = hexVertexOffsets[edgeLength] = tuple((edgeLength * math.cos(angle), edgeLength * math.sin(angle))
+                                                       for angle in HEX_VERTEX_ANGLES)
+    return [(center.x + dx, center.y + dy) for dx, dy in offsets]
+
+def hexToPixels(tilePositions, edgeLength, centerPixel):
+    """ The screen coordinates of each of tilePositions, converted together when numpy is available """
+    if HexCoordSys.numpy is None or not tilePositions:
+        return [HexCoordSys.hexToPixel(tilePosition, edgeLength, centerPixel) for tilePosition in tilePositions]
+    return [HexCoordSys.ScreenCoordinate(x, y)
+            for x, y in HexCoordSys.hexToPixelBatch(tilePositions, edgeLength, centerPixel).tolist()]
+
+class Camera(object):
+    """ Which part of the board is on screen and at what scale. The offset is the board pixel at a scale of one that is
+    shown at the center of the window """
+    def __init__(self, width=WINDOW_WIDTH, height=WINDOW_HEIGHT):
+        self.width = width
+        self.height = height
+        self.offset = (0.0, 0.0)
+        self.scale = 1.0
+        self.update()
+
+    def update(self):
+        self.edgeLength = TILE_EDGE_LENGTH * self.scale
+        # Where the center of tile 0,0 is on screen. It is kept to whole pixels so that panning moves everything drawn
+        # by the same whole number of pixels, and anything pre-rendered can be reused
+        self.centerPixel = HexCoordSys.ScreenCoordinate(x=int(round(self.width / 2.0 - self.offset[0] * self.scale)),
+                                                        y=int(round(self.height / 2.0 - self.offset[1] * self.scale)))
+        self.tileAreaSize = (int(math.ceil(TILE_AREA_WIDTH * self.scale)), int(math.ceil(TILE_AREA_HEIGHT * self.scale)))
+
+    def pan(self, dx, dy):
+        """ Move the view by a number of screen pixels """
+        self.offset = (self.offset[0] + dx / self.scale, self.offset[1] + dy / self.scale)
+        self.update()
+
+    def zoom(self, factor, aroundPixel=None):
+        """ Scale the view by factor, keeping the board under aroundPixel, or the center of the window, in place """
+        scale = min(MAX_SCALE, max(MIN_SCALE, self.scale * factor))
+        if aroundPixel is not None:
+            dx = aroundPixel[0] - self.width / 2.0
+            dy = aroundPixel[1] - self.height / 2.0
+            self.offset = (self.offset[0] + dx / self.scale - dx / scale, self.offset[1] + dy / self.scale - dy / scale)
+        self.scale = scale
+        self.update()
+
+    def hexToPixel(self, tilePosition):
+        return HexCoordSys.hexToPixel(tilePosition, self.edgeLength, self.centerPixel)
+
+    def hexToPixels(self, tilePositions):
+        """ The screen coordinates of many tiles at once, for when a whole layout is recomputed """
+        return hexToPixels(tilePositions, self.edgeLength, self.centerPixel)
+
+    def pixelToHex(self, screenCoordinate):
+        return HexCoordSys.pixelToHex(screenCoordinate, self.edgeLength, self.centerPixel)
+
+    def getTileRect(self, tilePosition, center=None):
+        """ The area of the screen anything drawn for a tile is within, around center if it is already known """
+        rect = pygame.Rect((0, 0), self.tileAreaSize)
+        rect.center = self.hexToPixel(tilePosition) if center is None else center
+        return rect
+
+    def getVisiblePositions(self, rect=None):
+        """ Every position with any of its tile within rect, or the window """
+        if rect is None:
+            rect = pygame.Rect(0, 0, self.width, self.height)
+        # Widen the rect by half a tile, and a pixel for rounding, so tiles with their centers just outside are included
+        marginX = self.tileAreaSize[0] // 2 + 1
+        marginY = self.tileAreaSize[1] // 2 + 1
+        return HexCoordSys.getPositionsInRect(rect.left - marginX, rect.top - marginY, rect.right + marginX,
+                                              rect.bottom + marginY, self.edgeLength, self.centerPixel)
+
+    def getViewportInterest(self):
+        """ The hex region around the center tile that covers the whole window, as a ClientSession interest """
+        cornerTile = self.pixelToHex(HexCoordSys.ScreenCoordinate(0, 0))
+        centerTile = self.pixelToHex(HexCoordSys.ScreenCoordinate(self.width / 2, self.height / 2))
+        # One extra tile so partially visible tiles at the edges are included
+        radius = HexCoordSys.distanceBetween(centerTile, cornerTile) + 1
+        return {'center': [centerTile.row, centerTile.col], 'radius': radius}
 
 class CommonIdentity(object):
     def __eq__(self, other):
@@ -24,6 +122,9 @@ class CommonIdentity(object):
         return hash(self.__dict__)
 
 class ScreenView():
+    """ Retains what has been drawn between frames, redrawing only the areas of tiles that have changed. The screen is
+    drawn in layers, each an object with a drawAt(drawOnto, camera, tilePositions) method that draws what it has at
+    those positions, or everything within the surface's clip area when tilePositions is None """
     def __init__(self):
         pygame.init()
         # Create the display surface
@@ -31,69 +132,241 @@ class ScreenView():
         self.screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT), 1)
         pygame.display.set_caption('Title')
         self.drawOn = pygame.Surface((WINDOW_WIDTH, WINDOW_HEIGHT), 1)
-        self.cursor = CursorView()
+        # The board with the background layers drawn on it, changed areas are restored from here before the layers
+        # over them are redrawn
+        self.background = pygame.Surface((WINDOW_WIDTH, WINDOW_HEIGHT), 1)
+        self.backgroundColour = ConfigReader.getColourForId('LIGHT_GREY')
+        self.camera = Camera()
+        self.cursor = CursorView(self.camera)
+        self.lastCursorRect = None
+        self.redrawAll = True
 
     def getSurface(self):
         return self.drawOn
 
-    def clearSurface(self):
-        self.drawOn.fill(ConfigReader.getColourForId('LIGHT_GREY'))
+    def cameraChanged(self):
+        """ Redraw everything for the camera's new view of the board """
+        self.cursor.updatePosition(self.camera)
+        self.redrawAll = True
 
-    def draw(self):
-        # Put the current display surface onto the screen object
-        self.screen.blit(self.drawOn, (0, 0))
-        # Draw the cursor to the screen object
+    def redraw(self, backgroundDirty, dirty, backgroundLayers, layers):
+        """ Redraw the tiles that have changed and push only their areas to the display. Tiles in backgroundDirty have
+        changed in the background layers and those in dirty only in the layers over them """
+        screenRect = self.screen.get_rect()
+        if self.redrawAll or len(backgroundDirty) + len(dirty) > FULL_REDRAW_TILES:
+            # Only what is in view is drawn over the background
+            areas = [(screenRect, self.camera.getVisiblePositions())]
+            backgroundAreas = [(screenRect, None)] if self.redrawAll or backgroundDirty else []
+            self.redrawAll = False
+        else:
+            backgroundAreas = [self.getTileArea(tilePosition) for tilePosition in backgroundDirty]
+            areas = backgroundAreas + [self.getTileArea(tilePosition) for tilePosition in dirty - backgroundDirty]
+            backgroundAreas = [area for area in backgroundAreas if screenRect.colliderect(area[0])]
+            areas = [area for area in areas if screenRect.colliderect(area[0])]
+        for rect, tilePositions in backgroundAreas:
+            self.drawArea(self.background, rect, tilePositions, backgroundLayers)
+        for rect, tilePositions in areas:
+            self.drawArea(self.drawOn, rect, tilePositions, layers, self.background)
+        self.push([rect for rect, _ in areas])
+
+    def getTileArea(self, tilePosition):
+        """ The rect of a tile and the positions of everything that can be drawn over it """
+        return self.camera.getTileRect(tilePosition), HexCoordSys.getTilesWithin(1, tilePosition)
+
+    def drawArea(self, drawOnto, rect, tilePositions, layers, underlay=None):
+        drawOnto.set_clip(rect)
+        if underlay is not None:
+            drawOnto.blit(underlay, rect, rect)
+        else:
+            drawOnto.fill(self.backgroundColour, rect)
+        for layer in layers:
+            layer.drawAt(drawOnto, self.camera, tilePositions)
+        drawOnto.set_clip(None)
+
+    def push(self, rects):
+        """ Copy areas of the drawing surface to the screen with the cursor over them, and update the display for
+        those areas and wherever the cursor has moved from and to """
+        cursorRect = self.cursor.boundingBox
+        if cursorRect != self.lastCursorRect:
+            rects.append(cursorRect.copy())
+            if self.lastCursorRect is not None:
+                rects.append(self.lastCursorRect)
+        if not rects:
+            return
+        for rect in rects:
+            self.screen.blit(self.drawOn, rect, rect)
         self.cursor.draw(self.screen)
-        # Push the screen to the display buffer
-        pygame.display.flip()
+        self.lastCursorRect = cursorRect.copy()
+        pygame.display.update(rects)
 
 class TileView(CommonIdentity):
     def __init__(self, tilePosition):
-        self.surface = pygame.image.load("./hextile.png").convert()
-        self.surface.set_colorkey(ConfigReader.getColourForId('TRANSPARENT_COLOR_KEY'), RLEACCEL)
-        self.boundingBox = self.surface.get_rect()
-        self.boundingBox.center = HexCoordSys.hexToPixel(tilePosition, TILE_EDGE_LENGTH, CENTER)
         self.views = []
-        self.addView(TextView("%d,%d" % (tilePosition.row, tilePosition.col)))
         self.tilePosition = tilePosition
+        # Made when first drawn, as a board can have far more tiles than are ever on screen
+        self.label = None
 
     def addView(self, view):
-        view.setPosition(self.boundingBox.topleft[0], self.boundingBox.topleft[1])
         self.views.append(view)
 
     def getTilePosition(self):
         return self.tilePosition
 
-    def draw(self, drawOnto):
-        drawOnto.blit(self.surface, self.boundingBox.topleft)
+    def draw(self, drawOnto, camera, origin=(0, 0), center=None):
+        """ Draw onto a surface whose top left is at origin on the screen """
+        boundingBox = camera.getTileRect(self.tilePosition, center).move(-origin[0], -origin[1])
+        drawOnto.blit(Assets.getImage("./hextile.png", boundingBox.size), boundingBox)
+        if self.label is None:
+            self.label = TextView("%d,%d" % (self.tilePosition.row, self.tilePosition.col))
+        self.label.draw(drawOnto, camera, boundingBox.center)
         for view in self.views:
-            view.draw(drawOnto)
+            view.draw(drawOnto, camera, boundingBox.center)
 
-class TextView:
-    def __init__(self, text):
-        self.surface = pygame.font.Font(pygame.font.get_default_font(),12).render(text, 0, ConfigReader.getColourForId('WHITE'))
-        self.boundingBox = self.surface.get_rect()
-        self.setPosition(0,0)
+def getChunkOf(tilePosition):
+    """ The chunk a tile is in. Rows are offset by half a tile each so every chunk covers a rectangle of the screen """
+    return (tilePosition.row // CHUNK_SIZE, (tilePosition.col + tilePosition.row // 2) // CHUNK_SIZE)
 
-    def setPosition(self, screenX, screenY):
-        """ Takes a position at the top left of a tile and moves this bounding box to it"""
-        self.boundingBox.center = (screenX + (TILE_WIDTH/2), screenY + (TILE_HEIGHT/2))
+class TileChunk(object):
+    """ The tiles of one chunk of the board, drawn onto a surface of their own whenever they change """
+    def __init__(self, chunk):
+        self.chunk = chunk
+        self.tileViews = dict()
+        self.surface = None
+        self.boardRect = None
+        self.edgeLength = None
 
-    def draw(self, drawOnto):
-        drawOnto.blit(self.surface, self.boundingBox.topleft)
+    def getRect(self, camera):
+        """ Where the chunk is on screen. It is bounded by the tiles at each end of its rows, which are found once for
+        each scale relative to tile 0,0 as panning only moves it """
+        if self.edgeLength != camera.edgeLength:
+            firstRow = self.chunk[0] * CHUNK_SIZE
+            firstOffsetCol = self.chunk[1] * CHUNK_SIZE
+            rowEnds = [HexCoordSys.getTilePosition(row, offsetCol - row // 2)
+                       for row in range(firstRow, firstRow + CHUNK_SIZE)
+                       for offsetCol in (firstOffsetCol, firstOffsetCol + CHUNK_SIZE - 1)]
+            tileRects = [camera.getTileRect(tilePosition, center)
+                         for tilePosition, center in zip(rowEnds, camera.hexToPixels(rowEnds))]
+            self.boardRect = tileRects[0].unionall(tileRects).move(-camera.centerPixel.x, -camera.centerPixel.y)
+            self.edgeLength = camera.edgeLength
+            # Anything rendered was for another scale
+            self.surface = None
+        return self.boardRect.move(camera.centerPixel)
 
-class CursorView(object):
+    def isRendered(self, camera):
+        return self.surface is not None and self.edgeLength == camera.edgeLength
+
+    def render(self, camera):
+        """ Draw the tiles onto the chunk's surface, everywhere else is transparent as tiles overlap other chunks """
+        rect = self.getRect(camera)
+        if self.surface is None:
+            self.surface = pygame.Surface(rect.size).convert()
+            self.surface.set_colorkey(ConfigReader.getColourForId('TRANSPARENT_COLOR_KEY'), RLEACCEL)
+        self.surface.fill(ConfigReader.getColourForId('TRANSPARENT_COLOR_KEY'))
+        tileViews = self.tileViews.values()
+        centers = camera.hexToPixels([tileView.getTilePosition() for tileView in tileViews])
+        for tileView, center in zip(tileViews, centers):
+            tileView.draw(self.surface, camera, rect.topleft, center)
+
+class TileChunkLayer(object):
+    """ Draws tiles from pre-rendered chunks, so drawing an area of the board takes a blit for each chunk over it
+    rather than for each tile. A chunk is rendered again when next drawn after a tile in it is added or removed, or
+    the camera's scale has changed """
     def __init__(self):
-        self.surface = pygame.image.load("./hexcursor.png").convert()
-        self.surface.set_colorkey(ConfigReader.getColourForId('TRANSPARENT_COLOR_KEY'), RLEACCEL)
-        self.boundingBox = self.surface.get_rect()
+        self.chunks = dict()
+        self.staleChunks = set()
+        self.edgeLength = None
+
+    def addTile(self, tileView):
+        chunk = getChunkOf(tileView.getTilePosition())
+        if chunk not in self.chunks:
+            self.chunks[chunk] = TileChunk(chunk)
+        self.chunks[chunk].tileViews[tileView.getTilePosition()] = tileView
+        self.staleChunks.add(chunk)
+
+    def addTilesAt(self, tilePositions):
+        """ Add a TileView for each of tilePositions that does not have one, finding each chunk once """
+        chunks = self.chunks
+        staleChunks = self.staleChunks
+        for tilePosition in tilePositions:
+            chunk = getChunkOf(tilePosition)
+            tileChunk = chunks.get(chunk)
+            if tileChunk is None:
+                tileChunk = chunks[chunk] = TileChunk(chunk)
+            elif tilePosition in tileChunk.tileViews:
+                continue
+            tileChunk.tileViews[tilePosition] = TileView(tilePosition)
+            staleChunks.add(chunk)
+
+    def removeTile(self, tilePosition):
+        chunk = getChunkOf(tilePosition)
+        tileViews = self.chunks[chunk].tileViews
+        del tileViews[tilePosition]
+        if tileViews:
+            self.staleChunks.add(chunk)
+        else:
+            del self.chunks[chunk]
+            self.staleChunks.discard(chunk)
+
+    def hasTile(self, tilePosition):
+        chunk = self.chunks.get(getChunkOf(tilePosition))
+        return chunk is not None and tilePosition in chunk.tileViews
+
+    def drawAt(self, drawOnto, camera, tilePositions=None):
+        """ Draw the chunks of tilePositions, or every chunk, that are within the surface's clip area """
+        if self.edgeLength != camera.edgeLength:
+            # Chunks rendered at the old scale will not be drawn again until it is zoomed back to, so free them
+            for tileChunk in self.chunks.itervalues():
+                tileChunk.surface = None
+            self.edgeLength = camera.edgeLength
+        if tilePositions is None:
+            chunks = self.chunks.keys()
+        else:
+            chunks = set(getChunkOf(tilePosition) for tilePosition in tilePositions)
+        clip = drawOnto.get_clip()
+        for chunk in chunks:
+            tileChunk = self.chunks.get(chunk)
+            if tileChunk is None:
+                continue
+            rect = tileChunk.getRect(camera)
+            if not clip.colliderect(rect):
+                continue
+            if chunk in self.staleChunks or not tileChunk.isRendered(camera):
+                tileChunk.render(camera)
+                self.staleChunks.discard(chunk)
+            drawOnto.blit(tileChunk.surface, rect)
+
+class TextView:
+    def __init__(self, text, colour=None, size=Assets.DEFAULT_FONT_SIZE):
+        self.text = text
+        self.colour = colour if colour is not None else Assets.getColour('WHITE')
+        self.size = size
+
+    def draw(self, drawOnto, camera, center):
+        """ Draw the text centered on a point, scaled with the camera """
+        size = int(round(self.size * camera.scale))
+        if size < MIN_LABEL_SIZE:
+            return
+        surface = Assets.getText(self.text, self.colour, size)
+        boundingBox = surface.get_rect()
+        boundingBox.center = center
+        drawOnto.blit(surface, boundingBox)
+
+class CursorView(object):
+    def __init__(self, camera):
         self.tilePosUnderCursor = None
-        self.setPosition(0,0)
+        self.screenPosition = (0, 0)
+        self.updatePosition(camera)
+
+    def setPosition(self, screenX, screenY, camera):
+        """ Moves to the tile under a screen position """
+        self.screenPosition = (screenX, screenY)
+        self.updatePosition(camera)
 
-    def setPosition(self, screenX, screenY):
-        """ Translates position into position at top left of nearest tile. Does not work if position is already at top left """
-        self.tilePosUnderCursor = HexCoordSys.pixelToHex(HexCoordSys.ScreenCoordinate(screenX, screenY), TILE_EDGE_LENGTH, CENTER)
-        self.boundingBox.center = HexCoordSys.hexToPixel(self.tilePosUnderCursor, TILE_EDGE_LENGTH, CENTER)
+    def updatePosition(self, camera):
+        """ Moves to the tile under the last screen position, for when the camera has changed """
+        self.tilePosUnderCursor = camera.pixelToHex(HexCoordSys.ScreenCoordinate(*self.screenPosition))
+        self.boundingBox = camera.getTileRect(self.tilePosUnderCursor)
+        self.surface = Assets.getImage("./hexcursor.png", self.boundingBox.size)
 
     def getTilePosition(self):
         """ Note that this may not correspond to a tile on the board"""
@@ -105,26 +378,71 @@ class CursorView(object):
 class OverlayView(object):
     def __init__(self, tilePositions, colour):
         self.colour = colour
-        for tilePosition in tilePositions:
-            center = HexCoordSys.hexToPixel(tilePosition, TILE_EDGE_LENGTH, CENTER)
-            self.vertices = list()
-            for i in range(0,6):
-                angle = (2 * math.pi / 6) * (i + 0.5)
-                x_i = center.x + TILE_EDGE_LENGTH * math.cos(angle)
-                y_i = center.y + TILE_EDGE_LENGTH * math.sin(angle)
-                self.vertices.append((x_i, y_i))
+        self.tilePositions = tilePositions
 
-    def draw(self, drawOnto):
-        pygame.gfxdraw.filled_polygon(drawOnto, self.vertices, self.colour)
+    def draw(self, drawOnto, camera):
+        for tilePosition in self.tilePositions:
+            pygame.gfxdraw.filled_polygon(drawOnto, getHexVertices(camera.hexToPixel(tilePosition), camera.edgeLength),
+                                          self.colour)
+
+class OverlayLayer(object):
+    """ Hex overlays for many tiles drawn onto a single transparent surface the size of the window, which is updated as
+    tiles are added and removed. Drawing any area of the overlays is then one blit however many tiles it covers """
+    CLEAR = (0, 0, 0, 0)
+
+    def __init__(self):
+        self.colours = dict()
+        self.surface = None
+        # The camera position and scale the surface was drawn for
+        self.drawnFor = None
+
+    def setTile(self, tilePosition, colour):
+        self.colours[tilePosition] = colour
+        if self.surface is not None:
+            self.drawTile(tilePosition)
+
+    def removeTile(self, tilePosition):
+        if self.colours.pop(tilePosition, None) is not None and self.surface is not None:
+            pygame.draw.polygon(self.surface, self.CLEAR, self.getVertices(tilePosition))
+            # Clearing takes the edges shared with neighbouring overlays with it
+            for neighbour in HexCoordSys.getTilesWithin(1, tilePosition):
+                if neighbour in self.colours:
+                    self.drawTile(neighbour)
+
+    def hasTile(self, tilePosition):
+        return tilePosition in self.colours
+
+    def getVertices(self, tilePosition, center=None):
+        if center is None:
+            center = HexCoordSys.hexToPixel(tilePosition, self.drawnFor[0], self.drawnFor[1])
+        return getHexVertices(center, self.drawnFor[0])
+
+    def drawTile(self, tilePosition, center=None):
+        # Drawn without blending, so overlapping edges take one overlay's colour rather than doubling up
+        pygame.draw.polygon(self.surface, self.colours[tilePosition], self.getVertices(tilePosition, center))
+
+    def drawAt(self, drawOnto, camera, tilePositions=None):
+        """ Draw the overlays within the surface's clip area """
+        if not self.colours:
+            return
+        if self.surface is None or self.drawnFor != (camera.edgeLength, camera.centerPixel):
+            if self.surface is None:
+                self.surface = pygame.Surface((camera.width, camera.height), SRCALPHA, 32)
+            self.surface.fill(self.CLEAR)
+            self.drawnFor = (camera.edgeLength, camera.centerPixel)
+            tilePositions = self.colours.keys()
+            for tilePosition, center in zip(tilePositions, camera.hexToPixels(tilePositions)):
+                self.drawTile(tilePosition, center)
+        clip = drawOnto.get_clip()
+        drawOnto.blit(self.surface, clip, clip)
 
 class PieceView(CommonIdentity):
     def __init__(self, colour, tilePositions):
-        self.positions = set()
-        for tilePosition in tilePositions:
-            self.positions.add(HexCoordSys.hexToPixel(tilePosition, TILE_EDGE_LENGTH, CENTER))
+        self.tilePositions = set(tilePositions)
         self.colour = colour
-        self.radius = int(TILE_EDGE_LENGTH / 2.0)
 
-    def draw(self, drawOnto):
-        for position in self.positions:
-            pygame.gfxdraw.filled_circle(drawOnto, position.x, position.y, self.radius, self.colour)
\ No newline at end of file
+    def draw(self, drawOnto, camera):
+        radius = int(camera.edgeLength / 2.0)
+        for tilePosition in self.tilePositions:
+            position = camera.hexToPixel(tilePosition)
+            pygame.gfxdraw.filled_circle(drawOnto, position.x, position.y, radius, self.colour)
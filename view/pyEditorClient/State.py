@@ -1,10 +1,13 @@
-import logging, sys, uuid
+import logging, sys
 from collections import defaultdict
 
-from thor.view import HexCoordSys
+from thor.view import HexCoordSys, HexTopology
 from thor.view.HexCoordSys import TilePosition
 from graeae.Session import ClientSession
+from graeae.GameState import expandRange
 
+# Tiles added for a board have ids made from this and their position, so creating the same board again changes nothing
+TILE_ID_PREFIX = 'Tile:'
 
 class Board:
     def __init__(self, edgeLength):
@@ -12,35 +15,53 @@ class Board:
         self.diameter = 2 * self.radius
         self.numTilesHigh = self.diameter + 1
         self.numTilesWide = self.diameter + 1
-        print "Creating board", self.numTilesWide, "tiles wide and", self.numTilesHigh, "tiles high"
-        # Initialise the tiles with their position in the axial coordinate system used to define locations on the board
-        self.tilePositions = HexCoordSys.getPositionsDefinedByHexWithEdge(edgeLength)
-        self.numTiles = len(self.tilePositions)
-        print "Created a board containing", self.numTiles, "tiles"
-        self.borders = defaultdict(list)
-        for tilePosition in self.tilePositions:
-            for key in HexCoordSys.borders.keys():
-                if HexCoordSys.borders[key](tilePosition, self.tilePositions):
-                    self.borders[key].append(tilePosition)
+        self.numTiles = 3 * self.radius * (self.radius + 1) + 1
         self.center = TilePosition(row=0, col=0)
-        self.spokes = defaultdict(list)
-        for key in HexCoordSys.edgeDirections.keys():
-            curTile = self.center
-            while self.isOnBoard(curTile):
-                self.spokes[key].append(curTile)
-                curTile = HexCoordSys.edgeDirections[key](curTile)
+        self.topology = None
+        print "Creating board", self.numTilesWide, "tiles wide and", self.numTilesHigh, "tiles high containing", \
+            self.numTiles, "tiles"
+
+    def getAddCommand(self):
+        """ The single AddRange command that adds every tile on the board, which the server and clients expand """
+        return {'type': 'AddRange', 'target': 'Tile', 'idPrefix': TILE_ID_PREFIX,
+                'center': (self.center.row, self.center.col), 'radius': self.radius}
+
+    def iterTiles(self):
+        """ The id and position of every tile on the board in row-major order, generated as needed rather than held """
+        for id, (row, col) in expandRange(self.getAddCommand()):
+            yield id, TilePosition(row=row, col=col)
+
+    def getTopology(self):
+        # Only built for the few uses that need the whole board indexed
+        if self.topology is None:
+            self.topology = HexTopology.getTopologyForRadius(self.radius)
+        return self.topology
+
+    def getBorders(self):
+        topology = self.getTopology()
+        borders = defaultdict(list)
+        for key in HexCoordSys.BORDER_KEYS:
+            borders[key] = topology.positionsOf(topology.getIndicesOnBorder(key))
+        return borders
+
+    def getSpokes(self):
+        topology = self.getTopology()
+        spokes = defaultdict(list)
+        for key in HexCoordSys.EDGE_DIRECTION_KEYS:
+            spokes[key] = topology.positionsOf(topology.getIndicesAlong(key, topology.indexOf(self.center)))
+        return spokes
 
     def isOnBoard(self, tilePosition):
-        return tilePosition in self.tilePositions
+        return HexCoordSys.distanceBetween(self.center, tilePosition) <= self.radius
 
 if __name__ == '__main__':
     if len(sys.argv) > 0:
         logging.basicConfig(level=logging.INFO)
         session = ClientSession()
         board = Board(int(sys.argv[1].strip()))
-        for tilePosition in board.tilePositions:
-            session.addDataToSend(({'type': 'Add', 'target': 'Tile', 'id': str(uuid.uuid4()),
-                                    'tilePosition': (tilePosition.row, tilePosition.col)},))
+        session.addDataToSend(**board.getAddCommand())
+        # The session threads stop when this exits, so wait for the board to go
+        session.waitUntilSent()
 # with open('server.config') as config_file:
 #     forServer.queueNewDataForAll(json.load(config_file)["startCommands"])
 
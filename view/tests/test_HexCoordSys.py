@@ -0,0 +1,51 @@
+import random, unittest
+from thor.view import HexCoordSys
+from thor.view.HexCoordSys import ScreenCoordinate, TilePosition
+
+# Edge lengths the client draws at, including the fractional ones zooming gives, and some arbitrary ones
+EDGE_LENGTHS = (20, 5.0, 20 * 1.25 ** 3, 20 / 1.25 ** 2, 7.3, 33.33)
+
+@unittest.skipIf(HexCoordSys.numpy is None, "The batch conversions need numpy")
+class BatchConversionTest(unittest.TestCase):
+    """ Each batch conversion gives exactly what its scalar function gives for every element """
+    def setUp(self):
+        self.random = random.Random(3)
+
+    def randomCenter(self):
+        return ScreenCoordinate(x=self.random.randint(-500, 500), y=self.random.randint(-500, 500))
+
+    def testHexToPixelBatch(self):
+        for edgeLength in EDGE_LENGTHS:
+            center = self.randomCenter()
+            positions = [TilePosition(row=self.random.randint(-300, 300), col=self.random.randint(-300, 300))
+                         for _ in xrange(2000)]
+            batch = HexCoordSys.hexToPixelBatch(positions, edgeLength, center).tolist()
+            self.assertEqual(batch, [list(HexCoordSys.hexToPixel(position, edgeLength, center))
+                                     for position in positions])
+
+    def testPixelToHexBatch(self):
+        for edgeLength in EDGE_LENGTHS:
+            center = self.randomCenter()
+            pixels = [ScreenCoordinate(x=self.random.randint(-5000, 5000), y=self.random.randint(-5000, 5000))
+                      for _ in xrange(2000)]
+            # Every pixel of a patch around the center, which includes those on the edges between tiles
+            pixels.extend(ScreenCoordinate(x=center.x + dx, y=center.y + dy)
+                          for dx in xrange(-60, 61) for dy in xrange(-60, 61))
+            batch = HexCoordSys.pixelToHexBatch(pixels, edgeLength, center).tolist()
+            self.assertEqual(batch, [list(HexCoordSys.pixelToHex(pixel, edgeLength, center)) for pixel in pixels])
+
+    def testRoundPositionsBatchTies(self):
+        # Positions a half or a third of the way between tiles round exactly as roundPosn breaks the tie
+        positions = [TilePosition(row=row / 6.0, col=col / 6.0) for row in xrange(-30, 31) for col in xrange(-30, 31)]
+        positions.extend(TilePosition(row=self.random.uniform(-50, 50), col=self.random.uniform(-50, 50))
+                         for _ in xrange(2000))
+        batch = HexCoordSys.roundPositionsBatch(positions).tolist()
+        self.assertEqual(batch, [list(position.roundPosn()) for position in positions])
+
+    def testRoundHalfAwayFromZero(self):
+        values = [v / 2.0 for v in xrange(-21, 22)] + [0.49999999999999994, -0.49999999999999994, 2.5000000000000004]
+        self.assertEqual(HexCoordSys.roundHalfAwayFromZero(HexCoordSys.numpy.array(values)).tolist(),
+                         [int(round(value)) for value in values])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import random, unittest
+from thor.view import HexCoordSys, HexVisibility
+from thor.view.HexTopology import HexTopology
+
+def hasLineWalkOfSight(topology, fromIndex, toIndex, blockers):
+    """ Whether no tile between the two on the line getShortestTilePathBetween walks between them is a blocker """
+    path = HexCoordSys.getShortestTilePathBetween(topology.positionOf(fromIndex), topology.positionOf(toIndex))
+    return not any(blockers[topology.indexOf(tilePosition)] for tilePosition in path[1:-1])
+
+class VisibilityTest(unittest.TestCase):
+    """ The shadowcasting sweep sees exactly the tiles a pairwise line walk sees """
+    def setUp(self):
+        self.random = random.Random(5)
+        self.topology = HexTopology(7)
+
+    def randomBlockers(self, density):
+        return bytearray(1 if self.random.random() < density else 0 for _ in xrange(self.topology.numTiles))
+
+    def testNoBlockersSeesEverythingInRadius(self):
+        topology = self.topology
+        blockers = bytearray(topology.numTiles)
+        for sourceIndex in (0, topology.indexOfRowCol(0, 0), topology.numTiles - 1):
+            for radius in (0, 1, 4, 14):
+                self.assertEqual(sorted(HexVisibility.getVisibleIndices(topology, sourceIndex, radius, blockers)),
+                                 sorted(topology.getIndicesWithin(radius, sourceIndex)))
+
+    def testBlockersAreVisibleButHideWhatIsBehind(self):
+        topology = self.topology
+        blockers = bytearray(topology.numTiles)
+        blockers[topology.indexOfRowCol(0, 1)] = 1
+        visible = HexVisibility.getVisibleIndices(topology, topology.indexOfRowCol(0, 0), 7, blockers)
+        self.assertIn(topology.indexOfRowCol(0, 1), visible)
+        for col in xrange(2, 8):
+            self.assertNotIn(topology.indexOfRowCol(0, col), visible)
+
+    def testVisibleIndicesMatchLineWalks(self):
+        topology = self.topology
+        for density in (0.05, 0.15, 0.3):
+            for _ in xrange(15):
+                blockers = self.randomBlockers(density)
+                sourceIndex = self.random.randrange(topology.numTiles)
+                radius = self.random.randint(1, 14)
+                visible = HexVisibility.getVisibleIndices(topology, sourceIndex, radius, blockers)
+                self.assertEqual(len(visible), len(set(visible)))
+                self.assertEqual(sorted(visible),
+                                 [toIndex for toIndex in sorted(topology.getIndicesWithin(radius, sourceIndex))
+                                  if hasLineWalkOfSight(topology, sourceIndex, toIndex, blockers)])
+
+    def testHaveLineOfSightMatchesLineWalks(self):
+        topology = self.topology
+        blockers = self.randomBlockers(0.15)
+        # Several pairs share each source, so each is swept once for all of its targets
+        sources = [self.random.randrange(topology.numTiles) for _ in xrange(10)]
+        indexPairs = [(self.random.choice(sources), self.random.randrange(topology.numTiles)) for _ in xrange(500)]
+        self.assertEqual(HexVisibility.haveLineOfSight(topology, indexPairs, blockers),
+                         [hasLineWalkOfSight(topology, fromIndex, toIndex, blockers)
+                          for fromIndex, toIndex in indexPairs])
+        fromIndex, toIndex = indexPairs[0]
+        self.assertEqual(HexVisibility.hasLineOfSight(topology, fromIndex, toIndex, blockers),
+                         hasLineWalkOfSight(topology, fromIndex, toIndex, blockers))
+
+    def testLinesBetweenTiles(self):
+        # The line from 0,0 to 1,1 passes exactly between 0,1 and 1,0, and is rounded through 0,1
+        topology = self.topology
+        sourceIndex = topology.indexOfRowCol(0, 0)
+        toIndex = topology.indexOfRowCol(1, 1)
+        for blockedPosition, expected in (((0, 1), False), ((1, 0), True)):
+            blockers = bytearray(topology.numTiles)
+            blockers[topology.indexOfRowCol(*blockedPosition)] = 1
+            self.assertEqual(hasLineWalkOfSight(topology, sourceIndex, toIndex, blockers), expected)
+            self.assertEqual(HexVisibility.hasLineOfSight(topology, sourceIndex, toIndex, blockers), expected)
+
+if __name__ == '__main__':
+    unittest.main()